@@ -0,0 +1,693 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    BuildDaemon - An optional per-user daemon which builds envs and installs packages on behalf of every process on the host.
+
+      Identical requests in flight (same env, same requirements) are merged into one build, requests are run in
+        priority order (the on-demand importer before foreground builds, before background upgrades), and the daemon
+        keeps warm state between builds (imported modules, the host pip version, open package stores).
+
+      Start the daemon:
+
+        python -m VirtualEnvOnDemand daemon [--socket PATH] [--workers N]
+
+      And have a process use it:
+
+        VirtualEnvOnDemand.setBuildDaemon()
+
+      After which createEnv and installPackages (and so setupAndActivateEnv and the on-demand importer) send their work to
+        the daemon, relaying its output to the given stdout/stderr. If the daemon is not running (or goes away), they
+        build in-process exactly as before. Requests using an "installer" backend object are always run in-process.
+
+      Requests and responses are length-prefixed JSON over a Unix domain socket, which is only accessible by its owner.
+        Clients only use a daemon run by the same user.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import heapq
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+
+from .Requirements import getRequirementsKey
+from .exceptions import PipInstallFailed, PipInstallTimedOut, VirtualEnvDoesNotExist, BuildDaemonError, InvalidRequirement, RequirementConflict
+
+__all__ = ('BuildDaemon', 'setBuildDaemon', 'getBuildDaemon', 'getDefaultSocketPath', 'buildPriority', 'getBuildPriority',
+    'requestCreateEnv', 'requestInstallPackages', 'pingBuildDaemon',
+    'PRIORITY_INTERACTIVE', 'PRIORITY_NORMAL', 'PRIORITY_BACKGROUND',
+)
+
+# Request priorities. Lower runs first.
+
+# PRIORITY_INTERACTIVE - Something is blocked on this right now (e.x. an import)
+PRIORITY_INTERACTIVE = 0
+# PRIORITY_NORMAL - Default, e.x. createEnv
+PRIORITY_NORMAL = 10
+# PRIORITY_BACKGROUND - Nothing is waiting on this, e.x. a background upgrade
+PRIORITY_BACKGROUND = 20
+
+# DAEMON_PROTOCOL_VERSION - Bumped on incompatible changes to requests/responses
+DAEMON_PROTOCOL_VERSION = 1
+
+# MAX_RELAYED_OUTPUT - Maximum bytes of a build's stdout/stderr relayed back to the client (the tail is kept)
+MAX_RELAYED_OUTPUT = 65536
+
+_HEADER = struct.Struct('>I')
+
+# The daemon used by this process, @see setBuildDaemon
+global _daemonPolicy
+_daemonPolicy = { 'socketPath' : None, 'connectTimeout' : 0.5 }
+
+# _priorityLocal.priority - Priority of requests sent from this thread, @see buildPriority
+_priorityLocal = threading.local()
+
+# _workerLocal.isDaemonWorker - True on the daemon's own worker threads, which must build in-process
+_workerLocal = threading.local()
+
+
+def getDefaultSocketPath():
+    '''
+        getDefaultSocketPath - Get the default path of the daemon's socket. There is one daemon per user.
+
+            The socket is in XDG_RUNTIME_DIR when it is set (and is private to this user), otherwise in a private (0700)
+              per-user directory within the system temporary directory, which the daemon creates.
+
+        @return <str>
+    '''
+    runtimeDir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtimeDir and _isPrivateDirectory(runtimeDir):
+        return os.sep.join([runtimeDir, 'VirtualEnvOnDemand_daemon.sock'])
+
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.sep.join([tempfile.gettempdir(), 'VirtualEnvOnDemand_daemon_%d' %(uid,), 'daemon.sock'])
+
+
+def _isPrivateDirectory(directory):
+    '''
+        _isPrivateDirectory - Check that a directory is owned by this user, and not accessible by anyone else
+    '''
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return False
+    if not hasattr(os, 'getuid'):
+        return True
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not (st.st_mode & 0o077)
+
+
+def _ensurePrivateDirectory(directory):
+    '''
+        _ensurePrivateDirectory - Create the directory holding the daemon's socket, accessible only by this user
+
+        @raises ValueError - If it already exists, but is owned by someone else, or accessible by others
+    '''
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if not _isPrivateDirectory(directory):
+        raise ValueError('Refusing to use "%s" for the build daemon socket: it must be a directory owned by this user, with mode 0700.' %(directory,))
+
+
+def _isOwnDaemon(sock, socketPath):
+    '''
+        _isOwnDaemon - Check that a daemon socket belongs to this user, so another user cannot answer in place of the daemon
+          (e.x. with an env of their choosing, which would then be activated).
+
+            On Linux the credentials of the process listening on the connected #sock are checked (SO_PEERCRED),
+              elsewhere the owner of the socket file.
+
+        @return <bool>
+    '''
+    if not hasattr(os, 'getuid'):
+        return True
+
+    peerCredOption = getattr(socket, 'SO_PEERCRED', None)
+    if peerCredOption is not None:
+        try:
+            (pid, uid, gid) = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, peerCredOption, struct.calcsize('3i')))
+        except (socket.error, OSError):
+            return False
+        return uid == os.getuid()
+
+    try:
+        return os.stat(socketPath).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+def setBuildDaemon(socketPath=True, connectTimeout=0.5):
+    '''
+        setBuildDaemon - Send builds and installs from this process to the build daemon, when it is running
+
+            @param socketPath <bool/str/None> Default True - True to use the daemon at the default path (@see getDefaultSocketPath),
+                                                     a str path to use another daemon, or None/False to always build in-process.
+            @param connectTimeout <float> Default 0.5 - Seconds to wait to connect before building in-process instead
+
+            @return <dict> - The previous setting
+    '''
+    global _daemonPolicy
+
+    if socketPath is True:
+        socketPath = getDefaultSocketPath()
+    if socketPath and not hasattr(socket, 'AF_UNIX'):
+        raise ValueError('The build daemon requires Unix domain sockets, which are not available on this platform.')
+
+    oldPolicy = _daemonPolicy
+    _daemonPolicy = { 'socketPath' : socketPath or None, 'connectTimeout' : connectTimeout }
+    return oldPolicy
+
+
+def getBuildDaemon():
+    '''
+        getBuildDaemon - Get the build daemon setting of this process. @see setBuildDaemon
+
+        @return <dict>
+    '''
+    return dict(_daemonPolicy)
+
+
+class buildPriority(object):
+    '''
+        buildPriority - Context manager which sets the priority of build daemon requests made by this thread
+
+            with buildPriority(PRIORITY_BACKGROUND):
+                createEnv(...)
+    '''
+
+    def __init__(self, priority):
+        self.priority = priority
+        self._oldPriority = None
+
+    def __enter__(self):
+        self._oldPriority = getattr(_priorityLocal, 'priority', None)
+        _priorityLocal.priority = self.priority
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        _priorityLocal.priority = self._oldPriority
+
+
+def getBuildPriority():
+    '''
+        getBuildPriority - Get the priority of build daemon requests made by this thread
+
+        @return <int>
+    '''
+    priority = getattr(_priorityLocal, 'priority', None)
+    return PRIORITY_NORMAL if priority is None else priority
+
+
+def _sendMessage(sock, obj):
+    data = json.dumps(obj).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recvExactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1048576))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recvMessage(sock):
+    '''
+        _recvMessage - Receive a length-prefixed JSON message
+
+        @return - The message, or None if the connection was closed
+    '''
+    header = _recvExactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    data = _recvExactly(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def _encodeError(e):
+    return { 'type' : e.__class__.__name__, 'message' : str(e), 'returnCode' : getattr(e, 'returnCode', None),
+        'timeout' : getattr(e, 'timeout', None), 'reqFileContents' : getattr(e, 'reqFileContents', None),
+        'requirement' : getattr(e, 'requirement', None), 'name' : getattr(e, 'name', None), 'specifiers' : getattr(e, 'specifiers', None),
+        'reason' : getattr(e, 'reason', None) }
+
+
+def _decodeError(error):
+    '''
+        _decodeError - Rebuild an exception raised by a build in the daemon, so callers see the same exceptions as an in-process build
+    '''
+    errorType = error.get('type')
+    if errorType == 'PipInstallTimedOut':
+        return PipInstallTimedOut(error.get('timeout'), error.get('reqFileContents') or '')
+    if errorType == 'PipInstallFailed':
+        return PipInstallFailed(error.get('returnCode'), error.get('reqFileContents') or '')
+    if errorType == 'VirtualEnvDoesNotExist':
+        return VirtualEnvDoesNotExist(error.get('message'))
+    if errorType == 'InvalidRequirement':
+        return InvalidRequirement(error.get('requirement') or '', error.get('reason') or '')
+    if errorType == 'RequirementConflict':
+        return RequirementConflict(error.get('name') or '', error.get('specifiers') or [], error.get('reason') or '')
+    if errorType == 'ValueError':
+        return ValueError(error.get('message'))
+    return BuildDaemonError(errorType, error.get('message'))
+
+
+def _sendRequest(socketPath, connectTimeout, request):
+    '''
+        _sendRequest - Send a request to the build daemon, and wait for its response
+
+        @return <dict/None> - The response, or None if the daemon is not running, or went away before responding
+    '''
+    if not os.path.exists(socketPath):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.settimeout(connectTimeout)
+            sock.connect(socketPath)
+            if not _isOwnDaemon(sock, socketPath):
+                sys.stderr.write('Ignoring build daemon socket "%s", which is not owned by this user.\n' %(socketPath,))
+                return None
+            # Builds take as long as they take
+            sock.settimeout(None)
+            request['version'] = DAEMON_PROTOCOL_VERSION
+            _sendMessage(sock, request)
+            response = _recvMessage(sock)
+        except (socket.error, OSError, ValueError):
+            return None
+    finally:
+        sock.close()
+
+    if not response or response.get('version') != DAEMON_PROTOCOL_VERSION:
+        return None
+    return response
+
+
+def _getAbsolutePath(path):
+    '''
+        _getAbsolutePath - Resolve a path argument against our working directory, as the daemon has its own.
+          Anything which is not a path (None, True for a default lock file, "" to disable it) is returned as-is.
+    '''
+    if not path or not isinstance(path, str):
+        return path
+    return os.path.abspath(path)
+
+
+def _getPackageStoreArgs(packageStore):
+    if packageStore is None or isinstance(packageStore, str):
+        return _getAbsolutePath(packageStore)
+    return [_getAbsolutePath(packageStore.storeDirectory), packageStore.linkMode]
+
+
+def _relayOutput(response, stdout, stderr):
+    for (streamName, stream) in ( ('stdout', stdout), ('stderr', stderr) ):
+        if stream is not None and response.get(streamName):
+            stream.write(response[streamName])
+
+
+def _request(operation, arguments, stdout, stderr):
+    '''
+        _request - Run an operation on the build daemon
+
+        @return <dict/None> - The result, or None if the daemon is not in use or not available (so the caller should build in-process)
+
+        @raises - Whatever the build raised in the daemon, @see _decodeError
+    '''
+    policy = _daemonPolicy
+    if not policy['socketPath'] or getattr(_workerLocal, 'isDaemonWorker', False):
+        return None
+
+    response = _sendRequest(policy['socketPath'], policy['connectTimeout'], { 'operation' : operation, 'arguments' : arguments, 'priority' : getBuildPriority() })
+    if response is None:
+        return None
+
+    _relayOutput(response, stdout, stderr)
+    if response.get('error'):
+        raise _decodeError(response['error'])
+    return response.get('result')
+
+
+def requestCreateEnv(reqContents, parentDirectory, name, stdout, stderr, packageStore=None, lockFile=None, pythonExecutable=None, withPip=True, slim=False):
+    '''
+        requestCreateEnv - Have the build daemon create an env. @see VirtualEnvOnDemand.CreateEnv.createEnv
+
+            The env is never deleted by the daemon, nor activated. That is up to the caller.
+
+        @return <str/None> - The virtualenv directory, or None if the daemon is not available (so the caller should build in-process)
+    '''
+    if not isinstance(packageStore, (str, type(None))) and not hasattr(packageStore, 'storeDirectory'):
+        return None
+    if pythonExecutable and os.sep in pythonExecutable:
+        # Otherwise a name looked up on the PATH
+        pythonExecutable = os.path.abspath(pythonExecutable)
+    arguments = { 'packages' : reqContents, 'parentDirectory' : _getAbsolutePath(parentDirectory), 'name' : name,
+        'packageStore' : _getPackageStoreArgs(packageStore), 'lockFile' : _getAbsolutePath(lockFile), 'pythonExecutable' : pythonExecutable,
+        'withPip' : withPip, 'slim' : slim }
+    result = _request('createEnv', arguments, stdout, stderr)
+    if result is None:
+        return None
+    return result['virtualenvDirectory']
+
+
+def requestInstallPackages(reqContents, venvDir, stdout, stderr, packageStore=None, lockFile=None, timeout=None, retries=None):
+    '''
+        requestInstallPackages - Have the build daemon install packages. @see VirtualEnvOnDemand.InstallPackages.installPackages
+
+        @return <bool> - True if installed by the daemon, False if the daemon is not available (so the caller should install in-process)
+    '''
+    if not isinstance(packageStore, (str, type(None))) and not hasattr(packageStore, 'storeDirectory'):
+        return False
+    arguments = { 'packages' : reqContents, 'venvDir' : os.path.realpath(venvDir), 'packageStore' : _getPackageStoreArgs(packageStore),
+        'lockFile' : _getAbsolutePath(lockFile), 'timeout' : timeout, 'retries' : retries }
+    return _request('installPackages', arguments, stdout, stderr) is not None
+
+
+def pingBuildDaemon(socketPath=True):
+    '''
+        pingBuildDaemon - Check whether a build daemon is running
+
+        @param socketPath <bool/str> Default True - True for the default daemon, or a str path to its socket
+
+        @return <dict/None> - The daemon's status (pid, counts of requests, merged requests, queued and running builds), or None if not running
+    '''
+    if socketPath is True:
+        socketPath = getDefaultSocketPath()
+    response = _sendRequest(socketPath, _daemonPolicy['connectTimeout'], { 'operation' : 'ping' })
+    return response and response.get('result')
+
+
+def _readTail(f):
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(max(0, size - MAX_RELAYED_OUTPUT))
+    return f.read().decode('utf-8', 'replace')
+
+
+class _Job(object):
+    '''
+        _Job - One build in the daemon, and every request which has been merged into it
+    '''
+
+    def __init__(self, key, operation, arguments, priority):
+        self.key = key
+        self.operation = operation
+        self.arguments = arguments
+        self.priority = priority
+        self.isStarted = False
+        self.response = None
+        self.doneEvent = threading.Event()
+
+
+class BuildDaemon(object):
+    '''
+        BuildDaemon - Serves build and install requests from other processes. @see module documentation
+    '''
+
+    def __init__(self, socketPath=None, numWorkers=2):
+        '''
+            @param socketPath <str/None> Default None - Path of the socket to listen on. Default is getDefaultSocketPath()
+            @param numWorkers <int> Default 2 - Number of builds run at once. Host-wide limits still apply, @see VirtualEnvOnDemand.ResourcePolicy
+        '''
+        self.socketPath = socketPath or getDefaultSocketPath()
+        self.numWorkers = numWorkers
+
+        self._listenSocket = None
+        self._threads = []
+        self._isShutdown = False
+
+        # _lock guards everything below
+        self._lock = threading.Lock()
+        self._queueCondition = threading.Condition(self._lock)
+        self._queue = []
+        self._queueCounter = 0
+        self._inFlight = {}
+        self._packageStores = {}
+        self.stats = { 'requests' : 0, 'merged' : 0, 'running' : 0 }
+
+    def start(self):
+        '''
+            start - Start listening, and serving requests on background threads
+
+            @raises ValueError - If another daemon is already listening on the socket, or the default socket's directory is not private
+        '''
+        if self.socketPath == getDefaultSocketPath():
+            _ensurePrivateDirectory(os.path.dirname(self.socketPath))
+        if os.path.exists(self.socketPath):
+            if pingBuildDaemon(self.socketPath):
+                raise ValueError('A build daemon is already running on "%s".' %(self.socketPath,))
+            # Left behind by a daemon which did not shutdown cleanly
+            os.unlink(self.socketPath)
+
+        self._listenSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        oldUmask = os.umask(0o077)
+        try:
+            self._listenSocket.bind(self.socketPath)
+        finally:
+            os.umask(oldUmask)
+        self._listenSocket.listen(64)
+
+        # Warm up, so the first build does not pay for it
+        from .RunPip import getHostPipVersion
+        getHostPipVersion()
+
+        self._threads = [ threading.Thread(target=self._acceptLoop, name='VirtualEnvOnDemand-daemon-accept') ]
+        self._threads += [ threading.Thread(target=self._workerLoop, name='VirtualEnvOnDemand-daemon-worker-%d' %(i,)) for i in range(self.numWorkers) ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def serveForever(self):
+        '''
+            serveForever - Start (if not already started), and serve until shutdown is called (or KeyboardInterrupt)
+        '''
+        if self._listenSocket is None:
+            self.start()
+        try:
+            while not self._isShutdown:
+                self._threads[0].join(1.0)
+                if not self._threads[0].is_alive():
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        '''
+            shutdown - Stop accepting requests, and remove the socket. Builds already running are not interrupted.
+        '''
+        with self._lock:
+            if self._isShutdown:
+                return
+            self._isShutdown = True
+            self._queueCondition.notify_all()
+
+        try:
+            self._listenSocket.close()
+        except Exception:
+            pass
+        try:
+            os.unlink(self.socketPath)
+        except OSError:
+            pass
+
+    def getStatus(self):
+        '''
+            getStatus - Get counts of requests served, requests merged into an identical build in flight, and builds queued and running
+
+            @return <dict>
+        '''
+        with self._lock:
+            return dict(self.stats, pid=os.getpid(), queued=len([ job for job in self._inFlight.values() if not job.isStarted ]))
+
+    def _acceptLoop(self):
+        while not self._isShutdown:
+            try:
+                (clientSocket, _) = self._listenSocket.accept()
+            except (socket.error, OSError):
+                if self._isShutdown:
+                    return
+                continue
+            thread = threading.Thread(target=self._handleConnection, args=(clientSocket,))
+            thread.daemon = True
+            thread.start()
+
+    def _handleConnection(self, clientSocket):
+        try:
+            request = _recvMessage(clientSocket)
+            if not request:
+                return
+
+            if request.get('version') != DAEMON_PROTOCOL_VERSION:
+                response = { 'error' : _encodeError(BuildDaemonError('ProtocolError', 'Unsupported protocol version %s' %(str(request.get('version')),))) }
+            elif request.get('operation') == 'ping':
+                response = { 'result' : self.getStatus() }
+            elif request.get('operation') in ('createEnv', 'installPackages'):
+                job = self._submit(request['operation'], request.get('arguments') or {}, request.get('priority', PRIORITY_NORMAL))
+                job.doneEvent.wait()
+                response = job.response
+            else:
+                response = { 'error' : _encodeError(BuildDaemonError('ProtocolError', 'Unknown operation "%s"' %(str(request.get('operation')),))) }
+
+            response = dict(response, version=DAEMON_PROTOCOL_VERSION)
+            _sendMessage(clientSocket, response)
+        except (socket.error, OSError, ValueError):
+            # Client went away, or sent garbage
+            pass
+        finally:
+            clientSocket.close()
+
+    @staticmethod
+    def _getJobKey(operation, arguments):
+        '''
+            _getJobKey - Requests with the same key are the same build, and are merged while in flight
+
+            @return <str/None> - The key, or None if the request must not be merged (a createEnv with a random name)
+        '''
+        if operation == 'createEnv' and not arguments.get('name'):
+            return None
+        keyArguments = dict(arguments, packages=getRequirementsKey(arguments.get('packages') or ''))
+        return json.dumps([operation, keyArguments], sort_keys=True)
+
+    def _submit(self, operation, arguments, priority):
+        key = self._getJobKey(operation, arguments)
+        with self._lock:
+            self.stats['requests'] += 1
+            job = self._inFlight.get(key) if key is not None else None
+            if job is not None:
+                self.stats['merged'] += 1
+                if priority < job.priority and not job.isStarted:
+                    # Jump the queue. The old entry is skipped when popped.
+                    job.priority = priority
+                    self._pushJob(job)
+                return job
+
+            job = _Job(key, operation, arguments, priority)
+            if self._isShutdown:
+                job.response = { 'error' : _encodeError(BuildDaemonError('ShuttingDown', 'The build daemon is shutting down')) }
+                job.doneEvent.set()
+                return job
+            if key is not None:
+                self._inFlight[key] = job
+            self._pushJob(job)
+            return job
+
+    def _pushJob(self, job):
+        self._queueCounter += 1
+        heapq.heappush(self._queue, (job.priority, self._queueCounter, job))
+        self._queueCondition.notify()
+
+    def _workerLoop(self):
+        _workerLocal.isDaemonWorker = True
+        while True:
+            with self._lock:
+                job = None
+                while job is None:
+                    while not self._queue and not self._isShutdown:
+                        self._queueCondition.wait()
+                    if self._isShutdown:
+                        return
+                    (priority, _, job) = heapq.heappop(self._queue)
+                    if job.isStarted or priority != job.priority:
+                        # Already run, or re-queued at a higher priority
+                        job = None
+                job.isStarted = True
+                self.stats['running'] += 1
+
+            try:
+                job.response = self._runJob(job)
+            finally:
+                with self._lock:
+                    self.stats['running'] -= 1
+                    if job.key is not None:
+                        self._inFlight.pop(job.key, None)
+                job.doneEvent.set()
+
+    def _getPackageStore(self, packageStoreArgs):
+        if not isinstance(packageStoreArgs, list):
+            return packageStoreArgs
+
+        from .PackageStore import PackageStore
+        key = tuple(packageStoreArgs)
+        with self._lock:
+            if key not in self._packageStores:
+                self._packageStores[key] = PackageStore(*packageStoreArgs)
+            return self._packageStores[key]
+
+    def _runJob(self, job):
+        '''
+            _runJob - Run a build in this process
+
+            @return <dict> - The response, with the build's output
+        '''
+        from .CreateEnv import createEnv
+        from .InstallPackages import installPackages
+
+        arguments = job.arguments
+        stdout = tempfile.TemporaryFile()
+        stderr = tempfile.TemporaryFile()
+        try:
+            try:
+                packageStore = self._getPackageStore(arguments.get('packageStore'))
+                if job.operation == 'createEnv':
+                    venvInfo = createEnv(arguments.get('packages'), arguments['parentDirectory'], arguments.get('name'), stdout, stderr, deleteOnClose=False,
+                        activateEnvironment=False, packageStore=packageStore, lockFile=arguments.get('lockFile'),
+                        pythonExecutable=arguments.get('pythonExecutable'), withPip=arguments.get('withPip', True), slim=arguments.get('slim', False))
+                    response = { 'result' : { 'virtualenvDirectory' : venvInfo['virtualenvDirectory'], 'sitePackagesDirectory' : venvInfo['sitePackagesDirectory'] } }
+                else:
+                    installPackages(arguments.get('packages'), arguments['venvDir'], stdout, stderr, packageStore=packageStore,
+                        lockFile=arguments.get('lockFile'), timeout=arguments.get('timeout'), retries=arguments.get('retries'))
+                    response = { 'result' : { 'venvDir' : arguments['venvDir'] } }
+            except Exception as e:
+                response = { 'error' : _encodeError(e) }
+
+            response['stdout'] = _readTail(stdout)
+            response['stderr'] = _readTail(stderr)
+        finally:
+            stdout.close()
+            stderr.close()
+
+        return response
+
+
+def main(argv):
+    '''
+        main - Run the build daemon until interrupted
+
+        @param argv list<str> - Command line arguments, excluding the program name
+
+        @return <int> - Exit code
+    '''
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(prog='python -m VirtualEnvOnDemand daemon', description='Build envs and install packages on behalf of every process of this user.')
+    parser.add_argument('--socket', dest='socketPath', default=None, help='Path of the socket to listen on. Default: %s' %(getDefaultSocketPath(),))
+    parser.add_argument('--workers', dest='numWorkers', type=int, default=2, help='Number of builds to run at once. Default: 2')
+    args = parser.parse_args(argv)
+
+    daemon = BuildDaemon(args.socketPath, args.numWorkers)
+    try:
+        daemon.start()
+    except ValueError as e:
+        sys.stderr.write('%s\n' %(str(e),))
+        return 1
+
+    # Remove the socket on SIGTERM as well
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    sys.stderr.write('VirtualEnvOnDemand build daemon (pid %d) listening on "%s"\n' %(os.getpid(), daemon.socketPath))
+    daemon.serveForever()
+    return 0
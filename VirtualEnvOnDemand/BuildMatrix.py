@@ -0,0 +1,136 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    BuildMatrix - Build the same set of packages into one virtualenv per python interpreter, in parallel.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import threading
+
+from .CreateEnv import createEnv
+from .ProcessUtils import runProcessGetOutput
+
+__all__ = ('EnvBuildResult', 'getInterpreterVersion', 'buildEnvMatrix')
+
+
+class EnvBuildResult(object):
+    '''
+        EnvBuildResult - The outcome of building an env for one interpreter within buildEnvMatrix
+    '''
+
+    __slots__ = ('pythonExecutable', 'pythonVersion', 'virtualenvInfo', 'error')
+
+    def __init__(self, pythonExecutable, pythonVersion=None, virtualenvInfo=None, error=None):
+        '''
+            @param pythonExecutable <str> - The interpreter the env was built for
+            @param pythonVersion <str/None> - The "major.minor" version of #pythonExecutable, or None if it could not be determined
+            @param virtualenvInfo <VirtualEnvInfo/None> - The built env, or None on failure
+            @param error <Exception/None> - The exception which caused the build to fail, or None on success
+        '''
+        self.pythonExecutable = pythonExecutable
+        self.pythonVersion = pythonVersion
+        self.virtualenvInfo = virtualenvInfo
+        self.error = error
+
+    @property
+    def success(self):
+        return self.error is None and self.virtualenvInfo is not None
+
+    def __repr__(self):
+        if self.success:
+            return 'EnvBuildResult(%s [%s] -> "%s")' %(self.pythonExecutable, self.pythonVersion, self.virtualenvInfo.virtualenvDirectory)
+        return 'EnvBuildResult(%s [%s] FAILED: %s)' %(self.pythonExecutable, str(self.pythonVersion), str(self.error))
+
+
+def getInterpreterVersion(pythonExecutable):
+    '''
+        getInterpreterVersion - Get the "major.minor" version of a python interpreter
+
+        @param pythonExecutable <str> - Path to (or name on PATH of) a python interpreter
+
+        @return <str> - The version, e.x. "3.11"
+
+        @raises ValueError - If the interpreter could not be run
+    '''
+    try:
+        (returnCode, output) = runProcessGetOutput([pythonExecutable, '-c', 'import sys; sys.stdout.write("%d.%d" %(sys.version_info[0], sys.version_info[1]))'])
+    except OSError as e:
+        raise ValueError('Cannot run python interpreter "%s": %s' %(pythonExecutable, str(e)))
+
+    if returnCode != 0 or not output.strip():
+        raise ValueError('Cannot determine version of python interpreter "%s" (ret=%d)' %(pythonExecutable, returnCode))
+
+    return output.strip()
+
+
+def buildEnvMatrix(packages, pythonExecutables, parentDirectory, name, maxWorkers=None, stdout=None, stderr=None, packageStore=None, lockFile=None, installer=None, withPip=True):
+    '''
+        buildEnvMatrix - Build one virtualenv per interpreter, all with the same #packages, in parallel.
+
+            Each env is created at "parentDirectory/name-pyX.Y", laid out for its own interpreter version.
+
+            The envs are not activated, as they are generally for interpreters other than the running one.
+
+        @param packages <list/dict/str> - The packages to install in each env. @see VirtualEnvOnDemand.CreateEnv.createEnv
+        @param pythonExecutables list<str> - Paths to the python interpreters to build for
+        @param parentDirectory <str> - Directory in which to create the envs
+        @param name <str> - Base name of the envs. The interpreter version is appended.
+        @param maxWorkers <int/None> Default None - Maximum number of envs to build at once. Default is all at once.
+        @param stdout <iostream/None> Default None - Stream to be used as stdout for installation. Output of parallel builds will be interleaved.
+        @param stderr <iostream/None> Default None - Stream to be used as stderr for installation. Output of parallel builds will be interleaved.
+        @param packageStore <None/str/PackageStore> Default None - @see VirtualEnvOnDemand.CreateEnv.createEnv
+        @param lockFile <None/bool/str> Default None - @see VirtualEnvOnDemand.CreateEnv.createEnv
+                        A str path has "-pyX.Y" appended per interpreter, as each interpreter resolves to different pins.
+        @param installer <None/InstallerBackend> Default None - @see VirtualEnvOnDemand.CreateEnv.createEnv
+        @param withPip <bool> Default True - @see VirtualEnvOnDemand.CreateEnv.createEnv
+
+        @return list<EnvBuildResult> - One result per #pythonExecutables , in the same order. Failures do not affect the other builds,
+                                          and are reported in the "error" of that interpreter's result.
+    '''
+    results = [ EnvBuildResult(pythonExecutable) for pythonExecutable in pythonExecutables ]
+
+    # Determine versions up-front, so two interpreters of the same version do not race to build the same env
+    seenVersions = {}
+    for result in results:
+        try:
+            result.pythonVersion = getInterpreterVersion(result.pythonExecutable)
+        except ValueError as e:
+            result.error = e
+            continue
+        if result.pythonVersion in seenVersions:
+            result.error = ValueError('Interpreter "%s" is the same version (%s) as "%s", which is already being built.' %(result.pythonExecutable, result.pythonVersion, seenVersions[result.pythonVersion]))
+        else:
+            seenVersions[result.pythonVersion] = result.pythonExecutable
+
+    pending = [ result for result in results if result.error is None ]
+    pendingLock = threading.Lock()
+
+    def _worker():
+        while True:
+            with pendingLock:
+                if not pending:
+                    return
+                result = pending.pop(0)
+
+            envLockFile = lockFile
+            if lockFile and lockFile is not True:
+                envLockFile = '%s-py%s' %(lockFile, result.pythonVersion)
+
+            try:
+                result.virtualenvInfo = createEnv(packages=packages, parentDirectory=parentDirectory, name='%s-py%s' %(name, result.pythonVersion),
+                    stdout=stdout, stderr=stderr, deleteOnClose=False, activateEnvironment=False,
+                    packageStore=packageStore, lockFile=envLockFile, pythonExecutable=result.pythonExecutable, installer=installer, withPip=withPip)
+            except Exception as e:
+                result.error = e
+
+    numWorkers = len(pending)
+    if maxWorkers:
+        numWorkers = min(numWorkers, maxWorkers)
+
+    threads = [ threading.Thread(target=_worker, name='VirtualEnvOnDemand-matrix-%d' %(i,)) for i in range(numWorkers) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
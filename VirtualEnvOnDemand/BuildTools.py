@@ -0,0 +1,308 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    BuildTools - Build requirements which only ship as sdists in a persistent, shared build-tools env, and cache the wheels built.
+
+      For every sdist it installs, pip normally creates a fresh isolated build env and downloads setuptools and wheel into it,
+        which is often the slowest part of an install. SdistBuildInstaller instead keeps one build-tools env per interpreter
+        (and set of build requirements), builds sdists against it with "--no-build-isolation", and keeps the wheels built
+        in a cache keyed by the sha256 of the sdist. Installing the same sdist again skips both the build env and the build.
+
+      Example:
+
+        from VirtualEnvOnDemand.BuildTools import SdistBuildInstaller
+
+        installPackages('some-sdist-only-package', venvDir, installer=SdistBuildInstaller('/var/cache/myapp/builds'))
+
+      Layout of the cache directory:
+
+        <cacheDirectory>/envs/<key>/                   - The build-tools envs
+        <cacheDirectory>/locks/<key>/                  - Held while a build-tools env is being created
+        <cacheDirectory>/wheels/<key>/<sdist sha256>/  - The wheel built from each sdist
+
+      Where <key> identifies the python version and platform.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import hashlib
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+from .CreateEnv import createEnv
+from .Installers import PipInstaller
+from .VirtualEnvInfo import VirtualEnvInfo
+from .RunPip import runPip, writeRequirementsFile
+from .PackageStore import _hardlinkFile
+from .ResourcePolicy import HostSemaphore
+from .Metrics import SDIST_BUILDS
+from .utils import ensureDirectory, writeStrToFile
+
+__all__ = ('SdistBuildInstaller', 'DEFAULT_BUILD_REQUIREMENTS', 'DEFAULT_BUILD_CACHE_DIRECTORY', 'BUILD_TOOLS_ENV_VERSION')
+
+# DEFAULT_BUILD_REQUIREMENTS - Installed into the build-tools env. Enough for most setuptools-based sdists.
+DEFAULT_BUILD_REQUIREMENTS = 'setuptools\nwheel'
+
+# DEFAULT_BUILD_CACHE_DIRECTORY - Where the build-tools envs and wheels are kept, unless "cacheDirectory" is given.
+#   Per user, as wheels found in the cache are installed as-is.
+DEFAULT_BUILD_CACHE_DIRECTORY = os.sep.join([os.environ.get('XDG_CACHE_HOME') or os.sep.join([os.path.expanduser('~'), '.cache']),
+    'VirtualEnvOnDemand', 'build_cache'])
+
+# BUILD_TOOLS_ENV_VERSION - Part of the key of every build-tools env. Increase to have them all rebuilt.
+BUILD_TOOLS_ENV_VERSION = 1
+
+# BUILD_TOOLS_MARKER_FILENAME - Written into a build-tools env once it is complete, holding its build requirements
+BUILD_TOOLS_MARKER_FILENAME = '.VirtualEnvOnDemand_BuildTools'
+
+# SDIST_EXTENSIONS - Archive extensions pip downloads sdists as
+SDIST_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.tar', '.zip')
+
+
+def _hashSdist(path):
+    '''
+        _hashSdist - Get the hex sha256 of a downloaded sdist
+    '''
+    hashObj = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda : f.read(1048576), b''):
+            hashObj.update(block)
+    return hashObj.hexdigest()
+
+
+def _ensureCacheDirectory(directory):
+    '''
+        _ensureCacheDirectory - Create the cache directory (mode 0700) if missing, and check no one else can plant wheels in it
+
+        @return <str> - #directory
+
+        @raises ValueError - If it is not owned by this user, or is writable by others
+    '''
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(directory):
+            raise
+
+    if hasattr(os, 'getuid'):
+        st = os.stat(directory)
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            raise ValueError('Refusing to use "%s" as the build cache: it must be owned by this user, and not writable by others.' %(directory,))
+
+    return directory
+
+
+class SdistBuildInstaller(PipInstaller):
+    '''
+        SdistBuildInstaller - Install with pip, building any sdists in a shared build-tools env and reusing wheels already built from them.
+
+            The requirements are first downloaded (resolving dependencies) by the build-tools env's pip. Each sdist downloaded is then
+              replaced by the cached wheel built from it, building (and caching) it first if needed. Last, the virtualenv's pip installs
+              from only what was downloaded.
+
+            An sdist needing more than #buildRequirements to build (e.x. Cython, setuptools_scm) is built with build isolation instead,
+              and its wheel is cached all the same.
+
+            Requirements carrying "--hash" options are installed by pip as usual, as a wheel built here cannot match the hash of its sdist.
+    '''
+
+    def __init__(self, cacheDirectory=None, buildRequirements=DEFAULT_BUILD_REQUIREMENTS, extraArgs=None, lockTimeout=None):
+        '''
+            @param cacheDirectory <str/None> Default None - Where the build-tools envs and wheels are kept. Default is DEFAULT_BUILD_CACHE_DIRECTORY.
+            @param buildRequirements <str/list<str>> Default DEFAULT_BUILD_REQUIREMENTS - Requirements installed into the build-tools env.
+                                    Changing them creates a new build-tools env.
+            @param extraArgs list<str>/None - Extra arguments to "pip download", "pip wheel", and "pip install", e.x. ['--index-url', '...']
+            @param lockTimeout <float/None> Default None - Maximum seconds to wait for another process creating the same build-tools env.
+                                    None waits forever.
+
+            @raises ValueError - If #cacheDirectory is not owned by this user, or is writable by others
+        '''
+        PipInstaller.__init__(self, extraArgs)
+        self.cacheDirectory = _ensureCacheDirectory(os.path.realpath(cacheDirectory or DEFAULT_BUILD_CACHE_DIRECTORY))
+        if isinstance(buildRequirements, (list, tuple)):
+            buildRequirements = '\n'.join(buildRequirements)
+        self.buildRequirements = buildRequirements
+        self.lockTimeout = lockTimeout
+
+    @staticmethod
+    def _getInterpreterKey(venvDir):
+        '''
+            _getInterpreterKey - Get the part of the keys identifying the python version and platform of a virtualenv
+        '''
+        return 'py%s-%s-%s' %(VirtualEnvInfo.getPythonVersion(venvDir) or 'unknown', sys.platform, platform.machine().lower() or 'unknown')
+
+    def getBuildToolsEnv(self, venvDir, stdout=sys.stdout, stderr=sys.stderr):
+        '''
+            getBuildToolsEnv - Get the build-tools env for the python of a virtualenv, creating it if needed.
+
+                Safe to call concurrently from multiple processes, only one of which creates it.
+
+            @param venvDir <str/VirtualEnvInfo> - The virtualenv which packages will be built for
+            @param stdout <iostream/None> - Stream to be used as stdout while creating it. Use "None" to swallow output.
+            @param stderr <iostream/None> - Stream to be used as stderr while creating it. Use "None" to swallow output.
+
+            @return <str> - The root directory of the build-tools env
+
+            @raises -
+                VirtualEnvOnDemand.exceptions.PipInstallFailed - If the build requirements could not be installed
+                VirtualEnvOnDemand.exceptions.BuildSlotTimedOut - If another process was creating it for longer than #lockTimeout
+        '''
+        if isinstance(venvDir, VirtualEnvInfo):
+            venvDir = venvDir.virtualenvDirectory
+
+        requirementsHash = hashlib.sha256( ('%d\n%s' %(BUILD_TOOLS_ENV_VERSION, self.buildRequirements)).encode('utf-8') ).hexdigest()[:12]
+        key = '%s-%s' %(self._getInterpreterKey(venvDir), requirementsHash)
+        envsDirectory = ensureDirectory(os.sep.join([self.cacheDirectory, 'envs']))
+        buildEnvDir = os.sep.join([envsDirectory, key])
+        markerPath = os.sep.join([buildEnvDir, BUILD_TOOLS_MARKER_FILENAME])
+        if os.path.exists(markerPath):
+            return buildEnvDir
+
+        (lockFile, _) = HostSemaphore(os.sep.join([self.cacheDirectory, 'locks', key]), 1).acquire(self.lockTimeout)
+        try:
+            if os.path.exists(markerPath):
+                # Created by another process while we waited
+                return buildEnvDir
+            if os.path.exists(buildEnvDir):
+                # Left incomplete by a process which failed or died
+                shutil.rmtree(buildEnvDir)
+
+            pythonExecutable = None
+            if VirtualEnvInfo.getPythonVersion(venvDir) != '%d.%d' %(sys.version_info[0], sys.version_info[1]):
+                pythonExecutable = VirtualEnvInfo.getPythonBin(venvDir)
+
+            try:
+                createEnv(self.buildRequirements, envsDirectory, key, stdout, stderr, deleteOnClose=False, activateEnvironment=False,
+                    pythonExecutable=pythonExecutable)
+                ex = writeStrToFile(markerPath, self.buildRequirements + '\n')
+                if ex:
+                    raise ex
+            except:
+                shutil.rmtree(buildEnvDir, ignore_errors=True)
+                raise
+        finally:
+            HostSemaphore.release(lockFile)
+
+        return buildEnvDir
+
+    def _getWheelCacheDirectory(self, venvDir, sdistHash):
+        return os.sep.join([self.cacheDirectory, 'wheels', self._getInterpreterKey(venvDir), sdistHash])
+
+    @staticmethod
+    def _findWheel(wheelCacheDir):
+        try:
+            wheelFilenames = sorted([ filename for filename in os.listdir(wheelCacheDir) if filename.endswith('.whl') ])
+        except OSError:
+            return None
+        return wheelFilenames and os.sep.join([wheelCacheDir, wheelFilenames[0]]) or None
+
+    def getCachedWheel(self, venvDir, sdistPath):
+        '''
+            getCachedWheel - Get the wheel already built from an sdist, for the python of a virtualenv
+
+            @param venvDir <str> - The virtualenv which the wheel is for
+            @param sdistPath <str> - Path to the sdist archive
+
+            @return <str/None> - Path to the wheel, or None if it has not been built
+        '''
+        return self._findWheel(self._getWheelCacheDirectory(venvDir, _hashSdist(sdistPath)))
+
+    def buildWheel(self, venvDir, sdistPath, stdout=sys.stdout, stderr=sys.stderr, timeout=None):
+        '''
+            buildWheel - Get the wheel built from an sdist, from the cache or by building it in the build-tools env
+
+            @param venvDir <str> - The virtualenv which the wheel is for
+            @param sdistPath <str> - Path to the sdist archive
+            @param stdout <iostream/None> - Stream to be used as stdout for pip. Use "None" to swallow output.
+            @param stderr <iostream/None> - Stream to be used as stderr for pip. Use "None" to swallow output.
+            @param timeout <float/None> Default None - If provided, the maximum number of seconds each pip invocation may take
+
+            @return <str/None> - Path to the wheel, within the cache, or None if it could not be built
+
+            @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If pip exceeded #timeout
+        '''
+        wheelCacheDir = self._getWheelCacheDirectory(venvDir, _hashSdist(sdistPath))
+        wheelPath = self._findWheel(wheelCacheDir)
+        if wheelPath:
+            SDIST_BUILDS.inc(result='cached')
+            return wheelPath
+
+        buildEnvDir = self.getBuildToolsEnv(venvDir, stdout, stderr)
+        tmpDir = tempfile.mkdtemp(prefix='build_', dir=ensureDirectory(os.sep.join([self.cacheDirectory, 'tmp'])))
+        try:
+            wheelArgs = ['wheel', '--no-deps', '--wheel-dir', tmpDir] + self.extraArgs + [sdistPath]
+            result = 'built'
+            returnCode = runPip(buildEnvDir, wheelArgs[:1] + ['--no-build-isolation'] + wheelArgs[1:], None, None, timeout)
+            if returnCode != 0:
+                # Needs more than the build-tools env has, so let pip provide its build requirements
+                result = 'isolated'
+                returnCode = runPip(buildEnvDir, wheelArgs, stdout, stderr, timeout)
+            if returnCode != 0:
+                SDIST_BUILDS.inc(result='failure')
+                return None
+
+            try:
+                os.makedirs(os.path.dirname(wheelCacheDir))
+            except OSError:
+                pass
+            try:
+                os.rename(tmpDir, wheelCacheDir)
+            except OSError:
+                # Another process won the race
+                if not os.path.isdir(wheelCacheDir):
+                    raise
+        finally:
+            if os.path.isdir(tmpDir):
+                shutil.rmtree(tmpDir, ignore_errors=True)
+
+        SDIST_BUILDS.inc(result=result)
+        return self._findWheel(wheelCacheDir)
+
+    def installRequirements(self, reqContents, venvDir, stdout=sys.stdout, stderr=sys.stderr, noDeps=False, timeout=None, reportFilename=None):
+        '''
+            installRequirements - @see PipInstaller.installRequirements
+        '''
+        if isinstance(venvDir, VirtualEnvInfo):
+            venvDir = venvDir.virtualenvDirectory
+
+        if '--hash' in reqContents:
+            return PipInstaller.installRequirements(self, reqContents, venvDir, stdout, stderr, noDeps=noDeps, timeout=timeout, reportFilename=reportFilename)
+
+        buildEnvDir = self.getBuildToolsEnv(venvDir, stdout, stderr)
+
+        downloadDir = tempfile.mkdtemp(prefix='venv_downloads_', dir=venvDir)
+        reqFilename = writeRequirementsFile(reqContents, venvDir)
+        try:
+            downloadArgs = ['download', '--dest', downloadDir] + self.extraArgs + ['-r', reqFilename]
+            if noDeps:
+                downloadArgs.insert(1, '--no-deps')
+
+            # Preparing the metadata of sdists needs the build tools too. Try with only those of the build-tools env first.
+            returnCode = runPip(buildEnvDir, downloadArgs[:1] + ['--no-build-isolation'] + downloadArgs[1:], None, None, timeout)
+            if returnCode != 0:
+                returnCode = runPip(buildEnvDir, downloadArgs, stdout, stderr, timeout)
+            if returnCode != 0:
+                return returnCode
+
+            for filename in sorted(os.listdir(downloadDir)):
+                if filename.endswith('.whl') or not filename.lower().endswith(SDIST_EXTENSIONS):
+                    continue
+                sdistPath = os.sep.join([downloadDir, filename])
+                wheelPath = self.buildWheel(venvDir, sdistPath, stdout, stderr, timeout)
+                if wheelPath is None:
+                    if stderr is not None:
+                        stderr.write('VirtualEnvOnDemand: Failed to build a wheel from "%s"\n' %(filename,))
+                    return 1
+                _hardlinkFile(wheelPath, os.sep.join([downloadDir, os.path.basename(wheelPath)]))
+                os.remove(sdistPath)
+
+            return PipInstaller(self.extraArgs + ['--no-index', '--find-links', downloadDir]).installRequirements(reqContents, venvDir, stdout, stderr,
+                noDeps=noDeps, timeout=timeout, reportFilename=reportFilename)
+        finally:
+            shutil.rmtree(downloadDir, ignore_errors=True)
+            try:
+                os.remove(reqFilename)
+            except:
+                pass
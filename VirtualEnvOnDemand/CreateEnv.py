@@ -10,30 +10,46 @@ import atexit
 import shutil
 import sys
 import tempfile
+import time
 import virtualenv
 
-from .VirtualEnvInfo import VirtualEnvInfo, getInfoFromVirtualEnv
-from .InstallPackages import installPackages
+from .VirtualEnvInfo import VirtualEnvInfo, getInfoFromVirtualEnv, PIPLESS_MARKER_FILENAME
+from .InstallPackages import installPackages, generateRequirementsTxt
+from .ProcessUtils import runProcess
+from .RunPip import getHostPipVersion, HOST_PIP_MIN_VERSION
+from .Slim import slimEnv, SLIM_DEFAULT_CLASSES
+from .Metrics import ENV_CREATIONS, ENV_CREATION_SECONDS
+from .ResourcePolicy import acquireBuildSlot, isPriorityLowered
+from .BuildDaemon import requestCreateEnv
+from .Placement import placeTemporaryEnv
+from .utils import cmp_version, writeStrToFile
+
+try:
+    import venv
+except ImportError:
+    # python2
+    venv = None
 
 try:
     from types import StringTypes
 except ImportError:
     StringTypes = (str,)
 
-__all__ = ('activateEnv', 'createEnv', 'createEnvIfCannotImport')
+__all__ = ('activateEnv', 'deactivateEnv', 'activatedEnv', 'createEnv', 'createEnvIfCannotImport')
 
-def createEnv(packages=None, parentDirectory=None, name=None, stdout=sys.stdout, stderr=sys.stderr, deleteOnClose=True, activateEnvironment=True):
+def createEnv(packages=None, parentDirectory=None, name=None, stdout=sys.stdout, stderr=sys.stderr, deleteOnClose=True, activateEnvironment=True, packageStore=None, lockFile=None, pythonExecutable=None, installer=None, withPip=True, slim=False):
     '''
         createEnv - Creates a temporary virtual environment and installs the required modules for the current running application.
             You can use this, for example, to "recover" from a failed import by installing the software on demand.
 
             @param packages - Describes the required packages. Takes one of the following forms:
 
-                String - Directly becomes contents of requirements.txt file to be ingested by pip
+                String - Contents of a requirements.txt file. It is normalized (duplicates merged, conflicts raised) before pip ingests it.
                 List   - A list/tuple/set of package names (optionally including version requirements, e.x. MyPkg==1.2.3)
                 Dict   - A dictionary of package names to versions. If no value is present, the latest will be fetched.
 
-            @param parentDirectory <str> - Parent directory of the directory which will be created to hold the temporary environment and packages. Defaults to tempfile.tempdir
+            @param parentDirectory <str> - Parent directory of the directory which will be created to hold the temporary environment and packages.
+                Defaults to tempfile.tempdir, or a memory-backed filesystem per the placement policy. @see VirtualEnvOnDemand.Placement.setPlacementPolicy
 
             @param name <str> - If provided, will use this as the virtualenv name. Otherwise, a random name will be generated. This should not contain any directories, use #parentDirectory to specify the directory.
 
@@ -45,6 +61,28 @@ def createEnv(packages=None, parentDirectory=None, name=None, stdout=sys.stdout,
 
             @param activateEnvironment <bool> Default True, If True, this virtualenv will immediately be activated (so you can import installed packages)
 
+            @param packageStore <None/str/PackageStore> Default None - If provided, packages are linked from this host-wide store instead of being installed by pip directly.
+                @see VirtualEnvOnDemand.PackageStore.PackageStore
+
+            @param lockFile <None/bool/str> Default None - Capture a lock file on install, and install from it when it matches #packages.
+                @see VirtualEnvOnDemand.InstallPackages.installPackages
+
+            @param pythonExecutable <str/None> Default None - Path to a python interpreter to create the virtualenv for. Default (None) is the running interpreter.
+                When provided, virtualenv is run as a subprocess with this interpreter. You should not activate (#activateEnvironment) a virtualenv
+                built for a different python version than the running one. @see VirtualEnvOnDemand.BuildMatrix.buildEnvMatrix
+
+            @param installer <None/InstallerBackend> Default None - The backend used to install #packages. Default is pip.
+                @see VirtualEnvOnDemand.Installers
+
+            @param withPip <bool> Default True - If False, the virtualenv is created with the standard library "venv" module, without
+                seeding pip, setuptools, or wheel into it. This is much faster, and the env much smaller.
+                Installs into it are then done by the host's pip (pip 22.3 or newer is required) targeting the env's python.
+                Requires python3.
+
+            @param slim <bool/list<str>> Default False - If True, after installing #packages, files not needed at runtime (tests, docs, bytecode
+                for other pythons) are removed from every installed distribution, and the bytes saved are written to #stdout.
+                A list of slim classes chooses what is removed. @see VirtualEnvOnDemand.Slim.slimEnv
+
             @return - On success, returns a VirtualEnvInfo object, which can be used as a dict with the following fields:
                 {
                     'virtualenvDirectory'   : Absolute path to the root virtualenv directory
@@ -54,28 +92,115 @@ def createEnv(packages=None, parentDirectory=None, name=None, stdout=sys.stdout,
 
         @raises - 
             VirtualEnvOnDemand.exceptions.PipInstallFailed -  if cannot install packages
-            ValueError - If parent directory does not exist.
+            VirtualEnvOnDemand.exceptions.InvalidRequirement / RequirementConflict - (subclasses of ValueError) if #packages is malformed or conflicting
+            ValueError - If parent directory does not exist, virtualenv fails for #pythonExecutable, or #withPip is False and not supported.
             Others (Exception, etc)                        -  If permissions problem to write to specified directory, etc
     '''
-    if not os.path.isdir(parentDirectory):
+    if parentDirectory is not None and not os.path.isdir(parentDirectory):
         raise ValueError('Provided parent directory "%s" does not exist.' %(parentDirectory,))
 
     if name and os.sep in name:
         raise ValueError('Provided name "%s" must not contain any directories.' %(name,))
 
+    # Fail on malformed or conflicting requirements before spending any time creating the env
+    reqContents = generateRequirementsTxt(packages)
+
+    if not withPip:
+        hostPipVersion = getHostPipVersion()
+        if not hostPipVersion or cmp_version(hostPipVersion, HOST_PIP_MIN_VERSION) < 0:
+            raise ValueError('Creating a virtualenv without pip requires pip >= %s for the running python, but found: %s' %(HOST_PIP_MIN_VERSION, str(hostPipVersion)))
+        if venv is None and not pythonExecutable:
+            raise ValueError('Creating a virtualenv without pip requires the "venv" module (python3).')
+
+    placement = None
+    if parentDirectory is None:
+        placement = placeTemporaryEnv(deleteOnClose)
+        parentDirectory = placement.parentDirectory
     parentDirectory = os.path.realpath(parentDirectory)
 
-    # Create blank env
-    if name:
-        venvDir = os.sep.join([parentDirectory, name])
-    else:
-        venvDir = tempfile.mkdtemp(prefix='venv_', dir=parentDirectory)
+    try:
+        venvInfo = _createEnv(packages, reqContents, parentDirectory, name, stdout, stderr, deleteOnClose, activateEnvironment, packageStore,
+            lockFile, pythonExecutable, installer, withPip, slim, placement)
+    except:
+        if placement is not None:
+            placement.release()
+        raise
 
-    virtualenv.create_environment(venvDir, site_packages=True)
+    if placement is not None:
+        placement.assign(venvInfo.virtualenvDirectory)
+    return venvInfo
 
-    # If they provided required packages, install them
-    installPackages(packages, venvDir, stdout, stderr)
 
+def _createEnv(packages, reqContents, parentDirectory, name, stdout, stderr, deleteOnClose, activateEnvironment, packageStore, lockFile,
+        pythonExecutable, installer, withPip, slim, placement):
+    '''
+        _createEnv - Create the env, once validated and placed. @see createEnv
+    '''
+    if installer is None:
+        # Have the build daemon build it, if in use and running. @see VirtualEnvOnDemand.BuildDaemon
+        venvDir = requestCreateEnv(reqContents, parentDirectory, name, stdout, stderr, packageStore=packageStore,
+            lockFile=lockFile, pythonExecutable=pythonExecutable, withPip=withPip, slim=slim)
+        if venvDir is not None:
+            return _finishCreatedEnv(venvDir, deleteOnClose, activateEnvironment, placement)
+
+    # Queue for a host-wide build slot, if the resource policy limits concurrent builds
+    buildSlot = acquireBuildSlot()
+    startTime = time.time()
+    try:
+        # Create blank env
+        if name:
+            venvDir = os.sep.join([parentDirectory, name])
+        else:
+            venvDir = tempfile.mkdtemp(prefix='venv_', dir=parentDirectory)
+
+        # Creating in-process would escape the resource policy's priority, so use a subprocess when it is lowered
+        if not withPip:
+            if pythonExecutable or isPriorityLowered():
+                returnCode = runProcess([pythonExecutable or sys.executable, '-m', 'venv', '--without-pip', '--system-site-packages', venvDir], stdout, stderr)
+                if returnCode != 0:
+                    raise ValueError('Failed to create venv at "%s" for python "%s" (ret=%d).' %(venvDir, pythonExecutable, returnCode))
+            else:
+                venv.EnvBuilder(system_site_packages=True, with_pip=False, symlinks=(os.name != 'nt')).create(venvDir)
+
+            ex = writeStrToFile(os.sep.join([venvDir, PIPLESS_MARKER_FILENAME]), 'Created without pip. Packages are installed by the host pip.\n')
+            if ex:
+                raise ex
+        elif pythonExecutable or isPriorityLowered():
+            # virtualenv can only build for another interpreter from its command line
+            returnCode = runProcess([sys.executable, '-m', 'virtualenv', '--python', pythonExecutable or sys.executable, '--system-site-packages', venvDir], stdout, stderr)
+            if returnCode != 0:
+                raise ValueError('Failed to create virtualenv at "%s" for python "%s" (ret=%d).' %(venvDir, pythonExecutable or sys.executable, returnCode))
+        else:
+            virtualenv.create_environment(venvDir, site_packages=True)
+
+        # If they provided required packages, install them
+        installPackages(packages, venvDir, stdout, stderr, packageStore=packageStore, lockFile=lockFile, installer=installer)
+
+        if slim:
+            slimReport = slimEnv(venvDir, SLIM_DEFAULT_CLASSES if slim is True else slim)
+            if stdout is not None:
+                stdout.write('VirtualEnvOnDemand: Slimmed "%s", removed %d files (%d bytes).\n' %(venvDir, slimReport.filesRemoved, slimReport.bytesSaved))
+    except:
+        ENV_CREATIONS.inc(result='failure')
+        ENV_CREATION_SECONDS.observe(time.time() - startTime, result='failure')
+        raise
+    finally:
+        buildSlot.release()
+
+    ENV_CREATIONS.inc(result='success')
+    ENV_CREATION_SECONDS.observe(time.time() - startTime, result='success')
+
+    return _finishCreatedEnv(venvDir, deleteOnClose, activateEnvironment, placement)
+
+
+def _finishCreatedEnv(venvDir, deleteOnClose, activateEnvironment, placement=None):
+    '''
+        _finishCreatedEnv - Register cleanup of, and activate, a newly created env. @see createEnv
+
+        @param placement <EnvPlacement/None> - Where it was placed, if a temporary env. Released upon cleanup.
+
+        @return <VirtualEnvInfo>
+    '''
     # Generate the site-packages path
     venvSitePath = VirtualEnvInfo.getSitePackagesDirectory(venvDir)
 
@@ -94,6 +219,9 @@ def createEnv(packages=None, parentDirectory=None, name=None, stdout=sys.stdout,
             except:
                 pass
 
+            if placement is not None:
+                placement.release()
+
         atexit.register(_cleanupFunc)
 
     ret = VirtualEnvInfo(
@@ -132,8 +260,114 @@ def activateEnv(venv):
         # If already present, move to the front of the line
         sys.path.remove(info.sitePackagesDirectory)
 
-    sys.path = [info.sitePackagesDirectory] + sys.path
+    # Modify in-place, as others may hold a reference to sys.path
+    sys.path.insert(0, info.sitePackagesDirectory)
     return info.sitePackagesDirectory
+
+
+def _getInfo(venv):
+    if isinstance(venv, VirtualEnvInfo):
+        return venv
+    elif issubclass(venv.__class__, StringTypes):
+        return getInfoFromVirtualEnv(venv, validate=False)
+    raise TypeError('Unknown type passed: %s. Should be VirtualEnvInfo or a string.' %(venv.__class__.__name__,))
+
+
+def _isWithin(path, directories):
+    path = os.path.realpath(path)
+    for directory in directories:
+        if path == directory or path.startswith(directory + os.sep):
+            return True
+    return False
+
+
+def deactivateEnv(venv, evictModules=False):
+    '''
+        deactivateEnv - Deactivates a virtualenv activated by activateEnv, so its packages can no longer be imported.
+
+            The site-packages directory is removed from the python import path, and the import system's caches of it are cleared.
+
+        @param venv <str/VirtualEnvInfo> - A path to the root of a virtualenv, or a VirtualEnvInfo.VirtualEnvInfo object
+        @param evictModules <bool> Default False - If True, modules already imported from the virtualenv are also removed from sys.modules,
+                                                     so that importing them again finds them in whichever env is active then.
+                                                     Objects (classes, functions) already taken from those modules remain usable.
+
+        @raises - TypeError - if venv is not correct type
+
+        @return list<str> - Names of the modules evicted from sys.modules (empty unless #evictModules)
+    '''
+    info = _getInfo(venv)
+    venvDirectories = set([ os.path.realpath(info.virtualenvDirectory), os.path.realpath(info.sitePackagesDirectory) ])
+
+    sitePackagesDirectory = os.path.realpath(info.sitePackagesDirectory)
+    sys.path[:] = [ path for path in sys.path if path != info.sitePackagesDirectory and os.path.realpath(path or '.') != sitePackagesDirectory ]
+    _invalidateImportCaches(venvDirectories)
+
+    evicted = []
+    if evictModules:
+        for (moduleName, module) in list(sys.modules.items()):
+            moduleFile = getattr(module, '__file__', None)
+            modulePaths = [moduleFile] if moduleFile else list(getattr(module, '__path__', None) or [])
+            if modulePaths and all( [ _isWithin(modulePath, venvDirectories) for modulePath in modulePaths ] ):
+                del sys.modules[moduleName]
+                evicted.append(moduleName)
+
+    return evicted
+
+
+def _invalidateImportCaches(venvDirectories):
+    '''
+        _invalidateImportCaches - Forget the import system's cached finders for (and listings of) paths within #venvDirectories
+    '''
+    for path in list(sys.path_importer_cache.keys()):
+        if path and _isWithin(path, venvDirectories):
+            sys.path_importer_cache.pop(path, None)
+
+    try:
+        from importlib import invalidate_caches
+    except ImportError:
+        # python2, which does not cache directory listings
+        return
+    invalidate_caches()
+
+
+class activatedEnv(object):
+    '''
+        activatedEnv - Context manager which activates a virtualenv for the duration of a block, e.x. to run a task in
+          a different env within a long-lived process:
+
+            with activatedEnv(venvInfo):
+                import plugin
+                plugin.run()
+
+          Upon exit, sys.path is restored exactly as it was upon entry, and the import system's caches of the env are cleared.
+    '''
+
+    def __init__(self, venv, evictModules=False):
+        '''
+            @param venv <str/VirtualEnvInfo> - A path to the root of a virtualenv, or a VirtualEnvInfo.VirtualEnvInfo object
+            @param evictModules <bool> Default False - If True, modules imported from the env are removed from sys.modules upon exit.
+                                                         @see deactivateEnv
+        '''
+        self.venv = venv
+        self.evictModules = evictModules
+        self.evicted = []
+        self._savedPath = None
+
+    def __enter__(self):
+        '''
+            @return <VirtualEnvInfo> - The activated env
+
+            @raises ValueError - If the env is not usable
+        '''
+        info = _getInfo(self.venv)
+        self._savedPath = list(sys.path)
+        activateEnv(info)
+        return info
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.evicted = deactivateEnv(self.venv, evictModules=self.evictModules)
+        sys.path[:] = self._savedPath
     
 
 def createEnvIfCannotImport(importName, packages, parentDirectory=None, stdout=sys.stdout, stderr=sys.stderr, deleteOnClose=True):
@@ -157,7 +391,7 @@ def createEnvIfCannotImport(importName, packages, parentDirectory=None, stdout=s
         __import__(importName)
     except ImportError:
         # Import failed, build our environment and try again.
-        ret = createEnv(packages, parentDirectory, stdout, stderr, deleteOnClose)
+        ret = createEnv(packages, parentDirectory, stdout=stdout, stderr=stderr, deleteOnClose=deleteOnClose)
         __import__(importName)
 
     return ret
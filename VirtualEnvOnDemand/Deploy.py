@@ -0,0 +1,302 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Deploy - Pre-baking, warming and inspecting envs ahead of time (e.x. during an image build or a deploy),
+      so that the first real process start does not pay for building them.
+
+      These are also available from the command line, @see "python -m VirtualEnvOnDemand --help"
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from .VirtualEnvInfo import VirtualEnvInfo, getInfoFromVirtualEnv
+from .CreateEnv import createEnv
+from .PersistentEnv import setupAndActivateEnv, MY_VERSION_FILENAME
+from .ProcessUtils import runProcess, runProcessGetOutput
+from .RunPip import runPipGetOutput
+from .Integrity import verifyEnvIntegrity
+from .utils import cmp_version, writeStrToFile
+
+__all__ = ('compileEnv', 'verifyEnv', 'VerifyResult', 'getEnvManifest', 'listDistributions', 'readBuildInfo', 'recordBuildTimings',
+    'runBenchmarks', 'BUILD_INFO_FILENAME', 'BENCH_CREATE', 'BENCH_REUSE', 'BENCH_IMPORT', 'BENCH_ALL_SCENARIOS',
+)
+
+# BUILD_INFO_FILENAME - Within the root of a virtualenv, JSON of how long each step of preparing it took
+BUILD_INFO_FILENAME = '.VirtualEnvOnDemand_BuildInfo'
+
+# Benchmark scenarios, @see runBenchmarks
+
+# BENCH_CREATE - Create a new env and install the packages (the cost of a cold start)
+BENCH_CREATE = 'create'
+# BENCH_REUSE - setupAndActivateEnv on an env which is already built (the cost paid by every process start)
+BENCH_REUSE = 'reuse'
+# BENCH_IMPORT - Start the env's python and import modules from it
+BENCH_IMPORT = 'import'
+
+BENCH_ALL_SCENARIOS = (BENCH_CREATE, BENCH_REUSE, BENCH_IMPORT)
+
+# _IMPORT_CHECK_SCRIPT - Run by the env's python with module names as arguments. Prints the ones which fail to import, and why.
+_IMPORT_CHECK_SCRIPT = '''
+import sys
+for name in sys.argv[1:]:
+    try:
+        __import__(name)
+    except BaseException as e:
+        sys.stdout.write('%s\\t%s: %s\\n' %(name, e.__class__.__name__, str(e).replace('\\n', ' ')))
+'''
+
+
+def _getVenvDir(venvDir):
+    if isinstance(venvDir, VirtualEnvInfo):
+        return venvDir['virtualenvDirectory']
+    # Resolve the symlink of envs using background upgrades to the current generation
+    return os.path.realpath(venvDir)
+
+
+def readBuildInfo(venvDir):
+    '''
+        readBuildInfo - Read the build info of an env, @see recordBuildTimings
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+
+        @return <dict> - The build info, empty if none was recorded
+    '''
+    try:
+        with open(os.sep.join([_getVenvDir(venvDir), BUILD_INFO_FILENAME]), 'rt') as f:
+            return json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def recordBuildTimings(venvDir, timings):
+    '''
+        recordBuildTimings - Record how long steps of preparing an env took, within the env. They are shown by getEnvManifest.
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+        @param timings dict<str, float> - Step name (e.x. "build", "compile") -> seconds. Merged with timings already recorded.
+
+        @return <None/Exception> - None if all goes well, otherwise the Exception raised
+    '''
+    buildInfo = readBuildInfo(venvDir)
+    buildInfo.setdefault('timings', {}).update(timings)
+    buildInfo['recorded'] = time.time()
+    return writeStrToFile(os.sep.join([_getVenvDir(venvDir), BUILD_INFO_FILENAME]), json.dumps(buildInfo, indent=2, sort_keys=True) + '\n')
+
+
+def compileEnv(venvDir, stdout=None, stderr=None, workers=0, timeout=None):
+    '''
+        compileEnv - Precompile the bytecode of everything installed in an env, with the env's python,
+          so that the first process to import each module does not pay to compile it (and does not need write access).
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+        @param stdout <iostream/None> - Stream to be used as stdout. Default None swallows output.
+        @param stderr <iostream/None> - Stream to be used as stderr. Default None swallows output.
+        @param workers <int> Default 0 - Number of processes to compile with, 0 for one per CPU. Ignored for python2 envs.
+        @param timeout <float/None> Default None - If provided, the maximum number of seconds to wait
+
+        @return <int> - The return code of compileall, 0 if everything compiled
+
+        @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If #timeout was exceeded
+    '''
+    venvDir = _getVenvDir(venvDir)
+    cmd = [ VirtualEnvInfo.getPythonBin(venvDir), '-m', 'compileall', '-q' ]
+
+    pythonVersion = VirtualEnvInfo.getPythonVersion(venvDir)
+    if pythonVersion and cmp_version(pythonVersion, '3.5') >= 0:
+        cmd += [ '-j', str(workers) ]
+
+    return runProcess(cmd + [ VirtualEnvInfo.getSitePackagesDirectory(venvDir) ], stdout, stderr, timeout)
+
+
+class VerifyResult(object):
+    '''
+        VerifyResult - The outcome of verifyEnv
+
+            problems - Descriptions of everything found wrong with the env
+    '''
+
+    __slots__ = ('problems',)
+
+    def __init__(self, problems=None):
+        self.problems = problems or []
+
+    @property
+    def success(self):
+        return not self.problems
+
+    def __repr__(self):
+        return 'VerifyResult(problems=%r)' %(self.problems,)
+
+
+def verifyEnv(venvDir, importNames=None, timeout=None, deep=False):
+    '''
+        verifyEnv - Verify that an env is usable: its layout is valid, the installed distributions have
+          all of their dependencies ("pip check"), and (optionally) modules can be imported by the env's python.
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+        @param importNames list<str>/None Default None - Modules which must be importable
+        @param timeout <float/None> Default None - Maximum seconds for each subprocess
+        @param deep <bool> Default False - If True, also check every installed file against the hashes in its distribution's RECORD.
+                                             @see VirtualEnvOnDemand.Integrity.verifyEnvIntegrity
+
+        @return <VerifyResult>
+    '''
+    venvDir = _getVenvDir(venvDir)
+    result = VerifyResult()
+
+    try:
+        getInfoFromVirtualEnv(venvDir, validate=True)
+    except ValueError as e:
+        result.problems.append('invalid env: %s' %(str(e),))
+        return result
+
+    if deep:
+        for (name, problems) in sorted(verifyEnvIntegrity(venvDir).broken.items()):
+            result.problems += [ '%s: %s file %s' %(name, problem, relPath) for (problem, relPath) in problems ]
+
+    (returnCode, output) = runPipGetOutput(venvDir, ['check'], timeout=timeout)
+    if returnCode != 0:
+        result.problems += [ 'pip check: %s' %(line.strip(),) for line in output.split('\n') if line.strip() ] or [ 'pip check failed (ret=%d)' %(returnCode,) ]
+
+    if importNames:
+        (returnCode, output) = runProcessGetOutput([VirtualEnvInfo.getPythonBin(venvDir), '-c', _IMPORT_CHECK_SCRIPT] + list(importNames), timeout=timeout)
+        result.problems += [ 'cannot import %s' %(line.replace('\t', ': ', 1),) for line in output.split('\n') if line.strip() ]
+        if returnCode != 0:
+            result.problems.append('import check failed (ret=%d)' %(returnCode,))
+
+    return result
+
+
+def listDistributions(sitePackagesDirectory):
+    '''
+        listDistributions - List the distributions installed into a site-packages directory, from their metadata directories
+
+        @param sitePackagesDirectory <str> - The site-packages directory
+
+        @return dict<str, str> - Distribution name -> version
+    '''
+    ret = {}
+    try:
+        entries = os.listdir(sitePackagesDirectory)
+    except OSError:
+        return ret
+
+    for entry in entries:
+        for suffix in ('.dist-info', '.egg-info'):
+            if entry.endswith(suffix) and '-' in entry:
+                (name, version) = entry[:-len(suffix)].split('-', 2)[:2]
+                ret[name] = version
+    return ret
+
+
+def _getDirectorySize(directory):
+    total = 0
+    for (dirPath, dirNames, fileNames) in os.walk(directory):
+        for fileName in fileNames:
+            try:
+                total += os.lstat(os.path.join(dirPath, fileName)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def getEnvManifest(venvDir):
+    '''
+        getEnvManifest - Describe an env: where it is, what it runs, what is installed, and how long it took to prepare
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+
+        @return <dict> - With keys: virtualenvDirectory, sitePackagesDirectory, pythonVersion, pipless, myVersion,
+                           distributions (name -> version), sizeBytes, and timings (@see recordBuildTimings)
+
+        @raises ValueError - If #venvDir is not a valid virtualenv
+    '''
+    venvDir = _getVenvDir(venvDir)
+    getInfoFromVirtualEnv(venvDir, validate=True)
+    sitePackagesDirectory = VirtualEnvInfo.getSitePackagesDirectory(venvDir)
+
+    myVersion = None
+    try:
+        with open(os.sep.join([venvDir, MY_VERSION_FILENAME]), 'rt') as f:
+            myVersion = f.read().strip() or None
+    except (IOError, OSError):
+        pass
+
+    return {
+        'virtualenvDirectory' : venvDir,
+        'sitePackagesDirectory' : sitePackagesDirectory,
+        'pythonVersion' : VirtualEnvInfo.getPythonVersion(venvDir),
+        'pipless' : VirtualEnvInfo.isPipless(venvDir),
+        'myVersion' : myVersion,
+        'distributions' : listDistributions(sitePackagesDirectory),
+        'sizeBytes' : _getDirectorySize(venvDir),
+        'timings' : readBuildInfo(venvDir).get('timings', {}),
+    }
+
+
+def _runImports(cmd):
+    returnCode = runProcess(cmd, None, None)
+    if returnCode != 0:
+        raise ValueError('Command %s failed (ret=%d).' %(str(cmd), returnCode))
+
+
+def _timeCall(func, *args, **kwargs):
+    startTime = time.time()
+    func(*args, **kwargs)
+    return time.time() - startTime
+
+
+def runBenchmarks(packages, scenarios=BENCH_ALL_SCENARIOS, repeat=3, parentDirectory=None, importNames=None, withPip=True, stdout=None):
+    '''
+        runBenchmarks - Time the scenarios which matter at deploy time, with a given set of packages.
+
+            Everything is built in a temporary directory, which is removed afterwards.
+
+        @param packages <list/dict/str> - The packages, @see VirtualEnvOnDemand.CreateEnv.createEnv
+        @param scenarios list<str> Default BENCH_ALL_SCENARIOS - Which of the BENCH_* scenarios to run
+        @param repeat <int> Default 3 - Number of times to run each scenario
+        @param parentDirectory <str/None> Default None - Where to create the temporary directory. Default is the system temporary directory.
+        @param importNames list<str>/None Default None - Modules imported by BENCH_IMPORT. If not provided, that scenario is skipped.
+        @param withPip <bool> Default True - Passed to createEnv, @see VirtualEnvOnDemand.CreateEnv.createEnv
+        @param stdout <iostream/None> Default None - If provided, progress is written here
+
+        @return dict<str, list<float>> - Scenario -> seconds taken by each run
+
+        @raises - Whatever a scenario raised, e.x. PipInstallFailed. ValueError if the modules could not be imported.
+    '''
+    benchDirectory = tempfile.mkdtemp(prefix='VirtualEnvOnDemand_bench_', dir=parentDirectory)
+    ret = {}
+    savedPath = list(sys.path)
+    try:
+        if BENCH_CREATE in scenarios:
+            ret[BENCH_CREATE] = []
+            for i in range(repeat):
+                if stdout is not None:
+                    stdout.write('%s: run %d of %d\n' %(BENCH_CREATE, i + 1, repeat))
+                name = 'create%d' %(i,)
+                ret[BENCH_CREATE].append(_timeCall(createEnv, packages, benchDirectory, name, None, None, deleteOnClose=False, activateEnvironment=False, withPip=withPip))
+                shutil.rmtree(os.sep.join([benchDirectory, name]), ignore_errors=True)
+
+        venvInfo = None
+        if BENCH_REUSE in scenarios or (BENCH_IMPORT in scenarios and importNames):
+            if stdout is not None:
+                stdout.write('Building env for %s\n' %(', '.join([ x for x in (BENCH_REUSE, BENCH_IMPORT) if x in scenarios ]),))
+            venvInfo = setupAndActivateEnv(benchDirectory, 'reuse', packages, myVersion='1', withPip=withPip)
+
+        if BENCH_REUSE in scenarios:
+            ret[BENCH_REUSE] = [ _timeCall(setupAndActivateEnv, benchDirectory, 'reuse', packages, myVersion='1', withPip=withPip) for i in range(repeat) ]
+
+        if BENCH_IMPORT in scenarios and importNames:
+            cmd = [ VirtualEnvInfo.getPythonBin(venvInfo['virtualenvDirectory']), '-c', 'import %s' %(', '.join(importNames),) ]
+            ret[BENCH_IMPORT] = [ _timeCall(_runImports, cmd) for i in range(repeat) ]
+    finally:
+        sys.path[:] = savedPath
+        shutil.rmtree(benchDirectory, ignore_errors=True)
+
+    return ret
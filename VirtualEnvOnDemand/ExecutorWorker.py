@@ -0,0 +1,194 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    ExecutorWorker - The worker process of VirtualEnvOnDemand.VenvExecutor.VenvExecutor
+
+      This is run as a script by the python of the target virtualenv (which need not have VirtualEnvOnDemand installed),
+        so it must only use the standard library, and remain compatible with both python2 and python3.
+
+      Usage: python ExecutorWorker.py [address] [numWorkers] [preloadModules] [authKey]
+
+        address        - "unix:/path/to/socket" or "tcp:host:port" to connect back to the executor
+        numWorkers     - Number of workers to run. With more than one, and where fork is available, this process acts as a
+                           fork-server: it imports #preloadModules once, then forks the workers, which share those warm imports.
+                           Workers which die abnormally are replaced.
+        preloadModules - Comma-separated list of modules to import before serving, or "" for none
+        authKey        - Secret sent back to the executor to prove this worker was started by it
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import hmac
+import os
+import pickle
+import socket
+import struct
+import sys
+import traceback
+
+# PICKLE_PROTOCOL - Highest protocol understood by both python2 and python3
+PICKLE_PROTOCOL = 2
+
+# EXIT_CANNOT_CONNECT - Exit code of a worker which could not reach the executor. The fork-server does not replace these.
+EXIT_CANNOT_CONNECT = 3
+
+_HEADER = struct.Struct('>I')
+
+
+def sendMessage(sock, obj):
+    '''
+        sendMessage - Send a length-prefixed pickled message
+    '''
+    data = pickle.dumps(obj, PICKLE_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def sendHello(sock, authKey):
+    '''
+        sendHello - Prove to the executor that this worker was started by it. Sent raw rather than pickled,
+          so the executor can check it before unpickling anything from the connection.
+    '''
+    sock.sendall(authKey.encode('ascii') + _HEADER.pack(os.getpid()))
+
+
+def recvHello(sock, authKey):
+    '''
+        recvHello - Receive and check the hello of a worker, @see sendHello
+
+        @return <int/None> - The pid of the worker, or None if the connection was closed, or the key does not match
+    '''
+    expectedKey = authKey.encode('ascii')
+    data = _recvExactly(sock, len(expectedKey) + _HEADER.size)
+    if data is None or not hmac.compare_digest(data[:len(expectedKey)], expectedKey):
+        return None
+    return _HEADER.unpack(data[len(expectedKey):])[0]
+
+
+def _recvExactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1048576))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recvMessage(sock):
+    '''
+        recvMessage - Receive a length-prefixed pickled message
+
+        @return - The unpickled message, or None if the connection was closed
+    '''
+    header = _recvExactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    data = _recvExactly(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return pickle.loads(data)
+
+
+def connect(address):
+    '''
+        connect - Connect to an address in the form "unix:/path" or "tcp:host:port"
+    '''
+    (family, _, location) = address.partition(':')
+    if family == 'unix':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(location)
+    else:
+        (host, _, port) = location.rpartition(':')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((host, int(port)))
+    return sock
+
+
+def _runTask(payload):
+    '''
+        _runTask - Unpickle and run one task
+
+        @return tuple - ( succeeded <bool>, result or exception, formatted traceback or None )
+    '''
+    try:
+        (func, args, kwargs) = pickle.loads(payload)
+        return (True, func(*args, **kwargs), None)
+    except (Exception, SystemExit) as e:
+        # SystemExit is caught too, so a task calling sys.exit does not take down the worker
+        return (False, e, traceback.format_exc())
+
+
+def serve(address, authKey):
+    '''
+        serve - Connect to the executor, and run tasks until told to shutdown (or the executor goes away)
+    '''
+    try:
+        sock = connect(address)
+    except (socket.error, OSError):
+        return EXIT_CANNOT_CONNECT
+
+    try:
+        sendHello(sock, authKey)
+        while True:
+            message = recvMessage(sock)
+            if message is None or message[0] == 'shutdown':
+                return 0
+
+            (_, taskId, payload) = message
+            (succeeded, value, formattedTraceback) = _runTask(payload)
+            try:
+                sendMessage(sock, ('result', taskId, succeeded, value, formattedTraceback))
+            except Exception as e:
+                # Result (or exception) could not be pickled
+                sendMessage(sock, ('result', taskId, False, RuntimeError('Could not send result of task back to executor: %s: %s' %(e.__class__.__name__, str(e))), formattedTraceback))
+    except (socket.error, OSError, EOFError):
+        return 0
+    finally:
+        sock.close()
+
+
+def main(argv):
+    (address, numWorkers, preloadModules, authKey) = argv[1:5]
+    numWorkers = int(numWorkers)
+
+    for moduleName in [ x.strip() for x in preloadModules.split(',') if x.strip() ]:
+        try:
+            __import__(moduleName)
+        except Exception as e:
+            sys.stderr.write('VenvExecutor worker: Failed to preload module "%s": %s\n' %(moduleName, str(e)))
+
+    if numWorkers <= 1 or not hasattr(os, 'fork'):
+        return serve(address, authKey)
+
+    # Fork-server
+    def _spawn():
+        pid = os.fork()
+        if pid == 0:
+            exitCode = 1
+            try:
+                exitCode = serve(address, authKey)
+            finally:
+                os._exit(exitCode)
+        return pid
+
+    children = set( [ _spawn() for i in range(numWorkers) ] )
+    while children:
+        try:
+            (pid, status) = os.wait()
+        except OSError:
+            break
+        children.discard(pid)
+
+        died = os.WIFSIGNALED(status) or (os.WIFEXITED(status) and os.WEXITSTATUS(status) not in (0, EXIT_CANNOT_CONNECT))
+        if died:
+            children.add(_spawn())
+
+    return 0
+
+
+if __name__ == '__main__':
+    # Running as a script puts this package's directory first on the path, where our modules would shadow the user's.
+    if sys.path and os.path.abspath(sys.path[0] or '.') == os.path.dirname(os.path.abspath(__file__)):
+        del sys.path[0]
+
+    sys.exit(main(sys.argv))
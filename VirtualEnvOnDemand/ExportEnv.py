@@ -0,0 +1,304 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    ExportEnv - Methods to ship a prebuilt virtualenv between hosts.
+
+      exportEnv streams a virtualenv into a compressed archive, and importEnv extracts one,
+        fixing up the absolute paths embedded within the env to its new location.
+
+      Build once, then have every other host import the archive from a local artifact directory, with no pip runs at all.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import csv
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tarfile
+import time
+
+from .VirtualEnvInfo import VirtualEnvInfo, getInfoFromVirtualEnv
+from .Wheels import _hashFile, _writeRecord
+from .exceptions import IncompatibleVirtualEnv
+
+__all__ = ('exportEnv', 'importEnv', 'getHostCompatibility')
+
+# MANIFEST_NAME - The first member of every exported archive, describing where it came from
+MANIFEST_NAME = '.VirtualEnvOnDemand_Export.json'
+
+# ENV_ARCNAME - The directory within the archive holding the virtualenv
+ENV_ARCNAME = 'env'
+
+# EXPORT_FORMAT_VERSION - Bump if the archive layout changes incompatibly
+EXPORT_FORMAT_VERSION = 1
+
+# PATH_FIXUP_FILENAMES - Files (by basename) anywhere in the env which may embed the absolute virtualenv path
+PATH_FIXUP_FILENAMES = ('pyvenv.cfg', 'RECORD', 'direct_url.json', 'orig-prefix.txt')
+
+# PATH_FIXUP_EXTENSIONS - Files (by extension) anywhere in the env which may embed the absolute virtualenv path
+PATH_FIXUP_EXTENSIONS = ('.pth', '.egg-link')
+
+
+def getHostCompatibility(pythonVersion=None):
+    '''
+        getHostCompatibility - Get the properties which must match between the exporting and importing host.
+
+        @param pythonVersion <str/None> - The "major.minor" python version. Defaults to the running interpreter.
+
+        @return dict - { 'pythonVersion', 'implementation', 'system', 'machine' }
+    '''
+    return {
+        'pythonVersion'  : pythonVersion or '%d.%d' %(sys.version_info[0], sys.version_info[1]),
+        'implementation' : platform.python_implementation(),
+        'system'         : platform.system(),
+        'machine'        : platform.machine(),
+    }
+
+
+def exportEnv(venvInfo, fileobj, compression='gz'):
+    '''
+        exportEnv - Stream a virtualenv into a compressed tar archive.
+
+            Files are read and compressed straight into #fileobj, so no temporary copy of the env is made.
+
+        @param venvInfo <str/VirtualEnvInfo> - The virtualenv to export
+        @param fileobj <file> - A writable file-like object, e.x. an open file, a socket's makefile('wb'), or sys.stdout's buffer
+        @param compression <str> Default 'gz' - One of 'gz', 'bz2', 'xz' (python3 only), or '' for none
+
+        @return <dict> - The manifest written into the archive
+    '''
+    if not isinstance(venvInfo, VirtualEnvInfo):
+        venvInfo = getInfoFromVirtualEnv(venvInfo)
+    venvDir = venvInfo.virtualenvDirectory
+
+    manifest = getHostCompatibility(VirtualEnvInfo.getPythonVersion(venvDir))
+    manifest['formatVersion'] = EXPORT_FORMAT_VERSION
+    manifest['virtualenvDirectory'] = venvDir
+    manifest['exported'] = time.time()
+
+    manifestData = json.dumps(manifest, sort_keys=True).encode('utf-8')
+
+    tar = tarfile.open(fileobj=fileobj, mode='w|' + compression)
+    try:
+        manifestInfo = tarfile.TarInfo(MANIFEST_NAME)
+        manifestInfo.size = len(manifestData)
+        manifestInfo.mtime = int(manifest['exported'])
+        tar.addfile(manifestInfo, io.BytesIO(manifestData))
+
+        def _filter(tarInfo):
+            # Skip anything transient which may be lingering in the env (sockets, in-progress temp files)
+            if not (tarInfo.isfile() or tarInfo.isdir() or tarInfo.issym() or tarInfo.islnk()):
+                return None
+            if os.path.basename(tarInfo.name).startswith(('venv_req_', '.venv_report_')):
+                return None
+            return tarInfo
+
+        tar.add(venvDir, arcname=ENV_ARCNAME, recursive=True, filter=_filter)
+    finally:
+        tar.close()
+
+    return manifest
+
+
+def _checkCompatibility(manifest):
+    if manifest.get('formatVersion') != EXPORT_FORMAT_VERSION:
+        raise IncompatibleVirtualEnv('Unsupported export format version %s (expected %d).' %(str(manifest.get('formatVersion')), EXPORT_FORMAT_VERSION))
+
+    hostCompatibility = getHostCompatibility()
+    for key in sorted(hostCompatibility.keys()):
+        if manifest.get(key) != hostCompatibility[key]:
+            raise IncompatibleVirtualEnv('Exported env has %s "%s", but this host has "%s".' %(key, str(manifest.get(key)), hostCompatibility[key]))
+
+
+def _needsPathFixup(relPath, binRelDir):
+    fileName = os.path.basename(relPath)
+    if fileName in PATH_FIXUP_FILENAMES or fileName.endswith(PATH_FIXUP_EXTENSIONS):
+        return True
+    # Scripts in bin have shebangs with the absolute path to the env python, and activate scripts set VIRTUAL_ENV
+    return os.path.dirname(relPath) == binRelDir
+
+
+def _fixupRecords(stagingEnvDir, venvDir, rewrittenFiles):
+    '''
+        _fixupRecords - Update the hash and size of every rewritten file in the RECORD of each distribution in a staged env,
+          so the imported env still passes deep verification (@see VirtualEnvOnDemand.Integrity)
+
+        @param stagingEnvDir <str> - The staged env
+        @param venvDir <str> - Where the env is being imported to. Absolute paths within RECORD files already point here.
+        @param rewrittenFiles set<str> - Normalized paths of the staged files which were rewritten
+    '''
+    sitePackagesDirectory = VirtualEnvInfo.getSitePackagesDirectory(stagingEnvDir)
+    if not os.path.isdir(sitePackagesDirectory):
+        return
+
+    for entry in os.listdir(sitePackagesDirectory):
+        recordPath = os.sep.join([sitePackagesDirectory, entry, 'RECORD'])
+        if not entry.endswith('.dist-info') or not os.path.isfile(recordPath):
+            continue
+
+        with open(recordPath, 'rt') as f:
+            rows = [ row for row in csv.reader(f) if row ]
+
+        changed = False
+        for row in rows:
+            if len(row) < 3 or not row[1]:
+                continue
+            recordedPath = row[0]
+            if recordedPath == venvDir or recordedPath.startswith(venvDir + '/'):
+                fullPath = stagingEnvDir + recordedPath[len(venvDir):]
+            else:
+                fullPath = os.sep.join([sitePackagesDirectory] + recordedPath.split('/'))
+            if os.path.normpath(fullPath) in rewrittenFiles:
+                (row[1], fileSize) = _hashFile(fullPath)
+                row[2] = str(fileSize)
+                changed = True
+
+        if changed:
+            _writeRecord(recordPath, rows)
+
+
+def _isWithin(path, directory):
+    '''
+        _isWithin - Check if #path, with every symlink resolved, is #directory or within it. #directory must already be resolved.
+    '''
+    path = os.path.realpath(path)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _checkDestination(destPath, stagingDir, memberName):
+    '''
+        _checkDestination - Make sure a member is extracted within the staging directory, and not through a symlink extracted earlier
+
+        @raises ValueError - If #destPath's parent resolves outside of #stagingDir
+    '''
+    if not _isWithin(os.path.dirname(destPath), stagingDir):
+        raise ValueError('Refusing to extract member through a link outside of env: "%s"' %(memberName,))
+    # Replace (rather than write through) whatever an earlier member left at this path
+    if os.path.islink(destPath) or (os.path.lexists(destPath) and not os.path.isdir(destPath)):
+        os.unlink(destPath)
+
+
+def importEnv(fileobj, parentDirectory, name, checkCompatibility=True):
+    '''
+        importEnv - Extract a virtualenv archive created by exportEnv.
+
+            The archive is read as a stream (so #fileobj can be a pipe or socket). It is extracted into a staging directory
+              alongside the destination, with absolute paths referencing the original location rewritten (pyvenv.cfg, shebangs
+              and activate scripts in the bin dir, RECORD files, .pth files), then renamed into place. The RECORD entries of rewritten
+              files are updated to match.
+
+            Binary launchers (e.x. the .exe wrappers on Windows) are not rewritten.
+
+        @param fileobj <file> - A readable file-like object containing the archive
+        @param parentDirectory <str> - Directory in which to create the env
+        @param name <str> - Name of the env directory. Must not already exist.
+        @param checkCompatibility <bool> Default True - If True, refuse to import an env built for a different python version, implementation, or platform.
+
+        @return <VirtualEnvInfo> - The imported env
+
+        @raises -
+            VirtualEnvOnDemand.exceptions.IncompatibleVirtualEnv - If #checkCompatibility and the env cannot run here
+            ValueError - If the destination already exists, the archive is malformed, or it has a link pointing outside of the env
+                           which a later member would be extracted through
+    '''
+    if name and os.sep in name:
+        raise ValueError('Provided name "%s" must not contain any directories.' %(name,))
+
+    parentDirectory = os.path.realpath(parentDirectory)
+    venvDir = os.sep.join([parentDirectory, name])
+    if os.path.lexists(venvDir):
+        raise ValueError('Destination "%s" already exists.' %(venvDir,))
+
+    stagingDir = os.sep.join([parentDirectory, '.%s.importing.%d' %(name, os.getpid())])
+    stagingEnvDir = os.sep.join([stagingDir, ENV_ARCNAME])
+
+    tar = tarfile.open(fileobj=fileobj, mode='r|*')
+    try:
+        manifestInfo = tar.next()
+        if manifestInfo is None or manifestInfo.name != MANIFEST_NAME:
+            raise ValueError('Archive was not created by exportEnv (missing manifest).')
+        manifest = json.loads(tar.extractfile(manifestInfo).read().decode('utf-8'))
+
+        if checkCompatibility:
+            _checkCompatibility(manifest)
+
+        oldPath = manifest['virtualenvDirectory']
+        (oldPathBytes, newPathBytes) = (oldPath.encode('utf-8'), venvDir.encode('utf-8'))
+        binRelDir = os.path.relpath(VirtualEnvInfo.getBinDir(oldPath), oldPath).replace(os.sep, '/')
+
+        os.makedirs(stagingDir)
+        stagingDir = os.path.realpath(stagingDir)
+
+        directories = []
+        # rewrittenFiles - Staged files whose contents were changed by the path fixup
+        rewrittenFiles = set()
+        for member in tar:
+            if member is manifestInfo:
+                continue
+            relPath = os.path.normpath(member.name).replace(os.sep, '/')
+            if relPath != ENV_ARCNAME and not relPath.startswith(ENV_ARCNAME + '/'):
+                raise ValueError('Unexpected member in archive: "%s"' %(member.name,))
+            if '..' in relPath.split('/'):
+                raise ValueError('Refusing to extract member outside of env: "%s"' %(member.name,))
+
+            envRelPath = relPath[len(ENV_ARCNAME) + 1:]
+            destPath = os.sep.join([stagingDir] + relPath.split('/'))
+
+            if member.isdir():
+                if os.path.islink(destPath) or not os.path.isdir(destPath):
+                    _checkDestination(destPath, stagingDir, member.name)
+                    os.makedirs(destPath)
+                directories.append( (destPath, member) )
+                continue
+
+            _checkDestination(destPath, stagingDir, member.name)
+            if member.issym():
+                # The link itself may point anywhere (e.x. bin/python to the base interpreter), but nothing is ever extracted through it
+                linkTarget = member.linkname
+                if linkTarget == oldPath or linkTarget.startswith(oldPath + os.sep):
+                    linkTarget = venvDir + linkTarget[len(oldPath):]
+                os.symlink(linkTarget, destPath)
+            elif member.islnk():
+                linkRelPath = os.path.normpath(member.linkname).replace(os.sep, '/')
+                linkSource = os.sep.join([stagingDir] + linkRelPath.split('/'))
+                if not linkRelPath.startswith(ENV_ARCNAME + '/') or '..' in linkRelPath.split('/') or not _isWithin(linkSource, stagingDir):
+                    raise ValueError('Refusing to hardlink to a file outside of env: "%s" -> "%s"' %(member.name, member.linkname))
+                os.link(linkSource, destPath)
+            elif member.isfile():
+                srcFile = tar.extractfile(member)
+                with open(destPath, 'wb') as destFile:
+                    if _needsPathFixup(envRelPath, binRelDir):
+                        contents = srcFile.read()
+                        if b'\0' not in contents[:1024] and oldPathBytes in contents:
+                            contents = contents.replace(oldPathBytes, newPathBytes)
+                            rewrittenFiles.add(os.path.normpath(destPath))
+                        destFile.write(contents)
+                    else:
+                        shutil.copyfileobj(srcFile, destFile)
+                os.chmod(destPath, member.mode)
+                os.utime(destPath, (member.mtime, member.mtime))
+
+        # Apply directory permissions last, in case any are read-only
+        for (destPath, member) in directories:
+            os.chmod(destPath, member.mode)
+
+        # The env python links to the base interpreter, which must exist at the same location on this host.
+        stagingPythonBin = VirtualEnvInfo.getPythonBin(stagingEnvDir)
+        if checkCompatibility and os.path.islink(stagingPythonBin) and not os.path.exists(stagingPythonBin):
+            raise IncompatibleVirtualEnv('Base interpreter "%s" used by exported env does not exist on this host.' %(os.readlink(stagingPythonBin),))
+
+        if rewrittenFiles:
+            _fixupRecords(stagingEnvDir, venvDir, rewrittenFiles)
+
+        # Validated before it is moved into place, so a failed import leaves nothing behind
+        getInfoFromVirtualEnv(stagingEnvDir, validate=True)
+
+        os.rename(stagingEnvDir, venvDir)
+    finally:
+        tar.close()
+        shutil.rmtree(stagingDir, ignore_errors=True)
+
+    return getInfoFromVirtualEnv(venvDir, validate=False)
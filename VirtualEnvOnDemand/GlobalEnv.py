@@ -5,16 +5,30 @@
 '''
 
 # vim: ts=4 sw=4 expandtab
+import atexit
 import imp
+import os
+import shutil
 import sys
 import tempfile
+import threading
+import time
 
 from .CreateEnv import createEnv, activateEnv
 from .InstallPackages import installPackages, ensureImport
 from .VirtualEnvInfo import VirtualEnvInfo, VirtualEnvDeferredBuild, getInfoFromVirtualEnv
+from .InstallProfile import getInstallProfilePath, readInstallProfile, recordProfiledInstall, forgetProfiledInstall
+from .Metrics import IMPORTER_DECISIONS, IMPORTER_INSTALL_SECONDS
+from .BuildDaemon import buildPriority, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from .ResourcePolicy import lowestPriority
+from .Placement import placeTemporaryEnv
 from .exceptions import VirtualEnvDoesNotExist
 
-__all__ = ('globalOnDemandVirtualEnv', 'isOnDemandImporterEnabled', 'getGlobalVirtualEnvInfo', 'enableOnDemandImporter', 'ensureImportGlobal', 'VirtualEnvOnDemandImporter', 'toggleOnDemandImporter', 'toggleDebug')
+__all__ = ('globalOnDemandVirtualEnv', 'isOnDemandImporterEnabled', 'getGlobalVirtualEnvInfo', 'enableOnDemandImporter', 'ensureImportGlobal', 'VirtualEnvOnDemandImporter', 'toggleOnDemandImporter', 'toggleDebug', 'CircuitBreaker', 'getOnDemandCircuitBreaker',
+    'waitForInstallReplay', 'cancelGlobalEnvPrebuild',
+    'addImporterDecisionListener', 'removeImporterDecisionListener',
+    'DECISION_PRESENT', 'DECISION_KNOWN_FAILURE', 'DECISION_CIRCUIT_OPEN', 'DECISION_BUILD_ENV', 'DECISION_INSTALL', 'DECISION_INSTALL_FAILED',
+)
 
 global globalOnDemandVirtualEnv
 globalOnDemandVirtualEnv = None
@@ -22,10 +36,81 @@ global isOnDemandImporterEnabled
 isOnDemandImporterEnabled = False
 global knownFailures
 knownFailures = set()
+global onDemandCircuitBreaker
+onDemandCircuitBreaker = None
+global onDemandInstallTimeout
+onDemandInstallTimeout = None
+global onDemandInstallProfile
+onDemandInstallProfile = None
+
+# _replayThread - The thread replaying the install profile in the background, @see enableOnDemandImporter "replayInBackground"
+_replayThread = None
+# _replayLocal.isReplaying - True on a thread which is replaying the install profile. The on-demand importer is inactive there.
+_replayLocal = threading.local()
+
+# _prebuildThread - The thread speculatively building the deferred global env, @see enableOnDemandImporter "prebuildInBackground"
+_prebuildThread = None
+# _prebuildState - The prebuild's reserved 'directory' and its 'placement' (or None), the built 'env' (or None), and whether it was 'cancelled' or 'adopted' as the global env
+_prebuildState = None
+_prebuildLock = threading.Lock()
+# _prebuildLocal.isPrebuilding - True on the prebuild thread. The on-demand importer is inactive there.
+_prebuildLocal = threading.local()
 
 global debug
 debug = False
 
+# Decisions made by the on-demand importer, @see addImporterDecisionListener
+
+# DECISION_PRESENT - The module could already be found, so nothing was done
+DECISION_PRESENT = 'present'
+# DECISION_KNOWN_FAILURE - An install was already attempted for this module, so it was skipped
+DECISION_KNOWN_FAILURE = 'knownFailure'
+# DECISION_CIRCUIT_OPEN - Installs are failing, so it was skipped. @see CircuitBreaker
+DECISION_CIRCUIT_OPEN = 'circuitOpen'
+# DECISION_BUILD_ENV - The deferred global env was built
+DECISION_BUILD_ENV = 'buildEnv'
+# DECISION_INSTALL - The package was installed
+DECISION_INSTALL = 'install'
+# DECISION_INSTALL_FAILED - An install was attempted, and failed
+DECISION_INSTALL_FAILED = 'installFailed'
+
+# _NOT_FOUND_MARKER - In pip's output when the index has no such package
+_NOT_FOUND_MARKER = 'No matching distribution found'
+# _UNREACHABLE_MARKERS - In pip's output when the index could not be reached (in which case it reports everything as not found, too)
+_UNREACHABLE_MARKERS = ('Retrying (', 'Could not fetch URL', 'NewConnectionError', 'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'ProxyError', 'SSLError')
+
+_importerDecisionListeners = []
+
+def addImporterDecisionListener(listener):
+    '''
+        addImporterDecisionListener - Register a function to be called with every decision made by the on-demand importer.
+
+            @param listener <function> - Called as listener(moduleName, decision), where decision is one of the DECISION_* constants.
+                                          Exceptions raised by the listener are ignored, so they never break an import.
+    '''
+    if listener not in _importerDecisionListeners:
+        _importerDecisionListeners.append(listener)
+
+def removeImporterDecisionListener(listener):
+    '''
+        removeImporterDecisionListener - Unregister a function added by addImporterDecisionListener
+
+            @return <bool> - True if it was registered
+    '''
+    try:
+        _importerDecisionListeners.remove(listener)
+    except ValueError:
+        return False
+    return True
+
+def _noteImporterDecision(moduleName, decision):
+    IMPORTER_DECISIONS.inc(decision=decision)
+    for listener in list(_importerDecisionListeners):
+        try:
+            listener(moduleName, decision)
+        except Exception:
+            pass
+
 def toggleDebug(isDebug):
     '''
         toggleDebug - Toggle debug messages. Default disabled.
@@ -41,6 +126,89 @@ def toggleDebug(isDebug):
     debug = isDebug
     return oldValue
 
+class CircuitBreaker(object):
+    '''
+        CircuitBreaker - Stops attempting an operation after it has failed #failureThreshold times in a row.
+
+            Used by the on-demand importer so that when the package index is unreachable, every failed import
+              does not pay for another pip run (and its timeout). Once open, no attempts are allowed until #cooldown seconds
+              have passed, after which a single trial attempt is let through. If it succeeds the breaker closes, otherwise it re-opens.
+
+            The importer counts an install of a package which the index does not have as a success, as the index did answer.
+    '''
+
+    __slots__ = ('failureThreshold', 'cooldown', 'consecutiveFailures', 'openedAt', 'trialInProgress', '_lock')
+
+    def __init__(self, failureThreshold=5, cooldown=60.0):
+        '''
+            @param failureThreshold <int> Default 5 - Number of consecutive failures which opens the breaker
+            @param cooldown <float> Default 60.0 - Seconds the breaker stays open before allowing a trial attempt
+        '''
+        if failureThreshold < 1:
+            raise ValueError('failureThreshold must be >= 1')
+
+        self.failureThreshold = failureThreshold
+        self.cooldown = cooldown
+        self.consecutiveFailures = 0
+        self.openedAt = None
+        self.trialInProgress = False
+        self._lock = threading.Lock()
+
+    @property
+    def isOpen(self):
+        '''
+            isOpen - True if attempts are currently being refused
+        '''
+        return self.openedAt is not None
+
+    def allowAttempt(self):
+        '''
+            allowAttempt - Check if an attempt may be made. The result of an allowed attempt must be reported with recordSuccess or recordFailure.
+
+            @return <bool> - True if the attempt may proceed
+        '''
+        with self._lock:
+            if self.openedAt is None:
+                return True
+            if self.trialInProgress or time.time() - self.openedAt < self.cooldown:
+                return False
+            self.trialInProgress = True
+            return True
+
+    def recordSuccess(self):
+        '''
+            recordSuccess - Record a successful attempt, closing the breaker
+        '''
+        with self._lock:
+            self.consecutiveFailures = 0
+            self.openedAt = None
+            self.trialInProgress = False
+
+    def recordFailure(self):
+        '''
+            recordFailure - Record a failed attempt, opening the breaker if the threshold has been reached
+        '''
+        with self._lock:
+            self.consecutiveFailures += 1
+            if self.trialInProgress or self.consecutiveFailures >= self.failureThreshold:
+                self.openedAt = time.time()
+            self.trialInProgress = False
+
+    def reset(self):
+        '''
+            reset - Close the breaker and forget past failures
+        '''
+        self.recordSuccess()
+
+
+def getOnDemandCircuitBreaker():
+    '''
+        getOnDemandCircuitBreaker - Get the CircuitBreaker guarding installs by the on-demand importer
+
+        @return <CircuitBreaker/None> - The breaker, or None if enableOnDemandImporter has not been called or it was disabled.
+    '''
+    return onDemandCircuitBreaker
+
 def getGlobalVirtualEnvInfo():
     '''
         getGlobalVirtualEnvInfo - Returns the VirtualEnvInfo object representing the global environment, or None if not setup.
@@ -51,6 +219,196 @@ def getGlobalVirtualEnvInfo():
     '''
     return globalOnDemandVirtualEnv
 
+def _buildDeferredGlobalEnv():
+    '''
+        _buildDeferredGlobalEnv - If the global env's build was deferred (enableOnDemandImporter with deferSetup=True), build it now.
+
+        @return <VirtualEnvInfo/None> - The global env
+    '''
+    global globalOnDemandVirtualEnv
+    if not getattr(_replayLocal, 'isReplaying', False):
+        # The replay may be building it right now
+        waitForInstallReplay()
+
+    if isinstance(globalOnDemandVirtualEnv, VirtualEnvDeferredBuild):
+        prebuiltEnv = _adoptGlobalEnvPrebuild()
+        if prebuiltEnv is not None:
+            activateEnv(prebuiltEnv)
+            globalOnDemandVirtualEnv = prebuiltEnv
+            return globalOnDemandVirtualEnv
+
+        if getattr(_replayLocal, 'isReplaying', False):
+            # The importer is already inactive on this thread, and toggling it would affect imports on every other thread
+            globalOnDemandVirtualEnv = createEnv(packages=None, parentDirectory=globalOnDemandVirtualEnv.virtualenvDirectory, stdout=None, stderr=None)
+            return globalOnDemandVirtualEnv
+
+        # We need to disable our custom importer while building the virtualenv
+        toggleOnDemandImporter(False)
+        try:
+            globalOnDemandVirtualEnv = createEnv(packages=None, parentDirectory=globalOnDemandVirtualEnv.virtualenvDirectory, stdout=None, stderr=None)
+        finally:
+            toggleOnDemandImporter(True)
+    return globalOnDemandVirtualEnv
+
+def _prebuildGlobalEnv(state):
+    '''
+        _prebuildGlobalEnv - Speculatively build the deferred global env into the reserved directory, at the lowest priority.
+
+            The result is only used if an import misses (@see _adoptGlobalEnvPrebuild), otherwise it is removed at exit.
+    '''
+    _prebuildLocal.isPrebuilding = True
+    venv = None
+    try:
+        with lowestPriority():
+            with buildPriority(PRIORITY_BACKGROUND):
+                venv = createEnv(packages=None, parentDirectory=os.path.dirname(state['directory']), name=os.path.basename(state['directory']),
+                    stdout=None, stderr=None, activateEnvironment=False)
+    except Exception as e:
+        if debug is True:
+            sys.stderr.write('Prebuilding the on-demand env failed: %s: %s\n' %(e.__class__.__name__, str(e)))
+    finally:
+        _prebuildLocal.isPrebuilding = False
+
+    with _prebuildLock:
+        if venv is not None and not state['cancelled']:
+            state['env'] = venv
+            if state['placement'] is not None:
+                state['placement'].assign(state['directory'])
+            return
+    _removeGlobalEnvPrebuild(state)
+
+def _removeGlobalEnvPrebuild(state):
+    shutil.rmtree(state['directory'], ignore_errors=True)
+    if state['placement'] is not None:
+        state['placement'].release()
+
+def _adoptGlobalEnvPrebuild():
+    '''
+        _adoptGlobalEnvPrebuild - Take the speculatively built global env, waiting for whatever is left of its build
+
+        @return <VirtualEnvInfo/None> - The env, or None if there is no prebuild or it failed or was cancelled
+    '''
+    state = _prebuildState
+    if state is None or state['cancelled']:
+        return None
+
+    startTime = time.time()
+    _joinReleasingImportLock(_prebuildThread)
+    with _prebuildLock:
+        if state['env'] is None or state['cancelled']:
+            return None
+        state['adopted'] = True
+
+    if debug is True:
+        sys.stderr.write('Using the prebuilt on-demand env "%s" (waited %.3fs)\n' %(state['directory'], time.time() - startTime))
+    return state['env']
+
+def cancelGlobalEnvPrebuild():
+    '''
+        cancelGlobalEnvPrebuild - Discard the speculative build of the deferred global env (@see enableOnDemandImporter "prebuildInBackground"),
+          if no import has needed it yet. Called at exit.
+
+            A build in progress is not interrupted. It finishes at the lowest priority, and is then removed.
+
+        @return <bool> - True if a prebuild was discarded
+    '''
+    state = _prebuildState
+    if state is None:
+        return False
+    with _prebuildLock:
+        if state['cancelled'] or state['adopted']:
+            return False
+        state['cancelled'] = True
+
+    if not _prebuildThread.is_alive():
+        _removeGlobalEnvPrebuild(state)
+    return True
+
+def _discardGlobalEnvPrebuildAtExit():
+    if cancelGlobalEnvPrebuild() and _prebuildThread.is_alive():
+        # The thread dies with the process, so will not be removing what it built so far
+        _removeGlobalEnvPrebuild(_prebuildState)
+
+def _isImportable(moduleName):
+    try:
+        imp.find_module(moduleName)
+        return True
+    except ImportError:
+        return False
+
+def _replayInstallProfile(profilePath):
+    '''
+        _replayInstallProfile - Install every package recorded in the install profile which is not already importable, with one install.
+
+            If the batched install fails, nothing more is done here. The on-demand importer will then install
+              the packages one by one as they are imported, and forget any which can no longer be installed.
+    '''
+    _replayLocal.isReplaying = True
+    try:
+        packageNames = [ packageName for packageName in readInstallProfile(profilePath) if not _isImportable(packageName) ]
+        if not packageNames:
+            return
+
+        if debug is True:
+            sys.stderr.write('Replaying on-demand installs from "%s": %s\n' %(profilePath, ', '.join(packageNames)))
+
+        try:
+            venv = _buildDeferredGlobalEnv()
+            installPackages(packageNames, venv['virtualenvDirectory'], None, None, timeout=onDemandInstallTimeout, retries=0)
+        except Exception as e:
+            if debug is True:
+                sys.stderr.write('Replaying on-demand installs failed: %s: %s\n' %(e.__class__.__name__, str(e)))
+    finally:
+        _replayLocal.isReplaying = False
+
+def waitForInstallReplay(timeout=None):
+    '''
+        waitForInstallReplay - Wait for a background replay of the install profile (enableOnDemandImporter(..., replayInBackground=True)) to complete.
+
+            The on-demand importer waits for this itself before installing anything, so calling this is only needed
+              to block until the replay is done, e.x. before forking.
+
+        @param timeout <float/None> - Maximum number of seconds to wait, or None to wait forever.
+
+        @return <bool> - True if no replay is still running
+    '''
+    return _joinReleasingImportLock(_replayThread, timeout)
+
+def _joinReleasingImportLock(thread, timeout=None):
+    '''
+        _joinReleasingImportLock - Wait for a background thread (replay, prebuild) which may need to import things itself
+
+        @return <bool> - True if #thread is not running
+    '''
+    if thread is None or thread is threading.current_thread():
+        return True
+
+    # Meta path finders (like the on-demand importer) are called with the global import lock held. The background thread needs it
+    #  to import anything, so it must be released while waiting. This thread keeps the lock of the module it is importing.
+    releasedLevels = _releaseImportLock()
+    try:
+        thread.join(timeout)
+    finally:
+        for i in range(releasedLevels):
+            imp.acquire_lock()
+    return not thread.is_alive()
+
+def _releaseImportLock():
+    '''
+        _releaseImportLock - Fully release the global import lock, if held by this thread
+
+        @return <int> - The number of (re-entrant) levels released, which must be re-acquired
+    '''
+    releasedLevels = 0
+    while imp.lock_held():
+        try:
+            imp.release_lock()
+        except RuntimeError:
+            # Held by another thread
+            break
+        releasedLevels += 1
+    return releasedLevels
+
 def setGlobalVirtualEnv(venv, enableOnDemandImporter=True):
     '''
         setGlobalVirtualEnv - Sets the global virtualenv to be used by the on demand importer.
@@ -73,31 +431,75 @@ def setGlobalVirtualEnv(venv, enableOnDemandImporter=True):
     return globalOnDemandVirtualEnv
 
 
-def enableOnDemandImporter(tmpDir=None, deferSetup=True, noRetryFailedPackages=True):
+def enableOnDemandImporter(tmpDir=None, deferSetup=True, noRetryFailedPackages=True, installTimeout=None, circuitBreakerThreshold=5, circuitBreakerCooldown=60.0, installProfile=None, replayInBackground=False,
+        prebuildInBackground=False):
     '''
         enableOnDemandImporter - Calling this method turns on the "on demand" importer. A temporary global env is created, and all failed imports will attempt an installation.
 
-           @param tmpDir <str/None> - Temporary directory to use. A subdirectory will be created within this. Defaults to tempfile.gettempdir()
+           @param tmpDir <str/None> - Temporary directory to use. A subdirectory will be created within this. Defaults to tempfile.gettempdir(),
+                                        or a memory-backed filesystem per the placement policy. @see VirtualEnvOnDemand.Placement.setPlacementPolicy
            @param deferSetup <bool> - If True (default), defers setup (which can take a couple seconds) until the first failed import or attempted install.
                                         Setup takes a couple seconds. Use this to always enable on-demand importer, but give advantage if all modules are present.
                                         If False, the ondemand virtualenv will be setup right-away. If you are using this in a multi-threaded environment, this should be set to False.
            @param noRetryFailedPackages <bool> - If True (default), a package which fails to download will not be retried. This is a performance savings. This should generally always be True,
                                                    unless you are using VirtualEnvOnDemand to have a running process written to work with an unreleased module to prevent a restart or something similar.
+           @param installTimeout <float/None> - Maximum seconds an on-demand install may block the import. Default None uses the timeout from setInstallPolicy.
+                                                  The on-demand importer never retries, as the import is blocked waiting.
+           @param circuitBreakerThreshold <int/None> - After this many consecutive failed installs (default 5), the on-demand importer stops
+                                                  attempting installs for #circuitBreakerCooldown seconds. None disables. @see CircuitBreaker
+           @param circuitBreakerCooldown <float> - Seconds to stop attempting installs once the circuit breaker opens. Default 60.
+           @param installProfile <None/bool/str> - If True, every package the on-demand importer installs successfully is recorded, in order,
+                                                  into an install profile within #tmpDir. A str is an explicit path to the profile instead.
+                                                  The packages recorded by previous runs which are not importable are then installed right away,
+                                                  in one batch, so this run does not discover them one import at a time. @see VirtualEnvOnDemand.InstallProfile
+           @param replayInBackground <bool> - If True (default False), the recorded packages are installed on a background thread, and this returns
+                                                  right away. An on-demand import waits for that install to finish before doing anything.
+                                                  @see waitForInstallReplay
+           @param prebuildInBackground <bool> - If True (default False), and #deferSetup is True, the env is built right away on a background thread,
+                                                  at the lowest CPU and I/O priority. The first failed import then only waits for whatever is left
+                                                  of that build. If no import fails, the env is removed at exit. @see cancelGlobalEnvPrebuild
     '''
-    global isOnDemandImporterEnabled, globalOnDemandVirtualEnv, knownFailures
+    global isOnDemandImporterEnabled, globalOnDemandVirtualEnv, knownFailures, onDemandCircuitBreaker, onDemandInstallTimeout, onDemandInstallProfile, _replayThread
+    global _prebuildThread, _prebuildState
     if isOnDemandImporterEnabled is True:
         return
     if deferSetup is False:
         globalOnDemandVirtualEnv = createEnv(packages=None, parentDirectory=tmpDir, stdout=None, stderr=None)
     else:
-        globalOnDemandVirtualEnv = VirtualEnvDeferredBuild(parentDirectory=tmpDir or tempfile.gettempdir())
+        # Without a #tmpDir, the env is placed when it is built
+        globalOnDemandVirtualEnv = VirtualEnvDeferredBuild(parentDirectory=tmpDir)
+        if prebuildInBackground and _prebuildState is None:
+            placement = placeTemporaryEnv() if tmpDir is None else None
+            # Reserve the directory now, so it can be cleaned up even if the process exits mid-build
+            _prebuildState = { 'directory' : tempfile.mkdtemp(prefix='venv_', dir=placement.parentDirectory if placement else tmpDir),
+                'placement' : placement, 'env' : None, 'cancelled' : False, 'adopted' : False }
+            atexit.register(_discardGlobalEnvPrebuildAtExit)
+            _prebuildThread = threading.Thread(target=_prebuildGlobalEnv, args=(_prebuildState,), name='VirtualEnvOnDemand-prebuild')
+            _prebuildThread.daemon = True
+            _prebuildThread.start()
 
     if noRetryFailedPackages is False:
         knownFailures = None
 
+    onDemandInstallTimeout = installTimeout
+    if circuitBreakerThreshold:
+        onDemandCircuitBreaker = CircuitBreaker(circuitBreakerThreshold, circuitBreakerCooldown)
+    else:
+        onDemandCircuitBreaker = None
+
+    onDemandInstallProfile = getInstallProfilePath(tmpDir or tempfile.gettempdir(), installProfile)
+
     sys.meta_path = [VirtualEnvOnDemandImporter()] + sys.meta_path
     isOnDemandImporterEnabled = True
 
+    if onDemandInstallProfile:
+        if replayInBackground:
+            _replayThread = threading.Thread(target=_replayInstallProfile, args=(onDemandInstallProfile,), name='VirtualEnvOnDemand-replay')
+            _replayThread.daemon = True
+            _replayThread.start()
+        else:
+            _replayInstallProfile(onDemandInstallProfile)
+
 
 def toggleOnDemandImporter(isActive):
     '''
@@ -161,23 +563,40 @@ def ensureImportGlobal(importName, packageName=None, stdout=None, stderr=None):
 
             NOTE: With this method, PipInstallFailed will be intercepted and ImportError thrown instead, as this is intended to be a drop-in replacement for "import" when the package name differs.
     '''
-    global isOnDemandImporterEnabled, globalOnDemandVirtualEnv
+    global isOnDemandImporterEnabled
     if isOnDemandImporterEnabled is False:
         raise ValueError('Must call enableOnDemandImporter() before using ensureImportGlobal')
 
+    waitForInstallReplay()
+
     try:
         return ensureImport(importName, globalOnDemandVirtualEnv, packageName, stdout, stderr)
     except VirtualEnvDoesNotExist as e:
         if isinstance(globalOnDemandVirtualEnv, VirtualEnvDeferredBuild):
-            toggleOnDemandImporter(False)
-            globalOnDemandVirtualEnv = createEnv(packages=None, parentDirectory=globalOnDemandVirtualEnv.virtualenvDirectory, stdout=None, stderr=None)
-            toggleOnDemandImporter(True)
-            return ensureImport(importName, globalOnDemandVirtualEnv, packageName, stdout, stderr)
+            return ensureImport(importName, _buildDeferredGlobalEnv(), packageName, stdout, stderr)
         else:
             raise
         
         
 
+def _isPackageNotFound(pipOutput):
+    '''
+        _isPackageNotFound - Check if a failed install was because the index has no such package, rather than a transient failure
+
+        @param pipOutput <file> - pip's stderr, from the failed install
+
+        @return <bool>
+    '''
+    try:
+        pipOutput.seek(0)
+        output = pipOutput.read()
+    except (IOError, OSError, ValueError):
+        return False
+    if _NOT_FOUND_MARKER not in output:
+        return False
+    return not [ marker for marker in _UNREACHABLE_MARKERS if marker in output ]
+
+
 class VirtualEnvOnDemandImporter(object):
     '''
         VirtualEnvOnDemandImporter - The workhouse of auto-importing. Upon an import that wouldn't resolve, it will try to install the leading package name using pip.
@@ -186,7 +605,7 @@ class VirtualEnvOnDemandImporter(object):
 
     def find_module(self, fullname, path=None):
         # Try to see if already installed or loaded, and fall back to default loader
-        if path is not None:
+        if path is not None or getattr(_replayLocal, 'isReplaying', False) or getattr(_prebuildLocal, 'isPrebuilding', False):
             return None
 
         if fullname in sys.modules or fullname.split('.')[0] in sys.modules:
@@ -194,10 +613,12 @@ class VirtualEnvOnDemandImporter(object):
 
         try:
             imp.find_module(fullname, path)
+            _noteImporterDecision(fullname, DECISION_PRESENT)
             return None
         except ImportError:
             try:
                 imp.find_module(fullname.split('.')[0], path)
+                _noteImporterDecision(fullname, DECISION_PRESENT)
                 return None
             except ImportError:
                 pass
@@ -208,24 +629,56 @@ class VirtualEnvOnDemandImporter(object):
             # We are tracking failures and already know this has failed
             if debug is True:
                 sys.stderr.write('Skipping %s because in known-failure list\n' %(moduleName,))
+            _noteImporterDecision(moduleName, DECISION_KNOWN_FAILURE)
             return None
 
-        global globalOnDemandVirtualEnv
-        if isinstance(globalOnDemandVirtualEnv, VirtualEnvDeferredBuild):
-            # Virtualenv build was deferred, so go ahead and do it.
+        circuitBreaker = onDemandCircuitBreaker
+        if circuitBreaker is not None and not circuitBreaker.allowAttempt():
+            if debug is True:
+                sys.stderr.write('Skipping %s because installs are failing (circuit breaker is open)\n' %(moduleName,))
+            _noteImporterDecision(moduleName, DECISION_CIRCUIT_OPEN)
+            return None
 
-            # We need to disable our custom importer while building the virtualenv
-            toggleOnDemandImporter(False)
-            globalOnDemandVirtualEnv = createEnv(packages=None, parentDirectory=globalOnDemandVirtualEnv.virtualenvDirectory, stdout=None, stderr=None)
-            toggleOnDemandImporter(True)
-            
-            
+        if _replayThread is not None and _replayThread.is_alive():
+            # The install profile is being replayed, which may be installing this very package
+            waitForInstallReplay()
+            if _isImportable(moduleName):
+                _noteImporterDecision(moduleName, DECISION_PRESENT)
+                return None
+
+        startTime = time.time()
+        # pipOutput - pip's stderr, to tell a package which does not exist from an index which cannot be reached
+        pipOutput = tempfile.TemporaryFile(mode='w+t')
         try:
-            installPackages(moduleName, globalOnDemandVirtualEnv['virtualenvDirectory'], None, None)
+            if isinstance(globalOnDemandVirtualEnv, VirtualEnvDeferredBuild):
+                # Virtualenv build was deferred, so go ahead and do it. Within the try, so a failure is reported to the circuit breaker.
+                _buildDeferredGlobalEnv()
+                _noteImporterDecision(moduleName, DECISION_BUILD_ENV)
+
+            # An import is blocked on this, so it goes ahead of other builds queued on the build daemon
+            with buildPriority(PRIORITY_INTERACTIVE):
+                installPackages(moduleName, globalOnDemandVirtualEnv['virtualenvDirectory'], None, pipOutput, timeout=onDemandInstallTimeout, retries=0)
+            IMPORTER_INSTALL_SECONDS.observe(time.time() - startTime, result='success')
+            if circuitBreaker is not None:
+                circuitBreaker.recordSuccess()
+            if onDemandInstallProfile:
+                recordProfiledInstall(onDemandInstallProfile, moduleName)
+            _noteImporterDecision(moduleName, DECISION_INSTALL)
         except:
 #            msg = 'VirtualEnvOnDemand: Unable to resolve and install package to satisfy %s.' %(moduleName,)
 #            sys.stderr.write(msg + '\n')
-            pass
+            IMPORTER_INSTALL_SECONDS.observe(time.time() - startTime, result='failure')
+            if circuitBreaker is not None:
+                if _isPackageNotFound(pipOutput):
+                    # The index answered, there is just no such package (e.x. an optional import being probed). Installs are working.
+                    circuitBreaker.recordSuccess()
+                else:
+                    circuitBreaker.recordFailure()
+            if onDemandInstallProfile:
+                forgetProfiledInstall(onDemandInstallProfile, moduleName)
+            _noteImporterDecision(moduleName, DECISION_INSTALL_FAILED)
+        finally:
+            pipOutput.close()
         if knownFailures is not None:
             knownFailures.add(moduleName)
 
@@ -0,0 +1,399 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    ImportProfiler - Opt-in profiling of imports, attributing time, stat calls, and on-demand importer decisions
+      to each module and to the sys.path entry (i.e. which activated env, or the standard library) that served it.
+
+      Example:
+
+        from VirtualEnvOnDemand.ImportProfiler import ImportProfiler
+
+        with ImportProfiler() as profiler:
+            setupAndActivateEnv(...)
+            import myapp
+
+        sys.stderr.write(profiler.formatReport(limit=25))
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import builtins
+except ImportError:
+    # python2
+    import __builtin__ as builtins
+
+try:
+    from importlib import _bootstrap_external
+except ImportError:
+    _bootstrap_external = None
+
+from .GlobalEnv import addImporterDecisionListener, removeImporterDecisionListener
+
+__all__ = ('ImportProfiler', 'ImportRecord', 'enableImportProfiler', 'disableImportProfiler', 'REPORT_SORT_KEYS')
+
+# REPORT_SORT_KEYS - Valid "sortBy" values for ImportProfiler.getRecords / formatReport
+REPORT_SORT_KEYS = ('selfTime', 'totalTime', 'findTime', 'statCalls', 'count', 'moduleName')
+
+
+class ImportRecord(object):
+    '''
+        ImportRecord - What the profiler observed importing one module
+
+            totalTime - Seconds spent importing this module, including the modules it imported
+            selfTime  - Seconds spent importing this module, excluding the modules it imported
+            findTime  - Seconds spent by meta path finders (including the on-demand importer) locating this module
+            statCalls - Number of stat calls made while importing this module (excluding the modules it imported)
+            decisions - Map of on-demand importer decision -> count, @see VirtualEnvOnDemand.GlobalEnv.DECISION_PRESENT
+            servedBy  - The sys.path entry the module was loaded from, or None (builtin, not found, etc)
+    '''
+
+    __slots__ = ('moduleName', 'servedBy', 'count', 'totalTime', 'selfTime', 'findTime', 'statCalls', 'decisions')
+
+    def __init__(self, moduleName):
+        self.moduleName = moduleName
+        self.servedBy = None
+        self.count = 0
+        self.totalTime = 0.0
+        self.selfTime = 0.0
+        self.findTime = 0.0
+        self.statCalls = 0
+        self.decisions = {}
+
+    def toDict(self):
+        '''
+            toDict - Get this record as a dict, e.x. for JSON
+        '''
+        return dict( [ (key, getattr(self, key)) for key in ImportRecord.__slots__ ] )
+
+    def __repr__(self):
+        return 'ImportRecord(%r, servedBy=%r, count=%d, totalTime=%.6f, selfTime=%.6f, findTime=%.6f, statCalls=%d, decisions=%r)' %(
+            self.moduleName, self.servedBy, self.count, self.totalTime, self.selfTime, self.findTime, self.statCalls, self.decisions)
+
+
+class ImportProfiler(object):
+    '''
+        ImportProfiler - Profile imports while enabled. Use enable/disable, or as a context manager.
+
+            The builtin __import__, os.stat, the import system's stat, and the find method of each finder on sys.meta_path
+              (including the on-demand importer) are wrapped while enabled. Finders added after enabling are not timed.
+              Imports done via importlib.import_module do not pass through __import__, so only their find time is recorded.
+
+            Only imports which load something new are recorded. Imports of already-loaded modules are not.
+    '''
+
+    def __init__(self):
+        # records - Map of module name -> ImportRecord
+        self.records = {}
+        self.isEnabled = False
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # _patchedFinders - list of ( finder, attribute name, original value in its __dict__ or None )
+        self._patchedFinders = []
+        self._originalImport = None
+        self._originalStat = None
+        self._originalPathStat = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.disable()
+
+    def enable(self):
+        '''
+            enable - Start profiling imports
+        '''
+        if self.isEnabled:
+            return
+
+        self._originalImport = builtins.__import__
+        builtins.__import__ = self._profiledImport
+
+        self._originalStat = os.stat
+        os.stat = self._countingStatWrapper(self._originalStat)
+
+        if _bootstrap_external is not None and hasattr(_bootstrap_external, '_path_stat'):
+            self._originalPathStat = _bootstrap_external._path_stat
+            _bootstrap_external._path_stat = self._countingStatWrapper(self._originalPathStat)
+
+        for finder in list(sys.meta_path):
+            for attrName in ('find_spec', 'find_module'):
+                self._patchFinder(finder, attrName)
+
+        addImporterDecisionListener(self._noteDecision)
+        self.isEnabled = True
+
+    def disable(self):
+        '''
+            disable - Stop profiling imports. Collected records are kept.
+        '''
+        if not self.isEnabled:
+            return
+
+        removeImporterDecisionListener(self._noteDecision)
+
+        for (finder, attrName, originalValue) in reversed(self._patchedFinders):
+            try:
+                if originalValue is None:
+                    delattr(finder, attrName)
+                else:
+                    setattr(finder, attrName, originalValue)
+            except (AttributeError, TypeError):
+                pass
+        self._patchedFinders = []
+
+        if self._originalPathStat is not None:
+            _bootstrap_external._path_stat = self._originalPathStat
+            self._originalPathStat = None
+
+        os.stat = self._originalStat
+        builtins.__import__ = self._originalImport
+        self.isEnabled = False
+
+    def reset(self):
+        '''
+            reset - Discard all collected records
+        '''
+        with self._lock:
+            self.records = {}
+
+    def _getStack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _getRecord(self, moduleName):
+        record = self.records.get(moduleName)
+        if record is None:
+            record = self.records[moduleName] = ImportRecord(moduleName)
+        return record
+
+    def _countingStatWrapper(self, statFunc):
+        def _countingStat(*args, **kwargs):
+            stack = getattr(self._local, 'stack', None)
+            if stack:
+                stack[-1][3] += 1
+            return statFunc(*args, **kwargs)
+        return _countingStat
+
+    def _patchFinder(self, finder, attrName):
+        '''
+            _patchFinder - Replace a finder's find_spec/find_module with one which records the time taken.
+
+                Finders are patched in place (rather than wrapped) so identity and isinstance checks on sys.meta_path still work.
+        '''
+        originalFind = getattr(finder, attrName, None)
+        if originalFind is None:
+            return
+
+        def _timedFind(fullname, *args, **kwargs):
+            startTime = time.time()
+            try:
+                return originalFind(fullname, *args, **kwargs)
+            finally:
+                self._addFindTime(fullname, time.time() - startTime)
+
+        # Finders which are classes (like PathFinder) have classmethods, which must be restored as they were
+        isClass = isinstance(finder, type)
+        try:
+            originalValue = finder.__dict__.get(attrName)
+            setattr(finder, attrName, staticmethod(_timedFind) if isClass else _timedFind)
+        except (AttributeError, TypeError):
+            # e.x. a builtin type, or __slots__
+            return
+        self._patchedFinders.append( (finder, attrName, originalValue) )
+
+    def _addFindTime(self, moduleName, seconds):
+        with self._lock:
+            self._getRecord(moduleName).findTime += seconds
+
+    def _noteDecision(self, moduleName, decision):
+        with self._lock:
+            decisions = self._getRecord(moduleName).decisions
+            decisions[decision] = decisions.get(decision, 0) + 1
+
+    @staticmethod
+    def _resolveName(name, globals, level):
+        '''
+            _resolveName - Resolve a (possibly relative) import name to an absolute module name
+        '''
+        if not level or not globals:
+            return name
+        package = globals.get('__package__')
+        if not package:
+            package = globals.get('__name__', '')
+            if '__path__' not in globals:
+                package = package.rpartition('.')[0]
+        base = package.rsplit('.', level - 1)[0] if level > 1 else package
+        return name and '%s.%s' %(base, name) or base
+
+    @staticmethod
+    def _getServedBy(moduleName):
+        '''
+            _getServedBy - Find the sys.path entry a loaded module came from (longest match)
+        '''
+        moduleFile = getattr(sys.modules.get(moduleName), '__file__', None)
+        if not moduleFile:
+            return None
+        moduleFile = os.path.abspath(moduleFile)
+
+        servedBy = None
+        for pathEntry in sys.path:
+            pathEntry = os.path.abspath(pathEntry or '.')
+            if moduleFile.startswith(pathEntry + os.sep) and (servedBy is None or len(pathEntry) > len(servedBy)):
+                servedBy = pathEntry
+        return servedBy
+
+    def _profiledImport(self, name, globals=None, locals=None, fromlist=(), level=0):
+        originalImport = self._originalImport
+
+        moduleName = self._resolveName(name, globals, level)
+        if moduleName in sys.modules and not fromlist:
+            # Already loaded, nothing to profile
+            return originalImport(name, globals, locals, fromlist, level)
+
+        wasLoaded = moduleName in sys.modules
+        numModulesBefore = len(sys.modules)
+
+        stack = self._getStack()
+        # frame - [ moduleName, startTime, childTime, statCalls ]
+        frame = [moduleName, time.time(), 0.0, 0]
+        stack.append(frame)
+        try:
+            return originalImport(name, globals, locals, fromlist, level)
+        finally:
+            stack.pop()
+            elapsed = time.time() - frame[1]
+            if stack:
+                stack[-1][2] += elapsed
+
+            if not wasLoaded or len(sys.modules) != numModulesBefore:
+                with self._lock:
+                    record = self._getRecord(moduleName)
+                    record.count += 1
+                    record.totalTime += elapsed
+                    record.selfTime += max(0.0, elapsed - frame[2])
+                    record.statCalls += frame[3]
+                    if record.servedBy is None:
+                        record.servedBy = self._getServedBy(moduleName)
+
+    def getRecords(self, sortBy='selfTime', limit=None):
+        '''
+            getRecords - Get the collected records, sorted
+
+            @param sortBy <str> Default 'selfTime' - One of REPORT_SORT_KEYS. All but "moduleName" sort descending.
+            @param limit <int/None> Default None - If provided, only this many records are returned
+
+            @return list<ImportRecord> - The records
+        '''
+        if sortBy not in REPORT_SORT_KEYS:
+            raise ValueError('Unknown sortBy "%s". Choices are: %s' %(str(sortBy), ', '.join(REPORT_SORT_KEYS)))
+
+        with self._lock:
+            records = list(self.records.values())
+
+        records.sort(key=lambda record : getattr(record, sortBy), reverse=(sortBy != 'moduleName'))
+        if limit:
+            records = records[:limit]
+        return records
+
+    def getTotalsByServedBy(self):
+        '''
+            getTotalsByServedBy - Sum the self time, find time, and stat calls of every module, by the sys.path entry which served it.
+
+            @return dict<str/None, dict> - Map of sys.path entry (None for unattributed) -> { 'modules', 'selfTime', 'findTime', 'statCalls' }
+        '''
+        ret = {}
+        with self._lock:
+            records = list(self.records.values())
+
+        for record in records:
+            totals = ret.get(record.servedBy)
+            if totals is None:
+                totals = ret[record.servedBy] = { 'modules' : 0, 'selfTime' : 0.0, 'findTime' : 0.0, 'statCalls' : 0 }
+            totals['modules'] += 1
+            totals['selfTime'] += record.selfTime
+            totals['findTime'] += record.findTime
+            totals['statCalls'] += record.statCalls
+        return ret
+
+    def formatReport(self, sortBy='selfTime', limit=None):
+        '''
+            formatReport - Format the collected records as a text table, followed by totals per sys.path entry
+
+            @param sortBy <str> Default 'selfTime' - @see getRecords
+            @param limit <int/None> Default None - @see getRecords
+
+            @return <str> - The report
+        '''
+        lines = ['%10s %10s %10s %7s %5s  %-40s %s' %('self(ms)', 'total(ms)', 'find(ms)', 'stats', 'count', 'module', 'decisions')]
+        for record in self.getRecords(sortBy, limit):
+            decisions = ','.join([ '%s=%d' %(decision, count) for (decision, count) in sorted(record.decisions.items()) ])
+            lines.append('%10.3f %10.3f %10.3f %7d %5d  %-40s %s' %(record.selfTime * 1000.0, record.totalTime * 1000.0, record.findTime * 1000.0,
+                record.statCalls, record.count, record.moduleName, decisions))
+
+        lines += ['', '%10s %10s %7s %7s  %s' %('self(ms)', 'find(ms)', 'stats', 'modules', 'served by')]
+        totals = self.getTotalsByServedBy()
+        for servedBy in sorted(totals.keys(), key=lambda key : totals[key]['selfTime'], reverse=True):
+            entry = totals[servedBy]
+            lines.append('%10.3f %10.3f %7d %7d  %s' %(entry['selfTime'] * 1000.0, entry['findTime'] * 1000.0, entry['statCalls'], entry['modules'], servedBy or '(unattributed)'))
+
+        return '\n'.join(lines) + '\n'
+
+    def dumpJSON(self, fileobj=None, sortBy='selfTime'):
+        '''
+            dumpJSON - Dump the collected records and totals as JSON
+
+            @param fileobj <file/str/None> Default None - A file object or path to write the JSON to.
+            @param sortBy <str> Default 'selfTime' - @see getRecords
+
+            @return <str> - The JSON
+        '''
+        data = {
+            'records' : [ record.toDict() for record in self.getRecords(sortBy) ],
+            'totals'  : [ dict(totals, servedBy=servedBy) for (servedBy, totals) in self.getTotalsByServedBy().items() ],
+        }
+        ret = json.dumps(data, indent=2, sort_keys=True)
+
+        if fileobj is not None:
+            if hasattr(fileobj, 'write'):
+                fileobj.write(ret)
+            else:
+                with open(fileobj, 'wt') as f:
+                    f.write(ret)
+        return ret
+
+
+global _globalProfiler
+_globalProfiler = None
+
+def enableImportProfiler():
+    '''
+        enableImportProfiler - Start a process-wide import profiler, if not already started.
+
+        @return <ImportProfiler> - The profiler
+    '''
+    global _globalProfiler
+    if _globalProfiler is None:
+        _globalProfiler = ImportProfiler()
+    _globalProfiler.enable()
+    return _globalProfiler
+
+def disableImportProfiler():
+    '''
+        disableImportProfiler - Stop the process-wide import profiler started by enableImportProfiler
+
+        @return <ImportProfiler/None> - The profiler, with its collected records, or None if never enabled
+    '''
+    if _globalProfiler is not None:
+        _globalProfiler.disable()
+    return _globalProfiler
@@ -8,34 +8,104 @@
 
 import imp
 import os
-import tempfile
-import subprocess
+import random
 import sys
+import time
 
 from .VirtualEnvInfo import VirtualEnvInfo
-from .exceptions import PipInstallFailed, VirtualEnvDoesNotExist
+from .PackageStore import PackageStore
+from .LockFile import getLockFilePath, getRequirementsKey, readLockFile, writeLockFile, captureLock, pipSupportsReport
+from .Installers import PipInstaller
+from .RunPip import getPipVersion
+from .Requirements import normalizeRequirementsTxt
+from .Metrics import INSTALLS, INSTALL_SECONDS, INSTALL_RETRIES
+from .ResourcePolicy import acquireBuildSlot
+from .BuildDaemon import requestInstallPackages
+from .exceptions import PipInstallFailed, PipInstallTimedOut, SubprocessTimedOut, VirtualEnvDoesNotExist
+
+__all__ = ('installPackages', 'ensureImport', 'generateRequirementsTxt', 'setInstallPolicy', 'getInstallPolicy')
+
+# The defaults used by installPackages when "timeout" or "retries" are not given. @see setInstallPolicy
+global _installPolicy
+_installPolicy = { 'timeout' : None, 'retries' : 0, 'retryDelay' : 1.0, 'maxRetryDelay' : 30.0 }
+
+def setInstallPolicy(timeout=None, retries=0, retryDelay=1.0, maxRetryDelay=30.0):
+    '''
+        setInstallPolicy - Set the default timeout and retry behaviour of installPackages (and everything which calls it,
+          like createEnv, setupAndActivateEnv, and the on-demand importer).
+
+            @param timeout <float/None> Default None - Maximum seconds a single pip invocation may run. When exceeded, pip and
+                                                        every process it started are killed. None is no limit.
+            @param retries <int> Default 0 - Number of times a failed (or timed out) install is retried
+            @param retryDelay <float> Default 1.0 - Seconds to wait before the first retry. This doubles with each retry, with random jitter.
+            @param maxRetryDelay <float> Default 30.0 - The most seconds to wait between retries
+
+            @return <dict> - The previous policy
+    '''
+    global _installPolicy
+
+    if retries < 0:
+        raise ValueError('retries must be >= 0')
+
+    oldPolicy = _installPolicy
+    _installPolicy = { 'timeout' : timeout or None, 'retries' : int(retries), 'retryDelay' : float(retryDelay), 'maxRetryDelay' : float(maxRetryDelay) }
+    return oldPolicy
+
+def getInstallPolicy():
+    '''
+        getInstallPolicy - Get the default timeout and retry behaviour of installPackages. @see setInstallPolicy
+
+            @return <dict> - Copy of the policy, with keys "timeout", "retries", "retryDelay", and "maxRetryDelay"
+    '''
+    return dict(_installPolicy)
 
-__all__ = ('installPackages', 'ensureImport', 'generateRequirementsTxt')
+def _getRetryDelay(attemptNumber, retryDelay, maxRetryDelay):
+    '''
+        _getRetryDelay - Exponential backoff with jitter, so many processes failing at once do not all retry at once.
+
+            @param attemptNumber <int> - The number of the attempt which just failed, starting at 0
+
+            @return <float> - Seconds to sleep before the next attempt
+    '''
+    delay = min(maxRetryDelay, retryDelay * (2 ** attemptNumber))
+    return (delay / 2.0) + random.uniform(0, delay / 2.0)
 
-def installPackages(packages, venvDir, stdout=sys.stdout, stderr=sys.stderr):
+def installPackages(packages, venvDir, stdout=sys.stdout, stderr=sys.stderr, packageStore=None, lockFile=None, timeout=None, retries=None, installer=None):
     '''
         installPackages - Installs packages into a created virtual environment
 
             @param packages - Describes the required packages. Takes one of the following forms:
 
-                String - Directly becomes contents of requirements.txt file to be ingested by pip
+                String - Contents of a requirements.txt file. It is normalized (duplicates merged, conflicts raised) before pip ingests it.
                 List   - A list/tuple/set of package names (optionally including version requirements, e.x. MyPkg==1.2.3)
                 Dict   - A dictionary of package names to versions. If no value is present, the latest will be fetched.
 
             @param venvDir <str/VirtualEnvInfo> - Path to a created virtualenv directory. This should be the 'virtualenvDirectory' key from the return of createEnv, or just the VirtualEnvInfo object itself will work.
             @param stdout <iostream/None> - Stream to be used as stdout for installation. Default is sys.stdout. Use "None" to swallow output.
             @param stderr <iostream/None> - Stream to be used as stderr for installation. Default is sys.stderr. Use "None" to swallow output.
+            @param packageStore <None/str/PackageStore> Default None - If provided, packages are unpacked once into this host-wide store
+                                    and linked into the virtualenv, rather than being installed directly by pip. A str is the path to the store.
+                                    @see VirtualEnvOnDemand.PackageStore.PackageStore
+            @param lockFile <None/bool/str> Default None - If True, the first successful install writes a lock file (exact pins, and hashes where available)
+                                    into the virtualenv, and later installs of the same #packages install from that lock with no dependency resolution.
+                                    A str is an explicit path to the lock file instead, which can be shared between hosts.
+                                    The lock is ignored and regenerated whenever the requirements change.
+                                    @see VirtualEnvOnDemand.LockFile
+            @param timeout <float/None> Default None - Maximum seconds each pip invocation may run before it (and everything it started) is killed.
+                                    None uses the default from setInstallPolicy, 0 is no limit.
+            @param retries <int/None> Default None - Number of times to retry a failed or timed-out install, with jittered exponential backoff.
+                                    None uses the default from setInstallPolicy.
+            @param installer <None/InstallerBackend> Default None - The backend used to install. Default is pip (or #packageStore, if provided).
+                                    @see VirtualEnvOnDemand.Installers
 
             @return - The generated requirements.txt used to install packages.
 
             @raises - 
                 VirtualEnvOnDemand.exceptions.PipInstallFailed -  if cannot install packages
+                VirtualEnvOnDemand.exceptions.PipInstallTimedOut - (subclass of PipInstallFailed) if the final attempt exceeded #timeout
                 VirtualEnvOnDemand.exceptions.VirtualEnvDoesNotExist - If given venvDir does not exist
+                VirtualEnvOnDemand.exceptions.InvalidRequirement - If a requirement in #packages is malformed
+                VirtualEnvOnDemand.exceptions.RequirementConflict - If requirements in #packages cannot all be satisfied
                 Others (Exception, etc)                        -  If permissions problem to write to specified directory, etc
     '''
     if isinstance(venvDir, VirtualEnvInfo):
@@ -47,45 +117,106 @@ def installPackages(packages, venvDir, stdout=sys.stdout, stderr=sys.stderr):
     # Get packages
     reqContents = generateRequirementsTxt(packages)
 
+    policy = _installPolicy
+    if timeout is None:
+        timeout = policy['timeout']
+    timeout = timeout or None
+    if retries is None:
+        retries = policy['retries']
+
+    if reqContents and installer is None:
+        # Have the build daemon install them, if in use and running. @see VirtualEnvOnDemand.BuildDaemon
+        if requestInstallPackages(reqContents, venvDir, stdout, stderr, packageStore=packageStore, lockFile=lockFile, timeout=timeout, retries=retries):
+            return reqContents
+
     if reqContents:
-        # Generate a temporary named file for the requirements.txt and feed into pip
-        #  Note -- windows will NOT allow pip to read an open file handle held by another process.
-        #   so we have to create, close, and manually remove later.
-        reqFile = tempfile.NamedTemporaryFile(prefix='venv_req_', suffix='txt', mode='wt', dir=venvDir, delete=False)
-        reqFilename = reqFile.name
-        reqFile.write(reqContents)
-        if reqContents[-1] != '\n':
-            reqFile.write('\n')
-        reqFile.flush()
-        reqFile.close()
-        
-        # If they chose to ignore output to one or more streams, setup a /dev/null stream
-        devnull = None
-        if stdout is None or stderr is None:
-            devnull = open(os.devnull, 'wt')
-            if stdout is None:
-                stdout = devnull
-            if stderr is None:
-                stderr = devnull
-
-        # Install from generated requirements.txt
-        pipe = subprocess.Popen([ VirtualEnvInfo.getPipBin(venvDir), 'install', '--upgrade', '-r', reqFile.name], shell=False, stdout=stdout, stderr=stderr)
-        returnCode = pipe.wait()
-
-        # Cleanup our temp requirements.txt
+        startTime = time.time()
+        if packageStore is not None and not isinstance(packageStore, PackageStore):
+            packageStore = PackageStore(packageStore)
+
+        lockFilePath = getLockFilePath(venvDir, lockFile)
+        if lockFilePath:
+            requirementsKey = getRequirementsKey(reqContents)
+            lock = readLockFile(lockFilePath)
+            if lock and lock[0] == requirementsKey:
+                # The lock matches these requirements, so install the exact pins without resolving dependencies.
+                #  If this fails (e.x. lock was generated on an incompatible platform), fall through to a full install.
+                try:
+                    if _installRequirements(lock[1], venvDir, stdout, stderr, packageStore, noDeps=True, timeout=timeout, installer=installer) == 0:
+                        _recordInstall('success', 'lock', startTime)
+                        return reqContents
+                except SubprocessTimedOut:
+                    pass
+
+        reportFilename = None
+        usingPip = (installer is None and packageStore is None) or isinstance(installer, PipInstaller)
+        if lockFilePath and usingPip and pipSupportsReport(getPipVersion(venvDir)):
+            reportFilename = os.sep.join([venvDir, '.venv_report_%d.json' %(os.getpid(),)])
+
         try:
-            os.remove(reqFilename)
-        except:
-            pass
+            attemptNumber = 0
+            while True:
+                try:
+                    returnCode = _installRequirements(reqContents, venvDir, stdout, stderr, packageStore, reportFilename=reportFilename, timeout=timeout, installer=installer)
+                    if returnCode == 0:
+                        break
+                    error = PipInstallFailed(returnCode, reqContents)
+                except SubprocessTimedOut:
+                    error = PipInstallTimedOut(timeout, reqContents)
+
+                if attemptNumber >= retries:
+                    _recordInstall('timeout' if isinstance(error, PipInstallTimedOut) else 'failure', 'resolve', startTime)
+                    raise error
+                time.sleep(_getRetryDelay(attemptNumber, policy['retryDelay'], policy['maxRetryDelay']))
+                attemptNumber += 1
+                INSTALL_RETRIES.inc()
+
+            _recordInstall('success', 'resolve', startTime)
+
+            if lockFilePath:
+                pins = captureLock(venvDir, reportFilename)
+                if pins is not None:
+                    writeLockFile(lockFilePath, requirementsKey, pins)
+        finally:
+            if reportFilename:
+                try:
+                    os.remove(reportFilename)
+                except:
+                    pass
 
-        # Cleanup devnull stream if setup
-        if devnull is not None:
-            devnull.close()
+    return reqContents
 
-        if returnCode != 0:
-            raise PipInstallFailed(returnCode, reqContents)
+def _recordInstall(result, source, startTime):
+    '''
+        _recordInstall - Record the outcome of an installPackages call in the metrics registry
+    '''
+    INSTALLS.inc(result=result, source=source)
+    INSTALL_SECONDS.observe(time.time() - startTime, result=result, source=source)
 
-    return reqContents
+def _installRequirements(reqContents, venvDir, stdout, stderr, packageStore=None, noDeps=False, reportFilename=None, timeout=None, installer=None):
+    '''
+        _installRequirements - Install a requirements.txt into a virtualenv, either with an installer backend or through a package store.
+
+        @return <int> - The return code of pip, 0 on success.
+
+        @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If pip exceeded #timeout
+        @raises VirtualEnvOnDemand.exceptions.BuildSlotTimedOut - If no build slot became free in time. @see VirtualEnvOnDemand.ResourcePolicy
+    '''
+    # Each attempt holds a host-wide build slot if the resource policy limits concurrent builds (unless the caller, e.x. createEnv, holds one)
+    with acquireBuildSlot():
+        if installer is not None:
+            if isinstance(installer, PipInstaller):
+                return installer.installRequirements(reqContents, venvDir, stdout, stderr, noDeps=noDeps, timeout=timeout, reportFilename=reportFilename)
+            return installer.installRequirements(reqContents, venvDir, stdout, stderr, noDeps=noDeps, timeout=timeout)
+
+        if packageStore is not None:
+            try:
+                packageStore.installRequirements(reqContents, venvDir, stdout, stderr, noDeps=noDeps, timeout=timeout)
+            except PipInstallFailed as e:
+                return e.returnCode or 1
+            return 0
+
+        return PipInstaller().installRequirements(reqContents, venvDir, stdout, stderr, noDeps=noDeps, timeout=timeout, reportFilename=reportFilename)
 
 def ensureImport(importName, venvDir, packageName=None, stdout=None, stderr=None):
     '''
@@ -140,11 +271,17 @@ def generateRequirementsTxt(packages):
 
             @param packages - Describes the required packages. Takes one of the following forms:
 
-                String - Directly becomes contents of requirements.txt file to be ingested by pip
+                String - Contents of a requirements.txt file. It is normalized (duplicates merged, conflicts raised) before pip ingests it.
                 List   - A list/tuple/set of package names (optionally including version requirements, e.x. MyPkg==1.2.3)
                 Dict   - A dictionary of package names to versions. If no value is present, the latest will be fetched.
 
+            Requirements are parsed, validated, and merged in-process (@see VirtualEnvOnDemand.Requirements), so duplicates and
+              spelling variants are combined, and malformed or conflicting requirements fail here, before pip runs.
+
             @return <str> - generated requirements.txt file contents
+
+            @raises VirtualEnvOnDemand.exceptions.InvalidRequirement - If a requirement is malformed
+            @raises VirtualEnvOnDemand.exceptions.RequirementConflict - If requirements cannot all be satisfied (e.x. "foo==1" and "foo==2")
     '''
 
     if not packages:
@@ -167,5 +304,5 @@ def generateRequirementsTxt(packages):
         # Straight up string
         reqContents = packages
 
-    return reqContents
+    return normalizeRequirementsTxt(reqContents)
 
@@ -0,0 +1,111 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    InstallProfile - Record which packages the on-demand importer installed, in order, so that the next run can
+      install them all up-front in one batch instead of discovering them one import at a time.
+
+      @see VirtualEnvOnDemand.GlobalEnv.enableOnDemandImporter "installProfile"
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import threading
+
+from .utils import canonicalizeName, writeStrToFile
+
+__all__ = ('INSTALL_PROFILE_FILENAME', 'getInstallProfilePath', 'readInstallProfile', 'recordProfiledInstall', 'forgetProfiledInstall')
+
+# INSTALL_PROFILE_FILENAME - Default name of the install profile, within the directory holding the global env
+INSTALL_PROFILE_FILENAME = '.VirtualEnvOnDemand_InstallProfile'
+
+# _profileLock - Serializes read-modify-write of profiles within this process
+_profileLock = threading.Lock()
+
+
+def getInstallProfilePath(parentDirectory, installProfile=True):
+    '''
+        getInstallProfilePath - Resolve the "installProfile" parameter to a path
+
+        @param parentDirectory <str> - The directory holding the global env
+        @param installProfile <bool/str> - True to use the default profile within #parentDirectory, or a str path to use an explicit profile
+
+        @return <str/None> - Path to the profile, or None if #installProfile disables profiling
+    '''
+    if not installProfile:
+        return None
+    if installProfile is True:
+        return os.sep.join([parentDirectory, INSTALL_PROFILE_FILENAME])
+    return installProfile
+
+
+def readInstallProfile(profilePath):
+    '''
+        readInstallProfile - Read an install profile
+
+        @param profilePath <str> - Path to the profile
+
+        @return list<str> - The recorded package names, in the order they were first installed. Empty if missing/unreadable.
+    '''
+    try:
+        with open(profilePath, 'rt') as f:
+            contents = f.read()
+    except (IOError, OSError):
+        return []
+
+    ret = []
+    seen = set()
+    for line in contents.split('\n'):
+        line = line.split('#', 1)[0].strip()
+        if line and canonicalizeName(line) not in seen:
+            seen.add(canonicalizeName(line))
+            ret.append(line)
+    return ret
+
+
+def _writeInstallProfile(profilePath, packageNames):
+    contents = ['# Generated by VirtualEnvOnDemand. Packages installed on-demand, in order.'] + list(packageNames)
+
+    # Write and rename, so a concurrent reader never sees a partial profile
+    tmpFilePath = '%s.tmp%d' %(profilePath, os.getpid())
+    ex = writeStrToFile(tmpFilePath, '\n'.join(contents) + '\n')
+    if ex:
+        return ex
+    try:
+        os.rename(tmpFilePath, profilePath)
+    except Exception as e:
+        return e
+
+    return None
+
+
+def recordProfiledInstall(profilePath, packageName):
+    '''
+        recordProfiledInstall - Append a package to an install profile, if not already present
+
+        @param profilePath <str> - Path to the profile
+        @param packageName <str> - The package which was installed
+
+        @return <None/Exception> - None if all goes well, otherwise the Exception raised
+    '''
+    with _profileLock:
+        packageNames = readInstallProfile(profilePath)
+        if canonicalizeName(packageName) in [ canonicalizeName(x) for x in packageNames ]:
+            return None
+        return _writeInstallProfile(profilePath, packageNames + [packageName])
+
+
+def forgetProfiledInstall(profilePath, packageName):
+    '''
+        forgetProfiledInstall - Remove a package from an install profile (e.x. because it can no longer be installed)
+
+        @param profilePath <str> - Path to the profile
+        @param packageName <str> - The package to remove
+
+        @return <None/Exception> - None if all goes well, otherwise the Exception raised
+    '''
+    with _profileLock:
+        packageNames = readInstallProfile(profilePath)
+        remaining = [ x for x in packageNames if canonicalizeName(x) != canonicalizeName(packageName) ]
+        if len(remaining) == len(packageNames):
+            return None
+        return _writeInstallProfile(profilePath, remaining)
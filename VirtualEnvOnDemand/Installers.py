@@ -0,0 +1,299 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Installers - Pluggable backends which install a requirements.txt into a virtualenv.
+
+      Pass an instance as "installer" to installPackages, createEnv, or setupAndActivateEnv.
+
+      PipInstaller is the default, and runs the virtualenv's pip.
+
+      LocalWheelInstaller installs already-resolved, pure-python wheels from a local directory in-process,
+        without starting pip at all, and hands anything it cannot handle (sdists, environment markers, platform wheels, etc) to pip.
+        This is intended for installs from a lock file, @see VirtualEnvOnDemand.LockFile
+
+      SdistBuildInstaller builds sdists in a shared build-tools env, and caches the wheels, @see VirtualEnvOnDemand.BuildTools
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+
+from .VirtualEnvInfo import VirtualEnvInfo
+from .RunPip import runPip, writeRequirementsFile
+from .Wheels import parseWheelFilename, installUnpackedWheel
+from .utils import canonicalizeName
+
+__all__ = ('InstallerBackend', 'PipInstaller', 'LocalWheelInstaller')
+
+# PINNED_REQUIREMENT_RE - "name[extras]==version", optionally followed by pip options (like --hash). No environment markers.
+PINNED_REQUIREMENT_RE = re.compile(r'^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?\s*==\s*(?P<version>[^\s;,=<>!~]+)(?P<options>(\s+--\S+)*)\s*$')
+
+
+class InstallerBackend(object):
+    '''
+        InstallerBackend - Interface for installing a requirements.txt into a virtualenv.
+
+            Subclasses implement installRequirements.
+    '''
+
+    def installRequirements(self, reqContents, venvDir, stdout=sys.stdout, stderr=sys.stderr, noDeps=False, timeout=None):
+        '''
+            installRequirements - Install a requirements.txt into a virtualenv
+
+            @param reqContents <str> - Contents of a requirements.txt
+            @param venvDir <str> - The root directory of the virtualenv
+            @param stdout <iostream/None> - Stream to be used as stdout. Use "None" to swallow output.
+            @param stderr <iostream/None> - Stream to be used as stderr. Use "None" to swallow output.
+            @param noDeps <bool> Default False - If True, #reqContents is a complete set of pins (like a lock file) and dependencies must not be resolved
+            @param timeout <float/None> Default None - If provided, the maximum number of seconds any subprocess may take
+
+            @return <int> - 0 on success, otherwise non-zero (like a return code from pip)
+
+            @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If a subprocess exceeded #timeout
+        '''
+        raise NotImplementedError('installRequirements must be implemented by %s' %(self.__class__.__name__,))
+
+
+class PipInstaller(InstallerBackend):
+    '''
+        PipInstaller - Install using the virtualenv's pip. This is the default backend.
+    '''
+
+    def __init__(self, extraArgs=None):
+        '''
+            @param extraArgs list<str>/None - Extra arguments to "pip install", e.x. ['--find-links', '/path/to/wheels']
+        '''
+        self.extraArgs = list(extraArgs or [])
+
+    def installRequirements(self, reqContents, venvDir, stdout=sys.stdout, stderr=sys.stderr, noDeps=False, timeout=None, reportFilename=None):
+        '''
+            installRequirements - @see InstallerBackend.installRequirements
+
+            @param reportFilename <str/None> - If provided, pip writes a JSON install report here (pip >= 22.2)
+        '''
+        pipArgs = ['install', '--upgrade'] + self.extraArgs
+        if noDeps:
+            pipArgs.append('--no-deps')
+        if reportFilename:
+            pipArgs += ['--report', reportFilename]
+
+        # Generate a temporary named file for the requirements.txt and feed into pip
+        reqFilename = writeRequirementsFile(reqContents, venvDir)
+
+        # Install from generated requirements.txt
+        try:
+            return runPip(venvDir, pipArgs + ['-r', reqFilename], stdout, stderr, timeout)
+        finally:
+            # Cleanup our temp requirements.txt
+            try:
+                os.remove(reqFilename)
+            except:
+                pass
+
+
+class LocalWheelInstaller(InstallerBackend):
+    '''
+        LocalWheelInstaller - Install exact pins from pure-python wheels within a local directory, in-process and in parallel.
+
+            Only requirements of the form "name==version" (optionally with --hash options) which have a matching pure-python
+              wheel (abi "none", platform "any", compatible with the virtualenv's python) within #wheelDirectory are handled here.
+              Everything else is passed to the #fallback backend (pip by default).
+
+            As no dependency resolution is done, requirements are only handled here when installing with noDeps (as from a lock file),
+              or if #assumeResolved is True.
+
+            If a requirement carries --hash options, the wheel must match one of them or the install fails.
+    '''
+
+    def __init__(self, wheelDirectory, fallback=None, maxWorkers=None, assumeResolved=False):
+        '''
+            @param wheelDirectory <str> - Directory containing .whl files (e.x. from "pip wheel", or PackageStore.getWheelsDirectory())
+            @param fallback <InstallerBackend/None> Default None - Backend for requirements which cannot be handled here.
+                                    Default is a PipInstaller which also looks for wheels within #wheelDirectory
+            @param maxWorkers <int/None> Default None - Number of wheels to install at once. Default is the number of CPUs.
+            @param assumeResolved <bool> Default False - If True, requirements are treated as a complete set of pins even when not installing with noDeps.
+        '''
+        self.wheelDirectory = wheelDirectory
+        self.fallback = fallback or PipInstaller(['--find-links', wheelDirectory])
+        if not maxWorkers:
+            try:
+                maxWorkers = os.cpu_count() or 1
+            except AttributeError:
+                import multiprocessing
+                maxWorkers = multiprocessing.cpu_count()
+        self.maxWorkers = maxWorkers
+        self.assumeResolved = assumeResolved
+
+    @staticmethod
+    def _splitRequirementLines(reqContents):
+        '''
+            _splitRequirementLines - Split a requirements.txt into logical lines, joining continuations and removing comments
+        '''
+        ret = []
+        current = ''
+        for line in reqContents.split('\n'):
+            line = line.split(' #', 1)[0].rstrip()
+            if line.lstrip().startswith('#'):
+                line = ''
+            if line.endswith('\\'):
+                current += line[:-1] + ' '
+                continue
+            line = (current + line).strip()
+            current = ''
+            if line:
+                ret.append(line)
+        if current.strip():
+            ret.append(current.strip())
+        return ret
+
+    @staticmethod
+    def _isCompatibleTag(tag, pythonVersion):
+        '''
+            _isCompatibleTag - Check if a wheel tag ("pyver-abi-plat") is pure-python and installable on #pythonVersion ("X.Y")
+        '''
+        (pyvers, abi, plat) = tag.split('-')
+        if abi != 'none' or plat != 'any':
+            return False
+
+        (major, minor) = [ int(x) for x in pythonVersion.split('.')[:2] ]
+        for pyver in pyvers.split('.'):
+            if pyver == 'py%d' %(major,):
+                return True
+            if pyver.startswith('py%d' %(major,)) and pyver[3:].isdigit() and int(pyver[3:]) <= minor:
+                return True
+        return False
+
+    def _findWheels(self, pythonVersion):
+        '''
+            _findWheels - Index the compatible wheels within #wheelDirectory
+
+            @return dict<tuple<str, str>, str> - Map of ( canonical name, lowercase version ) -> wheel path
+        '''
+        ret = {}
+        try:
+            filenames = sorted(os.listdir(self.wheelDirectory))
+        except OSError:
+            return ret
+
+        for filename in filenames:
+            if not filename.endswith('.whl'):
+                continue
+            try:
+                (name, version, tag) = parseWheelFilename(filename)
+            except ValueError:
+                continue
+            if self._isCompatibleTag(tag, pythonVersion):
+                ret.setdefault( (canonicalizeName(name), version.lower()), os.sep.join([self.wheelDirectory, filename]) )
+        return ret
+
+    @staticmethod
+    def _checkHashes(wheelPath, options):
+        '''
+            _checkHashes - Check a wheel against the --hash options of its requirement
+
+            @return <bool> - True if there are no hashes, or one matches
+        '''
+        hashes = [ option[len('--hash='):] for option in options.split() if option.startswith('--hash=') ]
+        if not hashes:
+            return True
+
+        digests = {}
+        for (algorithm, _, expected) in [ x.partition(':') for x in hashes ]:
+            if algorithm not in digests:
+                try:
+                    hashObj = hashlib.new(algorithm)
+                except ValueError:
+                    continue
+                with open(wheelPath, 'rb') as f:
+                    for block in iter(lambda : f.read(1048576), b''):
+                        hashObj.update(block)
+                digests[algorithm] = hashObj.hexdigest()
+            if digests[algorithm] == expected.lower():
+                return True
+        return False
+
+    @staticmethod
+    def _installWheel(wheelPath, venvDir):
+        '''
+            _installWheel - Unpack a wheel next to the virtualenv and move its files into place
+        '''
+        unpackDir = tempfile.mkdtemp(prefix='venv_unpack_', dir=venvDir)
+        try:
+            with zipfile.ZipFile(wheelPath) as wheelZip:
+                for member in wheelZip.namelist():
+                    if member.startswith('/') or '..' in member.split('/'):
+                        raise ValueError('Wheel "%s" contains unsafe path "%s"' %(wheelPath, member))
+                wheelZip.extractall(unpackDir)
+            return installUnpackedWheel(unpackDir, venvDir, placeFunc=shutil.move)
+        finally:
+            shutil.rmtree(unpackDir, ignore_errors=True)
+
+    def installRequirements(self, reqContents, venvDir, stdout=sys.stdout, stderr=sys.stderr, noDeps=False, timeout=None):
+        '''
+            installRequirements - @see InstallerBackend.installRequirements
+        '''
+        if isinstance(venvDir, VirtualEnvInfo):
+            venvDir = venvDir.virtualenvDirectory
+
+        pythonVersion = VirtualEnvInfo.getPythonVersion(venvDir)
+        if not (noDeps or self.assumeResolved) or not pythonVersion:
+            return self.fallback.installRequirements(reqContents, venvDir, stdout, stderr, noDeps=noDeps, timeout=timeout)
+
+        lines = self._splitRequirementLines(reqContents)
+        if [ line for line in lines if line.startswith('-') ]:
+            # Global options (index urls, constraints, etc) apply to the whole file, so leave it all to the fallback
+            return self.fallback.installRequirements(reqContents, venvDir, stdout, stderr, noDeps=noDeps, timeout=timeout)
+
+        availableWheels = self._findWheels(pythonVersion)
+
+        wheelPaths = []
+        fallbackLines = []
+        for line in lines:
+            matchObj = PINNED_REQUIREMENT_RE.match(line)
+            wheelPath = matchObj and availableWheels.get( (canonicalizeName(matchObj.group('name')), matchObj.group('version').lower()) )
+            if not wheelPath:
+                fallbackLines.append(line)
+                continue
+            if not self._checkHashes(wheelPath, matchObj.group('options') or ''):
+                if stderr is not None:
+                    stderr.write('VirtualEnvOnDemand: Hash of "%s" does not match requirement "%s"\n' %(wheelPath, line))
+                return 1
+            wheelPaths.append(wheelPath)
+
+        errors = []
+        pendingLock = threading.Lock()
+
+        def _worker():
+            while True:
+                with pendingLock:
+                    if not wheelPaths or errors:
+                        return
+                    wheelPath = wheelPaths.pop(0)
+                try:
+                    self._installWheel(wheelPath, venvDir)
+                except Exception as e:
+                    with pendingLock:
+                        errors.append( (wheelPath, e) )
+
+        threads = [ threading.Thread(target=_worker, name='VirtualEnvOnDemand-wheels-%d' %(i,)) for i in range(min(self.maxWorkers, len(wheelPaths))) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            if stderr is not None:
+                for (wheelPath, e) in errors:
+                    stderr.write('VirtualEnvOnDemand: Failed to install "%s": %s: %s\n' %(wheelPath, e.__class__.__name__, str(e)))
+            return 1
+
+        if fallbackLines:
+            return self.fallback.installRequirements('\n'.join(fallbackLines), venvDir, stdout, stderr, noDeps=noDeps, timeout=timeout)
+
+        return 0
@@ -0,0 +1,219 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Integrity - Deep verification of the files installed into a virtualenv, against the hashes in each distribution's RECORD,
+      and repair of only the distributions found broken (e.x. by an interrupted install, or deleted files).
+
+      @see VirtualEnvOnDemand.PersistentEnv.setupAndActivateEnv "verifyIntegrity"
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import json
+import os
+import sys
+import threading
+import time
+
+from .VirtualEnvInfo import VirtualEnvInfo
+from .Installers import PipInstaller
+from .Wheels import findDistInfoDirectory, _hashFile, _readRecord
+from .utils import canonicalizeName
+from .exceptions import PipInstallFailed
+
+__all__ = ('verifyEnvIntegrity', 'repairEnv', 'IntegrityReport', 'PROBLEM_MISSING', 'PROBLEM_MODIFIED')
+
+# Problems found with an installed file
+
+# PROBLEM_MISSING - The file listed in RECORD does not exist
+PROBLEM_MISSING = 'missing'
+# PROBLEM_MODIFIED - The file's size or hash differs from RECORD
+PROBLEM_MODIFIED = 'modified'
+
+
+class IntegrityReport(object):
+    '''
+        IntegrityReport - The outcome of verifyEnvIntegrity
+
+            distributions - Map of distribution name -> version, for every distribution which was checked
+            broken        - Map of distribution name -> list of ( problem, path relative to site-packages ), for every broken distribution
+            unverifiable  - Distributions which have no RECORD (e.x. installed by "setup.py install"), and so could not be checked
+            filesChecked  - Number of files hashed
+            elapsed       - Seconds taken
+    '''
+
+    __slots__ = ('distributions', 'broken', 'unverifiable', 'filesChecked', 'elapsed')
+
+    def __init__(self):
+        self.distributions = {}
+        self.broken = {}
+        self.unverifiable = []
+        self.filesChecked = 0
+        self.elapsed = 0.0
+
+    @property
+    def success(self):
+        return not self.broken
+
+    def __repr__(self):
+        return 'IntegrityReport(broken=%r, unverifiable=%r, filesChecked=%d, elapsed=%.3f)' %(self.broken, self.unverifiable, self.filesChecked, self.elapsed)
+
+
+def _getDefaultWorkers():
+    try:
+        return os.cpu_count() or 1
+    except AttributeError:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+
+def _checkFile(fullPath, expectedHash, expectedSize):
+    '''
+        _checkFile - Check one installed file against its RECORD entry
+
+        @return <str/None> - The problem (PROBLEM_*), or None if the file is intact
+    '''
+    try:
+        size = os.stat(fullPath).st_size
+    except OSError:
+        return PROBLEM_MISSING
+
+    # Cheap size check first, to not hash files which have obviously changed
+    if expectedSize and str(size) != expectedSize:
+        return PROBLEM_MODIFIED
+
+    (algorithm, _, _) = expectedHash.partition('=')
+    if algorithm != 'sha256':
+        # Everything pip writes is sha256. Others can only be checked for existence.
+        return None
+
+    try:
+        if _hashFile(fullPath)[0] != expectedHash:
+            return PROBLEM_MODIFIED
+    except (IOError, OSError):
+        return PROBLEM_MISSING
+    return None
+
+
+def verifyEnvIntegrity(venvDir, distributionNames=None, workers=None):
+    '''
+        verifyEnvIntegrity - Hash every file installed into a virtualenv, and compare against each distribution's RECORD.
+
+            Files are hashed in parallel. Files RECORD lists without a hash (bytecode, RECORD itself) are not checked.
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+        @param distributionNames list<str>/None Default None - If provided, only check these distributions (compared canonically)
+        @param workers <int/None> Default None - Number of threads hashing files. Default is the number of CPUs.
+
+        @return <IntegrityReport>
+    '''
+    startTime = time.time()
+    if isinstance(venvDir, VirtualEnvInfo):
+        venvDir = venvDir['virtualenvDirectory']
+    sitePackagesDirectory = VirtualEnvInfo.getSitePackagesDirectory(venvDir)
+    onlyNames = distributionNames and set([ canonicalizeName(name) for name in distributionNames ])
+
+    report = IntegrityReport()
+    # checks - ( distribution name, relative path, full path, hash, size )
+    checks = []
+    for entry in sorted(os.listdir(sitePackagesDirectory)):
+        if not entry.endswith('.dist-info'):
+            if entry.endswith('.egg-info'):
+                report.unverifiable.append(entry[:-len('.egg-info')].split('-', 1)[0])
+            continue
+
+        (name, _, version) = entry[:-len('.dist-info')].rpartition('-')
+        if onlyNames and canonicalizeName(name) not in onlyNames:
+            continue
+
+        recordPath = os.sep.join([sitePackagesDirectory, entry, 'RECORD'])
+        if not os.path.exists(recordPath):
+            report.unverifiable.append(name)
+            continue
+
+        report.distributions[name] = version
+        for (relPath, (fileHash, fileSize)) in _readRecord(recordPath).items():
+            if fileHash:
+                fullPath = os.path.normpath(os.sep.join([sitePackagesDirectory] + relPath.split('/')))
+                checks.append( (name, relPath, fullPath, fileHash, fileSize) )
+
+    numWorkers = max(1, min(workers or _getDefaultWorkers(), len(checks)))
+    problemsByWorker = [ [] for i in range(numWorkers) ]
+
+    def _worker(workerNumber):
+        problems = problemsByWorker[workerNumber]
+        for (name, relPath, fullPath, fileHash, fileSize) in checks[workerNumber::numWorkers]:
+            problem = _checkFile(fullPath, fileHash, fileSize)
+            if problem:
+                problems.append( (name, problem, relPath) )
+
+    # hashlib releases the GIL while hashing, so threads hash in parallel
+    threads = [ threading.Thread(target=_worker, args=(i,), name='VirtualEnvOnDemand-verify-%d' %(i,)) for i in range(numWorkers) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for problems in problemsByWorker:
+        for (name, problem, relPath) in problems:
+            report.broken.setdefault(name, []).append( (problem, relPath) )
+    for problems in report.broken.values():
+        problems.sort(key=lambda problem : problem[1])
+
+    report.filesChecked = len(checks)
+    report.elapsed = time.time() - startTime
+    return report
+
+
+def _getReinstallRequirement(sitePackagesDirectory, name, version):
+    '''
+        _getReinstallRequirement - Get the requirement which reinstalls exactly the installed distribution,
+          from where it was installed (PEP 610 direct_url.json) if not from an index.
+    '''
+    distInfoName = findDistInfoDirectory(sitePackagesDirectory, name)
+    try:
+        with open(os.sep.join([sitePackagesDirectory, distInfoName, 'direct_url.json']), 'rt') as f:
+            directUrl = json.loads(f.read())
+    except (TypeError, IOError, OSError, ValueError):
+        return '%s==%s' %(name, version)
+
+    url = directUrl.get('url')
+    vcsInfo = directUrl.get('vcs_info')
+    if vcsInfo and vcsInfo.get('vcs') and vcsInfo.get('commit_id'):
+        url = '%s+%s@%s' %(vcsInfo['vcs'], url, vcsInfo['commit_id'])
+    if not url or (directUrl.get('dir_info') or {}).get('editable'):
+        return '%s==%s' %(name, version)
+    return '%s @ %s' %(name, url)
+
+
+def repairEnv(venvDir, report=None, stdout=sys.stdout, stderr=sys.stderr, timeout=None, installer=None):
+    '''
+        repairEnv - Reinstall (without dependencies) only the distributions found broken by verifyEnvIntegrity, at their installed versions
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+        @param report <IntegrityReport/None> Default None - The result of verifyEnvIntegrity. If not provided, it is run now.
+        @param stdout <iostream/None> - Stream to be used as stdout for installation. Use "None" to swallow output.
+        @param stderr <iostream/None> - Stream to be used as stderr for installation. Use "None" to swallow output.
+        @param timeout <float/None> Default None - Maximum seconds pip may run
+        @param installer <None/PipInstaller> Default None - The pip installer to use (e.x. with "--find-links"). "--force-reinstall" is added.
+
+        @return <IntegrityReport> - Verification of the repaired distributions, after the repair
+
+        @raises VirtualEnvOnDemand.exceptions.PipInstallFailed - If the broken distributions could not be reinstalled
+        @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If pip exceeded #timeout
+    '''
+    if isinstance(venvDir, VirtualEnvInfo):
+        venvDir = venvDir['virtualenvDirectory']
+    if report is None:
+        report = verifyEnvIntegrity(venvDir)
+    if report.success:
+        return report
+
+    sitePackagesDirectory = VirtualEnvInfo.getSitePackagesDirectory(venvDir)
+    reqContents = '\n'.join([ _getReinstallRequirement(sitePackagesDirectory, name, report.distributions[name]) for name in sorted(report.broken.keys()) ])
+
+    installer = PipInstaller((installer.extraArgs if installer is not None else []) + ['--force-reinstall'])
+    returnCode = installer.installRequirements(reqContents, venvDir, stdout, stderr, noDeps=True, timeout=timeout)
+    if returnCode != 0:
+        raise PipInstallFailed(returnCode, reqContents)
+
+    return verifyEnvIntegrity(venvDir, list(report.broken.keys()))
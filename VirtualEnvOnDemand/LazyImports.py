@@ -0,0 +1,220 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    LazyImports - Opt-in lazy loading of the modules within activated envs, to cut startup time.
+
+      While enabled, python modules imported from an env's site-packages are loaded with importlib.util.LazyLoader:
+        "import bigpackage" only creates the module, and its body runs upon the first attribute access. Apps which import
+        large packages at module level, but only use them on some code paths, then no longer pay for them on every start.
+
+      Example:
+
+        setupAndActivateEnv(parentDirectory, name, packages, lazyImports=True)
+
+        ...
+
+        from VirtualEnvOnDemand.LazyImports import getDefaultLazyImporter
+        sys.stderr.write('Never used: %s\\n' %(', '.join(getDefaultLazyImporter().getReport().untouched),))
+
+      Some packages break when loaded lazily, e.x. those which replace themselves in sys.modules, install import hooks,
+        or must have side effects at import time. DEFAULT_LAZY_EXCLUDE lists common ones, and more can be excluded (or
+        lazy loading limited to an allow list) with LazyImporter's "include" and "exclude". "from package import name"
+        and "import package.submodule" load "package" right away, as its attributes are used.
+
+      Requires python 3.5 or newer.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import sys
+import threading
+
+try:
+    from importlib.machinery import PathFinder, SourceFileLoader, SourcelessFileLoader
+    from importlib.util import LazyLoader
+except ImportError:
+    # python2, or python3 < 3.5
+    LazyLoader = None
+
+from .VirtualEnvInfo import VirtualEnvInfo, getInfoFromVirtualEnv
+
+try:
+    from types import StringTypes
+except ImportError:
+    StringTypes = (str,)
+
+__all__ = ('LazyImporter', 'LazyImportReport', 'getDefaultLazyImporter', 'DEFAULT_LAZY_EXCLUDE')
+
+# DEFAULT_LAZY_EXCLUDE - Top-level packages which are always loaded eagerly, as they are known to break (or be pointless) when loaded lazily
+DEFAULT_LAZY_EXCLUDE = (
+    # Install import hooks or meta path finders, or replace modules in sys.modules
+    'six', '_distutils_hack', 'pkg_resources', 'setuptools', 'sh', 'py',
+    # Must have their side effects (monkey patching, registration) at import time
+    'gevent', 'eventlet', 'greenlet', 'pytest', '_pytest', 'pluggy', 'typing_extensions',
+)
+
+
+class LazyImportReport(object):
+    '''
+        LazyImportReport - Which modules were loaded lazily, and which of those have since been used
+
+            deferred  - Names of the modules which were loaded lazily
+            loaded    - Of #deferred, those whose body has since run (an attribute was accessed)
+            untouched - Of #deferred, those which have never been used. Their body never ran.
+            excluded  - Names of the modules within the env which were loaded eagerly because of the include/exclude lists
+    '''
+
+    __slots__ = ('deferred', 'loaded', 'untouched', 'excluded')
+
+    def __init__(self, deferred, loaded, untouched, excluded):
+        self.deferred = deferred
+        self.loaded = loaded
+        self.untouched = untouched
+        self.excluded = excluded
+
+    def __repr__(self):
+        return 'LazyImportReport(deferred=%d, loaded=%d, untouched=%r, excluded=%r)' %(len(self.deferred), len(self.loaded), self.untouched, self.excluded)
+
+
+class LazyImporter(object):
+    '''
+        LazyImporter - A meta path finder which has the modules found within the added envs loaded lazily.
+
+            Use addEnv to add envs, then enable (or use as a context manager). Modules already imported are not affected.
+              Only python source and bytecode modules are loaded lazily. Extension modules (.so, .pyd) are loaded as usual.
+    '''
+
+    def __init__(self, include=None, exclude=DEFAULT_LAZY_EXCLUDE):
+        '''
+            @param include list<str>/None Default None - If provided, only these top-level packages are loaded lazily
+            @param exclude list<str> Default DEFAULT_LAZY_EXCLUDE - Top-level packages which are always loaded eagerly.
+                                       Extend rather than replace the default, e.x. DEFAULT_LAZY_EXCLUDE + ('mypackage', )
+
+            @raises ValueError - If lazy loading is not supported by this python
+        '''
+        if LazyLoader is None:
+            raise ValueError('Lazy imports require python 3.5 or newer.')
+
+        self.include = include and frozenset(include) or None
+        self.exclude = frozenset(exclude or [])
+        self.isEnabled = False
+
+        # _directories - The site-packages directories of the added envs, as given and as resolved, each ending with a separator
+        self._directories = ()
+        self._deferred = []
+        self._excluded = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.disable()
+
+    def addEnv(self, venv):
+        '''
+            addEnv - Have the modules within a virtualenv loaded lazily
+
+            @param venv <str/VirtualEnvInfo> - A path to the root of a virtualenv, or a VirtualEnvInfo
+        '''
+        if isinstance(venv, StringTypes):
+            venv = getInfoFromVirtualEnv(venv, validate=False)
+        elif not isinstance(venv, VirtualEnvInfo):
+            raise TypeError('Unknown type passed to addEnv: %s. Should be VirtualEnvInfo or a string.' %(venv.__class__.__name__,))
+
+        sitePackagesDirectory = venv.sitePackagesDirectory
+        directories = set(self._directories)
+        for directory in (sitePackagesDirectory, os.path.realpath(sitePackagesDirectory)):
+            directories.add(directory.rstrip(os.sep) + os.sep)
+        self._directories = tuple(sorted(directories))
+
+    def enable(self):
+        '''
+            enable - Start loading modules within the added envs lazily.
+
+                This is placed on sys.meta_path just ahead of the standard path finder, so any other import hooks still come first.
+        '''
+        if self.isEnabled:
+            return
+
+        metaPath = list(sys.meta_path)
+        try:
+            index = metaPath.index(PathFinder)
+        except ValueError:
+            index = len(metaPath)
+        metaPath.insert(index, self)
+        sys.meta_path[:] = metaPath
+        self.isEnabled = True
+
+    def disable(self):
+        '''
+            disable - Stop loading modules lazily. Modules already loaded lazily stay so, and are still reported.
+        '''
+        if not self.isEnabled:
+            return
+
+        sys.meta_path[:] = [ finder for finder in sys.meta_path if finder is not self ]
+        self.isEnabled = False
+
+    def find_spec(self, fullname, path=None, target=None):
+        topLevelName = fullname.partition('.')[0]
+        isExcluded = (self.include is not None and topLevelName not in self.include) or topLevelName in self.exclude
+
+        # Anything not loaded lazily gets the spec already found, unchanged, rather than None, which would have the path searched again
+        spec = PathFinder.find_spec(fullname, path)
+        if spec is None or not spec.origin or not spec.origin.startswith(self._directories):
+            return spec
+
+        if isExcluded:
+            with self._lock:
+                self._excluded.add(fullname)
+            return spec
+        if not isinstance(spec.loader, (SourceFileLoader, SourcelessFileLoader)):
+            return spec
+
+        spec.loader = LazyLoader(spec.loader)
+        with self._lock:
+            self._deferred.append(fullname)
+        return spec
+
+    def getReport(self):
+        '''
+            getReport - Get which modules were loaded lazily, and which of those have never been used
+
+            @return <LazyImportReport>
+        '''
+        with self._lock:
+            deferred = list(self._deferred)
+            excluded = sorted(self._excluded)
+
+        loaded = []
+        untouched = []
+        for moduleName in deferred:
+            module = sys.modules.get(moduleName)
+            if module is None:
+                continue
+            # type() does not trigger the load, as accessing any attribute (even __class__) would
+            if type(module).__name__ == '_LazyModule':
+                untouched.append(moduleName)
+            else:
+                loaded.append(moduleName)
+
+        return LazyImportReport(deferred, loaded, untouched, excluded)
+
+
+# _defaultLazyImporter - Used by setupAndActivateEnv(..., lazyImports=True)
+_defaultLazyImporter = None
+
+def getDefaultLazyImporter():
+    '''
+        getDefaultLazyImporter - Get the LazyImporter used by setupAndActivateEnv(..., lazyImports=True), creating it (not enabled) if needed
+
+        @return <LazyImporter>
+
+        @raises ValueError - If lazy loading is not supported by this python
+    '''
+    global _defaultLazyImporter
+    if _defaultLazyImporter is None:
+        _defaultLazyImporter = LazyImporter()
+    return _defaultLazyImporter
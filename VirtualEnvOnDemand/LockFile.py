@@ -0,0 +1,163 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    LockFile - Capture the exact result of a successful install (pins and hashes), so that later
+      installs of the same requirements can skip pip's dependency resolution entirely.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import json
+import os
+
+from .VirtualEnvInfo import VirtualEnvInfo
+from .RunPip import runPipGetOutput
+from .Requirements import getRequirementsKey
+from .utils import canonicalizeName, cmp_version, writeStrToFile
+
+__all__ = ('LOCK_FILENAME', 'getLockFilePath', 'getRequirementsKey', 'readLockFile', 'writeLockFile', 'captureLock', 'pipSupportsReport')
+
+# LOCK_FILENAME - Default name of the lock file, within the root of a virtualenv
+LOCK_FILENAME = '.VirtualEnvOnDemand_Lock'
+
+# LOCK_KEY_PREFIX - Line within the lock file header which holds the requirements key
+LOCK_KEY_PREFIX = '# requirementsKey: '
+
+
+def getLockFilePath(venvDir, lockFile=True):
+    '''
+        getLockFilePath - Resolve the "lockFile" parameter used throughout VirtualEnvOnDemand to a path
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+        @param lockFile <bool/str> - True to use the default lock file within the virtualenv, or a str path to use an explicit lock file
+                                      (e.x. one committed alongside your application, to share between hosts)
+
+        @return <str/None> - Path to the lock file, or None if #lockFile disables locking
+    '''
+    if not lockFile:
+        return None
+    if lockFile is True:
+        if isinstance(venvDir, VirtualEnvInfo):
+            venvDir = venvDir.virtualenvDirectory
+        return os.sep.join([venvDir, LOCK_FILENAME])
+    return lockFile
+
+
+def readLockFile(lockFilePath):
+    '''
+        readLockFile - Read a lock file
+
+        @param lockFilePath <str> - Path to the lock file
+
+        @return tuple<str, str>/None - ( requirementsKey, lock contents as a requirements.txt ), or None if missing/unreadable
+    '''
+    try:
+        with open(lockFilePath, 'rt') as f:
+            contents = f.read()
+    except (IOError, OSError):
+        return None
+
+    for line in contents.split('\n'):
+        if line.startswith(LOCK_KEY_PREFIX):
+            return (line[len(LOCK_KEY_PREFIX):].strip(), contents)
+
+    return None
+
+
+def writeLockFile(lockFilePath, requirementsKey, pins):
+    '''
+        writeLockFile - Write a lock file
+
+        @param lockFilePath <str> - Path to the lock file
+        @param requirementsKey <str> - The key of the requirements this lock satisfies, @see getRequirementsKey
+        @param pins list<str> - requirements.txt lines of exact pins
+
+        @return <None/Exception> - None if all goes well, otherwise the Exception raised
+    '''
+    contents = ['# Generated by VirtualEnvOnDemand. Do not edit.', LOCK_KEY_PREFIX + requirementsKey] + list(pins)
+
+    # Write and rename, so a concurrent reader never sees a partial lock
+    tmpFilePath = '%s.tmp%d' %(lockFilePath, os.getpid())
+    ex = writeStrToFile(tmpFilePath, '\n'.join(contents) + '\n')
+    if ex:
+        return ex
+    try:
+        os.rename(tmpFilePath, lockFilePath)
+    except Exception as e:
+        return e
+
+    return None
+
+
+def pipSupportsReport(pipVersion):
+    '''
+        pipSupportsReport - Check if a version of pip supports "pip install --report" (added in pip 22.2)
+
+        @param pipVersion <str/None> - A pip version, @see VirtualEnvOnDemand.RunPip.getPipVersion
+
+        @return <bool> - True if supported
+    '''
+    return bool(pipVersion) and cmp_version(pipVersion, '22.2') >= 0
+
+
+def _getHashesFromReport(reportFilename):
+    '''
+        _getHashesFromReport - Extract the archive hashes from a pip JSON install report
+
+        @return dict<str, str> - Map of canonical name -> "sha256:<hex>"
+    '''
+    ret = {}
+    try:
+        with open(reportFilename, 'rt') as f:
+            report = json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return ret
+
+    for item in report.get('install', []):
+        name = item.get('metadata', {}).get('name')
+        archiveInfo = item.get('download_info', {}).get('archive_info', {})
+        if not name or not archiveInfo:
+            continue
+
+        hashes = archiveInfo.get('hashes') or {}
+        if 'sha256' in hashes:
+            ret[canonicalizeName(name)] = 'sha256:' + hashes['sha256']
+        elif archiveInfo.get('hash', '').startswith('sha256='):
+            ret[canonicalizeName(name)] = 'sha256:' + archiveInfo['hash'][len('sha256='):]
+
+    return ret
+
+
+def captureLock(venvDir, reportFilename=None):
+    '''
+        captureLock - Capture the exact pins of everything installed within a virtualenv
+
+            Pins come from "pip freeze". If a pip JSON install report is provided and it contains a hash for
+              every pinned distribution, hashes are included as well. As pip requires either all or no requirements
+              to carry hashes, if any is missing none are included.
+
+        @param venvDir <str> - The root directory of the virtualenv
+        @param reportFilename <str/None> - Path to a JSON report written by "pip install --report"
+
+        @return list<str>/None - requirements.txt lines, or None if pip freeze failed
+    '''
+    (returnCode, output) = runPipGetOutput(venvDir, ['freeze', '--local'])
+    if returnCode != 0:
+        return None
+
+    pins = [ line.strip() for line in output.split('\n') if line.strip() and not line.startswith('#') ]
+
+    hashes = reportFilename and _getHashesFromReport(reportFilename) or {}
+    if not hashes:
+        return pins
+
+    hashedPins = []
+    for pin in pins:
+        if '==' not in pin:
+            # Editable, direct url, etc. Cannot be hashed.
+            return pins
+        pinHash = hashes.get(canonicalizeName(pin.split('==', 1)[0]))
+        if not pinHash:
+            return pins
+        hashedPins.append('%s --hash=%s' %(pin, pinHash))
+
+    return hashedPins
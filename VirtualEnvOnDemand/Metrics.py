@@ -0,0 +1,346 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Metrics - A lightweight, dependency-free, in-process registry of counters and histograms.
+
+      VirtualEnvOnDemand records env creations, installs, pip runs, and on-demand importer activity into the
+        default registry (@see getMetricsRegistry). Use snapshot() to read them, or writePrometheusTextfile to
+        write them in the Prometheus text format, e.x. for the node exporter's textfile collector.
+
+      Example:
+
+        from VirtualEnvOnDemand.Metrics import getMetricsRegistry
+
+        getMetricsRegistry().writePrometheusTextfile('/var/lib/node_exporter/textfile/myapp_venv.prom')
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import tempfile
+import threading
+
+__all__ = ('Counter', 'Histogram', 'MetricsRegistry', 'getMetricsRegistry', 'DEFAULT_DURATION_BUCKETS',
+    'ENV_CREATIONS', 'ENV_CREATION_SECONDS', 'INSTALLS', 'INSTALL_SECONDS', 'INSTALL_RETRIES', 'PIP_RUNS', 'PIP_RUN_SECONDS',
+    'IMPORTER_DECISIONS', 'IMPORTER_INSTALL_SECONDS', 'BUILD_SLOT_WAIT_SECONDS', 'BUILD_SLOT_TIMEOUTS', 'SDIST_BUILDS', 'ENV_PLACEMENTS',
+    'REQUIREMENTS_WATCH_INSTALLS',
+)
+
+# DEFAULT_DURATION_BUCKETS - Histogram bucket upper bounds, in seconds. Sized for pip runs and env builds.
+DEFAULT_DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _formatValue(value):
+    '''
+        _formatValue - Format a sample value for the Prometheus text format
+    '''
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+def _escapeLabelValue(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _formatLabels(labelNames, labelValues, extra=None):
+    pairs = list(zip(labelNames, labelValues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join([ '%s="%s"' %(name, _escapeLabelValue(value)) for (name, value) in pairs ]) + '}'
+
+
+class _Metric(object):
+    '''
+        _Metric - Common base of Counter and Histogram. Samples are kept per combination of label values.
+    '''
+
+    metricType = None
+
+    def __init__(self, name, documentation, labelNames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _getLabelValues(self, labels):
+        if len(labels) != len(self.labelNames):
+            raise ValueError('Metric "%s" takes labels %r, but got %r' %(self.name, self.labelNames, tuple(sorted(labels.keys()))))
+        try:
+            return tuple([ str(labels[labelName]) for labelName in self.labelNames ])
+        except KeyError:
+            raise ValueError('Metric "%s" takes labels %r, but got %r' %(self.name, self.labelNames, tuple(sorted(labels.keys()))))
+
+    def reset(self):
+        '''
+            reset - Discard all samples
+        '''
+        with self._lock:
+            self._values = {}
+
+
+class Counter(_Metric):
+    '''
+        Counter - A value which only goes up, kept per combination of label values
+    '''
+
+    metricType = 'counter'
+
+    def inc(self, amount=1, **labels):
+        '''
+            inc - Increment the counter
+
+            @param amount <int/float> Default 1 - Amount to add
+            @param labels - A value for each of this counter's label names
+        '''
+        labelValues = self._getLabelValues(labels)
+        with self._lock:
+            self._values[labelValues] = self._values.get(labelValues, 0) + amount
+
+    def getValue(self, **labels):
+        '''
+            getValue - Get the current value for the given label values (0 if never incremented)
+        '''
+        return self._values.get(self._getLabelValues(labels), 0)
+
+    def getSamples(self):
+        '''
+            getSamples - Get all samples
+
+            @return list<dict> - [ { 'labels' : { name : value }, 'value' : value } ]
+        '''
+        with self._lock:
+            items = sorted(self._values.items())
+        return [ { 'labels' : dict(zip(self.labelNames, labelValues)), 'value' : value } for (labelValues, value) in items ]
+
+    def formatPrometheus(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [ '%s%s %s' %(self.name, _formatLabels(self.labelNames, labelValues), _formatValue(value)) for (labelValues, value) in items ]
+
+
+class Histogram(_Metric):
+    '''
+        Histogram - Counts observations (like durations) into buckets, and keeps their count and sum, per combination of label values
+    '''
+
+    metricType = 'histogram'
+
+    def __init__(self, name, documentation, labelNames=(), buckets=DEFAULT_DURATION_BUCKETS):
+        _Metric.__init__(self, name, documentation, labelNames)
+        self.buckets = tuple(sorted([ float(bucket) for bucket in buckets if bucket != float('inf') ]))
+
+    def observe(self, value, **labels):
+        '''
+            observe - Record an observation
+
+            @param value <float> - The observed value, e.x. seconds taken
+            @param labels - A value for each of this histogram's label names
+        '''
+        labelValues = self._getLabelValues(labels)
+        with self._lock:
+            sample = self._values.get(labelValues)
+            if sample is None:
+                # [ per-bucket counts (not cumulative), count, sum ]
+                sample = self._values[labelValues] = [ [0] * len(self.buckets), 0, 0.0 ]
+            for (i, bucket) in enumerate(self.buckets):
+                if value <= bucket:
+                    sample[0][i] += 1
+                    break
+            sample[1] += 1
+            sample[2] += value
+
+    def getSamples(self):
+        '''
+            getSamples - Get all samples
+
+            @return list<dict> - [ { 'labels' : { name : value }, 'count' : int, 'sum' : float, 'buckets' : [ ( upper bound, cumulative count ) ] } ]
+        '''
+        with self._lock:
+            items = sorted([ (labelValues, (list(sample[0]), sample[1], sample[2])) for (labelValues, sample) in self._values.items() ])
+
+        ret = []
+        for (labelValues, (bucketCounts, count, total)) in items:
+            cumulativeBuckets = []
+            cumulative = 0
+            for (bucket, bucketCount) in zip(self.buckets, bucketCounts):
+                cumulative += bucketCount
+                cumulativeBuckets.append( (bucket, cumulative) )
+            cumulativeBuckets.append( (float('inf'), count) )
+            ret.append( { 'labels' : dict(zip(self.labelNames, labelValues)), 'count' : count, 'sum' : total, 'buckets' : cumulativeBuckets } )
+        return ret
+
+    def formatPrometheus(self):
+        lines = []
+        for sample in self.getSamples():
+            labelValues = [ sample['labels'][labelName] for labelName in self.labelNames ]
+            for (bucket, cumulative) in sample['buckets']:
+                lines.append('%s_bucket%s %d' %(self.name, _formatLabels(self.labelNames, labelValues, ('le', _formatValue(bucket))), cumulative))
+            lines.append('%s_sum%s %s' %(self.name, _formatLabels(self.labelNames, labelValues), _formatValue(sample['sum'])))
+            lines.append('%s_count%s %d' %(self.name, _formatLabels(self.labelNames, labelValues), sample['count']))
+        return lines
+
+
+class MetricsRegistry(object):
+    '''
+        MetricsRegistry - A named set of counters and histograms
+    '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _getOrCreate(self, metricClass, name, documentation, labelNames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metricClass(name, documentation, labelNames, **kwargs)
+            elif metric.__class__ is not metricClass or metric.labelNames != tuple(labelNames):
+                raise ValueError('Metric "%s" is already registered as a %s with labels %r' %(name, metric.metricType, metric.labelNames))
+        return metric
+
+    def counter(self, name, documentation, labelNames=()):
+        '''
+            counter - Get the counter with the given name, registering it if it does not exist
+
+            @param name <str> - Metric name, e.x. "myapp_things_total"
+            @param documentation <str> - Help text
+            @param labelNames list<str> - Names of the labels every sample must provide
+
+            @return <Counter>
+        '''
+        return self._getOrCreate(Counter, name, documentation, labelNames)
+
+    def histogram(self, name, documentation, labelNames=(), buckets=DEFAULT_DURATION_BUCKETS):
+        '''
+            histogram - Get the histogram with the given name, registering it if it does not exist
+
+            @param name <str> - Metric name, e.x. "myapp_thing_seconds"
+            @param documentation <str> - Help text
+            @param labelNames list<str> - Names of the labels every sample must provide
+            @param buckets list<float> - Upper bounds of the buckets. +Inf is always added.
+
+            @return <Histogram>
+        '''
+        return self._getOrCreate(Histogram, name, documentation, labelNames, buckets=buckets)
+
+    def getMetric(self, name):
+        '''
+            getMetric - Get a registered metric by name, or None
+        '''
+        return self._metrics.get(name)
+
+    def getMetrics(self):
+        '''
+            getMetrics - Get all registered metrics, sorted by name
+        '''
+        with self._lock:
+            return [ self._metrics[name] for name in sorted(self._metrics.keys()) ]
+
+    def snapshot(self):
+        '''
+            snapshot - Get the current value of every metric
+
+            @return dict<str, dict> - Map of metric name -> { 'type' : 'counter'/'histogram', 'documentation' : str, 'samples' : list }
+                @see Counter.getSamples and Histogram.getSamples for the format of samples.
+        '''
+        return dict( [ (metric.name, { 'type' : metric.metricType, 'documentation' : metric.documentation, 'samples' : metric.getSamples() }) for metric in self.getMetrics() ] )
+
+    def reset(self):
+        '''
+            reset - Discard the samples of every metric. Metrics stay registered.
+        '''
+        for metric in self.getMetrics():
+            metric.reset()
+
+    def formatPrometheus(self):
+        '''
+            formatPrometheus - Format every metric in the Prometheus text exposition format
+
+            @return <str>
+        '''
+        lines = []
+        for metric in self.getMetrics():
+            lines.append('# HELP %s %s' %(metric.name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' %(metric.name, metric.metricType))
+            lines += metric.formatPrometheus()
+        return '\n'.join(lines) + '\n'
+
+    def writePrometheusTextfile(self, filename):
+        '''
+            writePrometheusTextfile - Write every metric in the Prometheus text format to a file.
+
+                The file is written to a temporary name and renamed into place, so a collector never reads a partial file.
+                For the node exporter's textfile collector, #filename should end in ".prom"
+
+            @param filename <str> - The file to write
+        '''
+        directory = os.path.dirname(os.path.abspath(filename))
+        (fd, tmpFilename) = tempfile.mkstemp(prefix='.metrics_', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.formatPrometheus())
+            os.chmod(tmpFilename, 0o644)
+            if os.name == 'nt' and os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpFilename, filename)
+        except:
+            try:
+                os.remove(tmpFilename)
+            except:
+                pass
+            raise
+
+
+global _metricsRegistry
+_metricsRegistry = MetricsRegistry()
+
+def getMetricsRegistry():
+    '''
+        getMetricsRegistry - Get the default registry, into which VirtualEnvOnDemand records its own metrics
+
+        @return <MetricsRegistry>
+    '''
+    return _metricsRegistry
+
+
+# Metrics recorded by VirtualEnvOnDemand
+
+ENV_CREATIONS = _metricsRegistry.counter('virtualenvondemand_env_creations_total',
+    'Virtualenvs created by createEnv, by result (success, failure)', ('result',))
+ENV_CREATION_SECONDS = _metricsRegistry.histogram('virtualenvondemand_env_creation_seconds',
+    'Seconds taken by createEnv, including installing packages', ('result',))
+
+INSTALLS = _metricsRegistry.counter('virtualenvondemand_installs_total',
+    'Calls to installPackages, by result (success, failure, timeout) and source (lock: installed from a matching lock file, resolve: full install)', ('result', 'source'))
+INSTALL_SECONDS = _metricsRegistry.histogram('virtualenvondemand_install_seconds',
+    'Seconds taken by installPackages, including retries', ('result', 'source'))
+INSTALL_RETRIES = _metricsRegistry.counter('virtualenvondemand_install_retries_total',
+    'Install attempts retried after a failure or timeout')
+
+PIP_RUNS = _metricsRegistry.counter('virtualenvondemand_pip_runs_total',
+    'pip invocations, by pip command and exit code ("timeout" if killed)', ('command', 'exit_code'))
+PIP_RUN_SECONDS = _metricsRegistry.histogram('virtualenvondemand_pip_run_seconds',
+    'Seconds each pip invocation took', ('command',))
+
+IMPORTER_DECISIONS = _metricsRegistry.counter('virtualenvondemand_importer_decisions_total',
+    'Decisions made by the on-demand importer. Hits are "present", skips are "knownFailure" and "circuitOpen", misses are "install" and "installFailed"', ('decision',))
+IMPORTER_INSTALL_SECONDS = _metricsRegistry.histogram('virtualenvondemand_importer_install_seconds',
+    'Seconds the on-demand importer blocked an import to install a package', ('result',))
+
+BUILD_SLOT_WAIT_SECONDS = _metricsRegistry.histogram('virtualenvondemand_build_slot_wait_seconds',
+    'Seconds builds and installs queued for a host-wide build slot. @see VirtualEnvOnDemand.ResourcePolicy')
+BUILD_SLOT_TIMEOUTS = _metricsRegistry.counter('virtualenvondemand_build_slot_timeouts_total',
+    'Builds and installs which gave up waiting for a host-wide build slot')
+
+SDIST_BUILDS = _metricsRegistry.counter('virtualenvondemand_sdist_builds_total',
+    'Sdists needed by SdistBuildInstaller, by result (cached: wheel reused, built: built in the shared build env, isolated: built with build isolation, failure)', ('result',))
+
+ENV_PLACEMENTS = _metricsRegistry.counter('virtualenvondemand_env_placements_total',
+    'Temporary envs placed while a memory budget is set, by location (memory, disk: spilled over). @see VirtualEnvOnDemand.Placement', ('location',))
+
+REQUIREMENTS_WATCH_INSTALLS = _metricsRegistry.counter('virtualenvondemand_requirements_watch_installs_total',
+    'Installs started by a RequirementsWatcher after the watched files changed, by result (success, failure). @see VirtualEnvOnDemand.RequirementsWatcher', ('result',))
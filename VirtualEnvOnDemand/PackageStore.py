@@ -0,0 +1,397 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    PackageStore - A host-wide, deduplicated store of unpacked distributions.
+
+      Each distribution (keyed by name, version, and wheel tag) is unpacked exactly once into the store,
+        and every virtualenv using it has its site-packages populated with hardlinks (or reflinks) into the store.
+
+      This saves disk space and page cache across many persistent envs which share packages, and makes
+        building an env whose packages are already in the store mostly a metadata operation.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .VirtualEnvInfo import VirtualEnvInfo
+from .RunPip import runPip, writeRequirementsFile
+from .Wheels import parseWheelFilename, findDistInfoDirectory, installUnpackedWheel
+from .exceptions import PipInstallFailed
+from .utils import canonicalizeName, ensureDirectory
+
+__all__ = ('PackageStore', 'LINK_MODE_HARDLINK', 'LINK_MODE_REFLINK', 'LINK_MODE_COPY')
+
+# Link modes - how files are placed from the store into a virtualenv
+
+# LINK_MODE_HARDLINK - Hardlink files. Falls back to copy if the store and the virtualenv are on different filesystems.
+LINK_MODE_HARDLINK = 'hardlink'
+# LINK_MODE_REFLINK - Copy-on-write clone (linux FICLONE, e.x. btrfs/xfs). Falls back to copy if unsupported.
+LINK_MODE_REFLINK = 'reflink'
+# LINK_MODE_COPY - Always copy.
+LINK_MODE_COPY = 'copy'
+
+# FICLONE - ioctl request for a reflink on linux
+FICLONE = 0x40049409
+
+
+def _copyFile(src, dest):
+    shutil.copy2(src, dest)
+
+# _HARDLINK_FALLBACK_ERRNOS - Errors from os.link which mean we should just copy instead (cross-device, unsupported, too many links)
+_HARDLINK_FALLBACK_ERRNOS = set( [ getattr(errno, x) for x in ('EXDEV', 'EPERM', 'EMLINK', 'ENOTSUP', 'EOPNOTSUPP') if hasattr(errno, x) ] )
+
+def _hardlinkFile(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        if e.errno not in _HARDLINK_FALLBACK_ERRNOS:
+            raise
+        shutil.copy2(src, dest)
+
+def _reflinkFile(src, dest):
+    try:
+        import fcntl
+        with open(src, 'rb') as srcFile:
+            with open(dest, 'wb') as destFile:
+                fcntl.ioctl(destFile.fileno(), FICLONE, srcFile.fileno())
+        shutil.copystat(src, dest)
+    except (ImportError, IOError, OSError):
+        shutil.copy2(src, dest)
+
+_LINK_FUNCTIONS = {
+    LINK_MODE_HARDLINK : _hardlinkFile,
+    LINK_MODE_REFLINK  : _reflinkFile,
+    LINK_MODE_COPY     : _copyFile,
+}
+
+
+class _StoreLock(object):
+    '''
+        _StoreLock - Context manager holding the store-wide lock file. Links hold it shared, and garbage collection exclusive,
+          so an entry is never removed while it is being linked. Where flock is unavailable, only the age check of
+          collectGarbage applies.
+    '''
+
+    def __init__(self, storeDirectory, exclusive=False):
+        self.lockPath = os.sep.join([storeDirectory, 'lock'])
+        self.exclusive = exclusive
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fd = os.open(self.lockPath, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        if self._fd is not None:
+            # Closing releases the lock
+            os.close(self._fd)
+            self._fd = None
+
+
+class PackageStore(object):
+    '''
+        PackageStore - A directory holding unpacked distributions shared between virtualenvs.
+
+            Layout:
+
+                <storeDirectory>/wheels/                             - The original wheel files, used as a local index
+                <storeDirectory>/entries/<name>/<version>/<tag>/tree - The unpacked wheel
+                <storeDirectory>/entries/<name>/<version>/<tag>/refs - One file per virtualenv using this entry
+                <storeDirectory>/lock                                - Held shared while linking, and exclusive by collectGarbage
+
+            Nothing within "tree" should ever be modified, as the files are shared with every virtualenv linked to it.
+    '''
+
+    __slots__ = ('storeDirectory', 'linkMode')
+
+    def __init__(self, storeDirectory, linkMode=LINK_MODE_HARDLINK):
+        '''
+            @param storeDirectory <str> - Path to the root of the store. Will be created if it does not exist.
+                                            For hardlinks to be used, this should be on the same filesystem as the virtualenvs.
+            @param linkMode <str> Default LINK_MODE_HARDLINK - One of the LINK_MODE_* constants
+        '''
+        if linkMode not in _LINK_FUNCTIONS:
+            raise ValueError('Unknown linkMode "%s". Choices are: %s' %(str(linkMode), str(sorted(_LINK_FUNCTIONS.keys()))))
+
+        self.storeDirectory = os.path.realpath(storeDirectory)
+        self.linkMode = linkMode
+
+        ensureDirectory(self.getWheelsDirectory())
+        ensureDirectory(os.sep.join([self.storeDirectory, 'entries']))
+        ensureDirectory(os.sep.join([self.storeDirectory, 'tmp']))
+
+    def getWheelsDirectory(self):
+        '''
+            getWheelsDirectory - Get the directory holding the original wheel files
+
+            @return <str> - Path to the directory
+        '''
+        return os.sep.join([self.storeDirectory, 'wheels'])
+
+    def getEntryDirectory(self, name, version, tag):
+        '''
+            getEntryDirectory - Get the directory of the store entry for a distribution
+
+            @param name <str> - Distribution name
+            @param version <str> - Distribution version
+            @param tag <str> - The wheel tag (pyver-abi-plat), e.x. "py2.py3-none-any"
+
+            @return <str> - Path to the entry directory (which may not exist)
+        '''
+        return os.sep.join([self.storeDirectory, 'entries', canonicalizeName(name), version, tag])
+
+    def addWheel(self, wheelPath):
+        '''
+            addWheel - Add a wheel to the store, unpacking it if it is not already present.
+
+                Safe to call concurrently from multiple processes. The wheel is unpacked into a temporary
+                  directory within the store, then atomically renamed into place.
+
+            @param wheelPath <str> - Path to a .whl file
+
+            @return <str> - The entry directory for this wheel
+        '''
+        (name, version, tag) = parseWheelFilename(wheelPath)
+        entryDir = self.getEntryDirectory(name, version, tag)
+        treeDir = os.sep.join([entryDir, 'tree'])
+
+        refsDir = os.sep.join([entryDir, 'refs'])
+        if os.path.isdir(treeDir):
+            # Marks the entry as in use, so collectGarbage leaves it alone until it is linked
+            try:
+                os.utime(refsDir, None)
+            except OSError:
+                pass
+            return entryDir
+
+        ensureDirectory(refsDir)
+
+        tmpDir = tempfile.mkdtemp(prefix='unpack_', dir=os.sep.join([self.storeDirectory, 'tmp']))
+        try:
+            with zipfile.ZipFile(wheelPath) as wheelZip:
+                wheelZip.extractall(tmpDir)
+            try:
+                os.rename(tmpDir, treeDir)
+            except OSError:
+                # Another process won the race
+                if not os.path.isdir(treeDir):
+                    raise
+        finally:
+            if os.path.isdir(tmpDir):
+                shutil.rmtree(tmpDir, ignore_errors=True)
+
+        storedWheel = os.sep.join([self.getWheelsDirectory(), os.path.basename(wheelPath)])
+        if not os.path.exists(storedWheel):
+            _hardlinkFile(wheelPath, storedWheel + '.tmp%d' %(os.getpid(),))
+            os.rename(storedWheel + '.tmp%d' %(os.getpid(),), storedWheel)
+
+        with open(os.sep.join([entryDir, 'WHEEL_FILENAME']), 'wt') as f:
+            f.write(os.path.basename(wheelPath))
+
+        return entryDir
+
+    @staticmethod
+    def _getReferenceFilename(entryDir, venvDir):
+        return os.sep.join([entryDir, 'refs', hashlib.sha1(venvDir.encode('utf-8')).hexdigest()])
+
+    def linkIntoEnv(self, entryDir, venvDir):
+        '''
+            linkIntoEnv - Install a store entry into a virtualenv, and record a reference to it.
+
+            @param entryDir <str> - An entry directory, as returned by #addWheel
+            @param venvDir <str/VirtualEnvInfo> - The virtualenv to link into
+
+            @return <str> - The name of the installed dist-info directory
+        '''
+        if isinstance(venvDir, VirtualEnvInfo):
+            venvDir = venvDir.virtualenvDirectory
+        venvDir = os.path.realpath(venvDir)
+
+        with _StoreLock(self.storeDirectory):
+            treeDir = os.sep.join([entryDir, 'tree'])
+            if not os.path.isdir(treeDir):
+                raise ValueError('Store entry "%s" does not exist (it may have been garbage collected). Use addWheel first.' %(entryDir,))
+
+            # If this exact entry is already linked into this virtualenv, there is nothing to do.
+            refFilename = self._getReferenceFilename(entryDir, venvDir)
+            if os.path.exists(refFilename):
+                distInfoName = findDistInfoDirectory(treeDir)
+                if distInfoName and os.path.isdir(os.sep.join([VirtualEnvInfo.getSitePackagesDirectory(venvDir), distInfoName])):
+                    return distInfoName
+
+            # Touched before linking as well, for where the lock is unavailable
+            os.utime(os.sep.join([entryDir, 'refs']), None)
+
+            distInfoName = installUnpackedWheel(treeDir, venvDir, _LINK_FUNCTIONS[self.linkMode])
+
+            with open(refFilename, 'wt') as f:
+                f.write('%s\n%s\n' %(venvDir, distInfoName))
+
+        return distInfoName
+
+    def getReferences(self, entryDir):
+        '''
+            getReferences - Get the virtualenvs which reference a store entry, and are still using it.
+
+            @param entryDir <str> - An entry directory
+
+            @return list<str> - The virtualenv directories referencing this entry
+        '''
+        ret = []
+        refsDir = os.sep.join([entryDir, 'refs'])
+        try:
+            refFilenames = os.listdir(refsDir)
+        except OSError:
+            return ret
+
+        for refFilename in refFilenames:
+            refPath = os.sep.join([refsDir, refFilename])
+            try:
+                with open(refPath, 'rt') as f:
+                    (venvDir, distInfoName) = f.read().strip().split('\n')[:2]
+            except (IOError, OSError, ValueError):
+                continue
+
+            # A reference is live so long as the virtualenv still has this exact distribution installed
+            if os.path.isdir(os.sep.join([VirtualEnvInfo.getSitePackagesDirectory(venvDir), distInfoName])):
+                ret.append(venvDir)
+            else:
+                try:
+                    os.unlink(refPath)
+                except OSError:
+                    pass
+
+        return ret
+
+    def collectGarbage(self, minAge=3600, dryRun=False):
+        '''
+            collectGarbage - Remove entries (and their wheels) which are no longer referenced by any virtualenv.
+
+                References from virtualenvs which have been deleted, or have since upgraded/uninstalled that distribution, are dropped.
+
+            @param minAge <int> Default 3600 - Entries added, or linked, within this many seconds are never removed,
+                                                so an entry returned by addWheel is not removed before it is linked.
+                                                Entries are only removed while holding the store lock exclusively,
+                                                so never while any process is linking from the store.
+            @param dryRun <bool> Default False - If True, nothing is removed, only reported.
+
+            @return list<str> - The entry directories which were (or with #dryRun, would be) removed
+        '''
+        removed = []
+        now = time.time()
+        entriesDir = os.sep.join([self.storeDirectory, 'entries'])
+
+        for (dirPath, dirNames, fileNames) in os.walk(entriesDir):
+            if 'tree' not in dirNames:
+                continue
+            # This is an entry directory, do not descend further.
+            del dirNames[:]
+
+            # Cheap check without the lock first, so links are only held up by entries which are likely garbage
+            if self.getReferences(dirPath) or self._isRecentlyUsed(dirPath, now, minAge):
+                continue
+            if dryRun:
+                removed.append(dirPath)
+                continue
+
+            with _StoreLock(self.storeDirectory, exclusive=True):
+                # Re-checked under the lock, as a link may have started (or finished) since
+                if self.getReferences(dirPath) or self._isRecentlyUsed(dirPath, time.time(), minAge):
+                    continue
+                # Moved aside while still holding the lock, so the (slow) removal does not hold up links
+                garbageDir = tempfile.mkdtemp(prefix='garbage_', dir=os.sep.join([self.storeDirectory, 'tmp']))
+                os.rename(dirPath, os.sep.join([garbageDir, 'entry']))
+            removed.append(dirPath)
+
+            try:
+                with open(os.sep.join([garbageDir, 'entry', 'WHEEL_FILENAME']), 'rt') as f:
+                    os.unlink(os.sep.join([self.getWheelsDirectory(), f.read().strip()]))
+            except (IOError, OSError):
+                pass
+
+            shutil.rmtree(garbageDir, ignore_errors=True)
+
+            # Cleanup empty version/name directories
+            parentDir = os.path.dirname(dirPath)
+            while parentDir != entriesDir:
+                try:
+                    os.rmdir(parentDir)
+                except OSError:
+                    break
+                parentDir = os.path.dirname(parentDir)
+
+        return removed
+
+    @staticmethod
+    def _isRecentlyUsed(entryDir, now, minAge):
+        try:
+            return now - os.stat(os.sep.join([entryDir, 'refs'])).st_mtime < minAge
+        except OSError:
+            return False
+
+    def installRequirements(self, reqContents, venvDir, stdout=sys.stdout, stderr=sys.stderr, noDeps=False, timeout=None):
+        '''
+            installRequirements - Resolve a requirements.txt to wheels, add them to the store, and link them into a virtualenv.
+
+                pip is first run against only the wheels already in the store (no network access), and only
+                  if that cannot satisfy the requirements is the configured index consulted.
+
+            @param reqContents <str> - Contents of a requirements.txt
+            @param venvDir <str/VirtualEnvInfo> - The virtualenv to install into
+            @param stdout <iostream/None> - Stream to be used as stdout for pip. Use "None" to swallow output.
+            @param stderr <iostream/None> - Stream to be used as stderr for pip. Use "None" to swallow output.
+            @param noDeps <bool> Default False - If True, dependencies are not resolved (i.e. #reqContents is already a complete set of pins, like a lock file)
+            @param timeout <float/None> Default None - If provided, the maximum number of seconds each pip invocation may take
+
+            @return list<str> - The dist-info directory names installed
+
+            @raises -
+                VirtualEnvOnDemand.exceptions.PipInstallFailed - If pip could not resolve or build the wheels
+                VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If pip exceeded #timeout
+        '''
+        if isinstance(venvDir, VirtualEnvInfo):
+            venvDir = venvDir.virtualenvDirectory
+
+        wheelhouse = tempfile.mkdtemp(prefix='venv_wheels_', dir=venvDir)
+        reqFilename = writeRequirementsFile(reqContents, venvDir)
+        try:
+            wheelArgs = ['wheel', '--find-links', self.getWheelsDirectory(), '--wheel-dir', wheelhouse, '-r', reqFilename]
+            if noDeps:
+                wheelArgs.insert(1, '--no-deps')
+
+            returnCode = runPip(venvDir, wheelArgs[:1] + ['--no-index'] + wheelArgs[1:], None, None, timeout)
+            if returnCode != 0:
+                returnCode = runPip(venvDir, wheelArgs, stdout, stderr, timeout)
+            if returnCode != 0:
+                raise PipInstallFailed(returnCode, reqContents)
+
+            ret = []
+            for wheelFilename in sorted(os.listdir(wheelhouse)):
+                if not wheelFilename.endswith('.whl'):
+                    continue
+                # Held across adding and linking, so the entry cannot be collected in between
+                with _StoreLock(self.storeDirectory):
+                    entryDir = self.addWheel(os.sep.join([wheelhouse, wheelFilename]))
+                    ret.append(self.linkIntoEnv(entryDir, venvDir))
+        finally:
+            shutil.rmtree(wheelhouse, ignore_errors=True)
+            try:
+                os.remove(reqFilename)
+            except:
+                pass
+
+        return ret
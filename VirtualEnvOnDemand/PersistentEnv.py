@@ -6,23 +6,59 @@
 '''
 
 import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from .CreateEnv import createEnv, activateEnv
 from .GlobalEnv import setGlobalVirtualEnv
 from .VirtualEnvInfo import getInfoFromVirtualEnv
 from .InstallPackages import installPackages
+from .Slim import slimEnv, SLIM_DEFAULT_CLASSES
+from .BuildDaemon import buildPriority, PRIORITY_BACKGROUND
+from .Integrity import verifyEnvIntegrity, repairEnv
+from .Installers import PipInstaller
+from .LazyImports import LazyImporter, getDefaultLazyImporter
+from .ResourcePolicy import HostSemaphore
+from .exceptions import BuildSlotTimedOut
 
-from .utils import cmp_version, writeStrToFile
+from .utils import cmp_version, ensureDirectory, writeStrToFile
 
 
-__all__ = ('setupAndActivateEnv', )
+__all__ = ('setupAndActivateEnv', 'waitForBackgroundUpgrade')
 
 # Filename which marks "myVersion" on a virtualenv.
 #  TODO: Maybe integrate this deeper into things, i.e. VirtualEnvInfo
 MY_VERSION_FILENAME = '.VirtualEnvOnDemand_Version'
 
-def setupAndActivateEnv(parentDirectory, name, packages, myVersion=None, forceInstallPackages=False, enableOnDemandImporter=False, printDebug=False):
+# GENERATIONS_SUFFIX - With background upgrades, "parentDirectory/name" is a symlink to the current generation,
+#   and every generation lives within "parentDirectory/name" + GENERATIONS_SUFFIX
+GENERATIONS_SUFFIX = '.generations'
+
+# UPGRADE_LOCK_DIRNAME - Within the generations directory, holds the lock held by the one process building a new generation.
+UPGRADE_LOCK_DIRNAME = '.upgrade-lock'
+
+# GENERATION_IN_USE_FILENAME - Within each generation, locked (shared) by every process which activated that generation
+GENERATION_IN_USE_FILENAME = '.VirtualEnvOnDemand_InUse'
+
+# KEEP_GENERATIONS - Number of generations (including the current) retained after a successful background upgrade.
+#   Older generations are also kept for as long as any process which activated them is running.
+KEEP_GENERATIONS = 2
+
+global _backgroundUpgradeThreads
+_backgroundUpgradeThreads = []
+
+# _heldGenerations - The open, locked GENERATION_IN_USE_FILENAME of each generation activated by this process. Held until exit.
+_heldGenerations = []
+
+def setupAndActivateEnv(parentDirectory, name, packages, myVersion=None, forceInstallPackages=False, enableOnDemandImporter=False, printDebug=False, packageStore=None, lockFile=None, backgroundUpgrade=False, installer=None, withPip=True, slim=False, verifyIntegrity=False, lazyImports=False):
     '''
         setupAndActivateEnv - 
 
@@ -32,7 +68,7 @@ def setupAndActivateEnv(parentDirectory, name, packages, myVersion=None, forceIn
 
                 List   - A list/tuple/set of package names (optionally including version requirements, e.x. MyPkg==1.2.3)
                 Dict   - A dictionary of package names to versions. If no value is present (i.e. evaluates to False, like '' or None), the latest will be fetched.
-                String - Directly becomes contents of requirements.txt file to be ingested by pip
+                String - Contents of a requirements.txt file. It is normalized (duplicates merged, conflicts raised) before pip ingests it.
 
               Note: if the virtualenv exists already, updates to this field will go unnoticed unless 
                 "myVersion" increases, or "forceInstallPackages" is set. @see #myVersion parameter below.
@@ -53,15 +89,66 @@ def setupAndActivateEnv(parentDirectory, name, packages, myVersion=None, forceIn
                 On production and deployed code, you will likely want to leave this as False, as it carries a performence penality with every script invocation
                   to check for updates. Instead, bump the value of "myVersion" e.g. from "1.2.0" to "1.2.0.1" or similar, or 
                   explicitly call #VirtualEnvOnDemand.InstallPackages.installPackages from an admin servlet, for example.
+                  A long-running service can instead follow its requirements file with #VirtualEnvOnDemand.RequirementsWatcher.watchRequirements
 
             @param enableOnDemandImporter <bool> Default False - If True, will use this env as the global "on demand" importer. 
                 @see #VirtualEnvOnDemand.GlobalEnv.enableOnDemandImporter
 
             @param printDebug <bool> Default False - If True, will print debug messages about what's going on to stderr.
+
+            @param packageStore <None/str/PackageStore> Default None - If provided, packages are unpacked once into this host-wide store,
+                and hardlinked into the virtualenv. Use this when many persistent envs on a host share the same packages.
+                @see VirtualEnvOnDemand.PackageStore.PackageStore
+
+            @param lockFile <None/bool/str> Default None - If True, the first successful install writes a lock file of exact pins into the virtualenv,
+                and later installs of the same #packages use it with no dependency resolution. Use a str path instead to share one lock between hosts.
+                @see VirtualEnvOnDemand.InstallPackages.installPackages
+
+            @param backgroundUpgrade <bool> Default False - If True, an upgrade (higher #myVersion, or #forceInstallPackages) does not block.
+
+                The currently installed env is activated right away, and a complete new env is built on a background thread in a sibling
+                  directory ( "name" + GENERATIONS_SUFFIX ). Once it is built, the "parentDirectory/name" symlink is atomically switched to
+                  point at it, so the next process to start uses the upgraded env. If the upgrade fails, the working env is left untouched.
+
+                In this mode, "parentDirectory/name" is a symlink to the current generation. An existing env which is a plain directory
+                  (created without this flag) is upgraded in-line as before. Platforms without symlinks (Windows) also upgrade in-line.
+
+                Generations older than the current one are removed once no running process has them activated (per a lock file held
+                  by setupAndActivateEnv. On platforms without flock, the previous generation is kept, and older ones removed).
+
+                The background thread is a daemon, so it does not hold up exit. An upgrade interrupted by exit is started over by the next process.
+                  @see #waitForBackgroundUpgrade
+
+            @param installer <None/InstallerBackend> Default None - The backend used to install packages, e.x. a LocalWheelInstaller to install
+                from local wheels in-process. @see VirtualEnvOnDemand.Installers
+
+            @param withPip <bool> Default True - If False, the env is created without its own pip, which is much faster.
+                @see VirtualEnvOnDemand.CreateEnv.createEnv
+
+            @param slim <bool/list<str>> Default False - If True, files not needed at runtime (tests, docs, etc) are removed after each install.
+                Modules recorded with VirtualEnvOnDemand.Slim.recordImports are always kept. @see VirtualEnvOnDemand.Slim.slimEnv
+
+            @param verifyIntegrity <bool> Default False - If True, when using an existing env, every installed file is hashed and checked against
+                its distribution's RECORD. Only the broken distributions (e.x. by an interrupted install, or deleted files) are reinstalled,
+                and the env is recreated only if that fails. This costs time on every call, proportional to the size of the env.
+                @see VirtualEnvOnDemand.Integrity
+
+            @param lazyImports <bool/LazyImporter> Default False - If True, the python modules within the env are loaded lazily: importing
+                one only creates the module, and its body runs upon first use, so modules imported but unused cost nothing at startup.
+                The shared VirtualEnvOnDemand.LazyImports.getDefaultLazyImporter is used, whose getReport lists the modules never used.
+                Pass a LazyImporter to choose which packages are loaded lazily. Requires python 3.5+. @see VirtualEnvOnDemand.LazyImports
     '''
 
+    if lazyImports:
+        # Before any work, so an unsupported python fails fast
+        lazyImporter = lazyImports if isinstance(lazyImports, LazyImporter) else getDefaultLazyImporter()
+
     virtualenvInfo = None
 
+    # installArgs - Passed through to every installPackages, and createArgs to every createEnv
+    installArgs = { 'packageStore' : packageStore, 'lockFile' : lockFile, 'installer' : installer }
+    createArgs = dict(installArgs, withPip=withPip, slim=slim)
+
     # venvPath - The combination of parentDirectory and name
     venvPath = os.sep.join([parentDirectory, name])
 
@@ -90,11 +177,24 @@ def setupAndActivateEnv(parentDirectory, name, packages, myVersion=None, forceIn
             # No previous version, we will set it.
             doInstallPackages = True
 
+    # Blue/green upgrades need "venvPath" to be (or become) a symlink to a generation
+    if backgroundUpgrade and (not hasattr(os, 'symlink') or (os.path.exists(venvPath) and not os.path.islink(venvPath))):
+        if printDebug:
+            sys.stderr.write ( "Cannot use background upgrade, as \"%s\" is not a symlink. Upgrades will be in-line.\n" %(venvPath,))
+        backgroundUpgrade = False
+
     # If there is no folder where our virtualenv should be, we must create it.
-    if not os.path.isdir(venvPath):
+    if backgroundUpgrade and not _isUsableEnv(venvPath):
+        if printDebug:
+            sys.stderr.write ( "Creating Env generation...\n")
+        virtualenvInfo = _createGeneration(parentDirectory, name, packages, myVersion, createArgs, printDebug)
+        _switchCurrentGeneration(venvPath, virtualenvInfo.virtualenvDirectory)
+
+        doInstallPackages = False
+    elif not os.path.isdir(venvPath):
         if printDebug:
             sys.stderr.write ( "Creating Env...\n")
-        virtualenvInfo = createEnv(packages=packages, parentDirectory=parentDirectory, name=name, stdout=None, stderr=None, deleteOnClose=False)
+        virtualenvInfo = createEnv(packages=packages, parentDirectory=parentDirectory, name=name, stdout=None, stderr=None, deleteOnClose=False, **createArgs)
         _writeVersionFileContents(versionFilePath, myVersion, printDebug)
 
         doInstallPackages = False
@@ -104,34 +204,68 @@ def setupAndActivateEnv(parentDirectory, name, packages, myVersion=None, forceIn
             sys.stderr.write ( "Using existing Env....\n")
         try:
             virtualenvInfo = getInfoFromVirtualEnv(venvPath, validate=True)
+            if verifyIntegrity:
+                _verifyAndRepair(virtualenvInfo, installer, printDebug)
         except ValueError as validationError:
             # This virtualenv is not usable. Maybe it is an empty directory, maybe something else. validationError will have the given reason.
             #  so create a virtualenv at this location.
             if printDebug:
                 sys.stderr.write ( "Cannot use virtualenv, recreating. Reason: " + str(validationError) + "\n" )
-            virtualenvInfo = createEnv(packages=packages, parentDirectory=parentDirectory, name=name, stdout=None, stderr=None, deleteOnClose=False)
+            virtualenvInfo = createEnv(packages=packages, parentDirectory=parentDirectory, name=name, stdout=None, stderr=None, deleteOnClose=False, **createArgs)
             _writeVersionFileContents(versionFilePath, myVersion, printDebug)
 
             doInstallPackages = False
 
     # If this flag is set, try to update packages, and install any new ones.
-    if doInstallPackages:
+    if doInstallPackages and backgroundUpgrade:
+        _startBackgroundUpgrade(parentDirectory, name, packages, myVersion, createArgs, printDebug)
+    elif doInstallPackages:
         if printDebug:
             (useStdout, useStderr) = (sys.stderr, sys.stderr)
         else:
             (useStdout, useStderr) = (None, None)
-        installPackages(packages, virtualenvInfo, stdout=useStdout, stderr=useStderr)
+        installPackages(packages, virtualenvInfo, stdout=useStdout, stderr=useStderr, **installArgs)
+        if slim:
+            slimReport = slimEnv(virtualenvInfo, SLIM_DEFAULT_CLASSES if slim is True else slim)
+            if printDebug:
+                sys.stderr.write ( "Slimmed Env, removed %d files (%d bytes).\n" %(slimReport.filesRemoved, slimReport.bytesSaved))
         _writeVersionFileContents(versionFilePath, myVersion, printDebug)
 
     # Use "activateEnv" to just activate this env as-is
+    if os.path.dirname(virtualenvInfo.virtualenvDirectory) == os.path.realpath(_getGenerationsDirectory(parentDirectory, name)):
+        _holdGeneration(virtualenvInfo.virtualenvDirectory)
     activateEnv(virtualenvInfo)
 
+    if lazyImports:
+        lazyImporter.addEnv(virtualenvInfo)
+        lazyImporter.enable()
+
     if enableOnDemandImporter:
         setGlobalVirtualEnv(virtualenvInfo, enableOnDemandImporter=True)
 
     return virtualenvInfo
 
 
+def _verifyAndRepair(virtualenvInfo, installer=None, printDebug=False):
+    '''
+        _verifyAndRepair - Deep verify an env, and reinstall any broken distributions
+
+        @raises ValueError - If the env is broken and could not be repaired
+    '''
+    report = verifyEnvIntegrity(virtualenvInfo)
+    if report.success:
+        return
+
+    if printDebug:
+        sys.stderr.write ( "Env is damaged, repairing: %s\n" %(', '.join(sorted(report.broken.keys())),))
+    try:
+        report = repairEnv(virtualenvInfo, report, None, None, installer=installer if isinstance(installer, PipInstaller) else None)
+    except Exception as repairError:
+        raise ValueError('Failed to repair damaged distributions (%s): %s' %(', '.join(sorted(report.broken.keys())), str(repairError)))
+    if not report.success:
+        raise ValueError('Distributions still damaged after repair: %s' %(', '.join(sorted(report.broken.keys())),))
+
+
 def _writeVersionFileContents(filename, myVersion, printDebug=False):
     if myVersion in (None, False):
         return
@@ -141,4 +275,192 @@ def _writeVersionFileContents(filename, myVersion, printDebug=False):
     if ex and printDebug is True:
         sys.stderr.write('Failed to update file "%s" with user-provided version "%s". Error was: %s\n' %(filename, myVersion, str(ex)))
     return ex
-        
+
+
+def waitForBackgroundUpgrade(timeout=None):
+    '''
+        waitForBackgroundUpgrade - Wait for any background upgrades started by setupAndActivateEnv(..., backgroundUpgrade=True) to complete.
+
+            The upgraded env is not activated in this process, it is used by the next process which starts.
+
+        @param timeout <float/None> - Maximum number of seconds to wait, or None to wait forever.
+
+        @return <bool> - True if no background upgrades are still running
+    '''
+    deadline = timeout is not None and (time.time() + timeout) or None
+    for thread in list(_backgroundUpgradeThreads):
+        thread.join(deadline is not None and max(0, deadline - time.time()) or None)
+
+    return not [ thread for thread in _backgroundUpgradeThreads if thread.is_alive() ]
+
+
+def _isUsableEnv(venvPath):
+    try:
+        getInfoFromVirtualEnv(venvPath, validate=True)
+    except ValueError:
+        return False
+    return True
+
+
+def _getGenerationsDirectory(parentDirectory, name):
+    return os.sep.join([parentDirectory, name + GENERATIONS_SUFFIX])
+
+
+def _createGeneration(parentDirectory, name, packages, myVersion, createArgs, printDebug=False):
+    '''
+        _createGeneration - Build a complete new env within the generations directory.
+
+            On failure, the partially-built generation is removed and the exception re-raised.
+
+        @param createArgs <dict> - Extra arguments to createEnv (packageStore, lockFile, installer, withPip, slim)
+
+        @return <VirtualEnvInfo> - The new generation
+    '''
+    generationsDir = ensureDirectory(_getGenerationsDirectory(parentDirectory, name))
+    generationPath = tempfile.mkdtemp(prefix='gen_%s_' %(time.strftime('%Y%m%d%H%M%S'),), dir=generationsDir)
+
+    try:
+        virtualenvInfo = createEnv(packages=packages, parentDirectory=generationsDir, name=os.path.basename(generationPath), stdout=None, stderr=None, deleteOnClose=False, activateEnvironment=False, **createArgs)
+    except:
+        shutil.rmtree(generationPath, ignore_errors=True)
+        raise
+
+    _writeVersionFileContents(os.sep.join([generationPath, MY_VERSION_FILENAME]), myVersion, printDebug)
+    return virtualenvInfo
+
+
+def _switchCurrentGeneration(venvPath, generationPath):
+    '''
+        _switchCurrentGeneration - Atomically point the "venvPath" symlink at a generation.
+
+            A new symlink is created aside, then renamed over the old one, so there is never a moment where venvPath is missing.
+    '''
+    target = os.path.relpath(generationPath, os.path.dirname(os.path.abspath(venvPath)))
+    tmpLink = '%s.tmp%d' %(venvPath, os.getpid())
+    if os.path.lexists(tmpLink):
+        os.unlink(tmpLink)
+    os.symlink(target, tmpLink)
+    os.rename(tmpLink, venvPath)
+
+
+def _holdGeneration(generationPath):
+    '''
+        _holdGeneration - Mark a generation as in use by this process, until it exits, so it is not pruned
+    '''
+    if fcntl is None:
+        return
+    try:
+        inUseFile = open(os.sep.join([generationPath, GENERATION_IN_USE_FILENAME]), 'a')
+    except (IOError, OSError):
+        return
+    fcntl.flock(inUseFile.fileno(), fcntl.LOCK_SH)
+    _heldGenerations.append(inUseFile)
+
+
+def _lockUnusedGeneration(generationPath):
+    '''
+        _lockUnusedGeneration - Lock a generation exclusively, if no process has it activated
+
+        @return <file/None> - The locked file (close it once the generation is removed), or None if the generation is in use
+    '''
+    try:
+        inUseFile = open(os.sep.join([generationPath, GENERATION_IN_USE_FILENAME]), 'a')
+    except (IOError, OSError):
+        return None
+    try:
+        fcntl.flock(inUseFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        inUseFile.close()
+        return None
+    return inUseFile
+
+
+def _acquireUpgradeLock(generationsDir):
+    '''
+        _acquireUpgradeLock - Try to become the one process upgrading an env. The lock is released by the OS if its holder dies.
+
+        @return <file/None> - The held lock (release with HostSemaphore.release), or None if another process holds it
+    '''
+    try:
+        return HostSemaphore(os.sep.join([generationsDir, UPGRADE_LOCK_DIRNAME]), 1).acquire(timeout=0)[0]
+    except (BuildSlotTimedOut, IOError, OSError):
+        return None
+
+
+def _pruneGenerations(venvPath, generationsDir, keep=KEEP_GENERATIONS):
+    '''
+        _pruneGenerations - Remove the generations beyond the newest #keep which no process has activated, never removing the current one.
+    '''
+    currentPath = os.path.realpath(venvPath)
+    generations = sorted( [ x for x in os.listdir(generationsDir) if x.startswith('gen_') ] )
+    for generation in generations[:max(0, len(generations) - keep)]:
+        generationPath = os.sep.join([generationsDir, generation])
+        if os.path.realpath(generationPath) == currentPath:
+            continue
+        if fcntl is None:
+            shutil.rmtree(generationPath, ignore_errors=True)
+            continue
+
+        inUseFile = _lockUnusedGeneration(generationPath)
+        if inUseFile is None:
+            continue
+        try:
+            # Removed while locked, so a process activating it meanwhile waits (and then fails to use it) rather than seeing it half-removed
+            shutil.rmtree(generationPath, ignore_errors=True)
+        finally:
+            inUseFile.close()
+
+
+def _startBackgroundUpgrade(parentDirectory, name, packages, myVersion, createArgs, printDebug=False):
+    '''
+        _startBackgroundUpgrade - Build a new generation on a background thread, and switch to it upon success.
+
+            If another process is already upgrading this env, nothing is done.
+
+        @return <threading.Thread/None> - The started thread, or None if another process holds the upgrade
+    '''
+    venvPath = os.sep.join([parentDirectory, name])
+    upgradeLock = _acquireUpgradeLock(ensureDirectory(_getGenerationsDirectory(parentDirectory, name)))
+
+    if upgradeLock is None:
+        if printDebug:
+            sys.stderr.write ( "Another process is already upgrading \"%s\", skipping.\n" %(venvPath,))
+        return None
+
+    def _upgrade():
+        try:
+            if printDebug:
+                sys.stderr.write ( "Building upgraded Env generation in background...\n")
+            try:
+                # Nothing waits on this, so let everything else queued on the build daemon go first
+                with buildPriority(PRIORITY_BACKGROUND):
+                    virtualenvInfo = _createGeneration(parentDirectory, name, packages, myVersion, createArgs, printDebug)
+            except Exception as upgradeError:
+                if printDebug:
+                    sys.stderr.write ( "Background upgrade of \"%s\" failed, keeping current env. Reason: %s\n" %(venvPath, str(upgradeError)))
+                return
+
+            try:
+                _switchCurrentGeneration(venvPath, virtualenvInfo.virtualenvDirectory)
+            except Exception as switchError:
+                shutil.rmtree(virtualenvInfo.virtualenvDirectory, ignore_errors=True)
+                if printDebug:
+                    sys.stderr.write ( "Failed to switch \"%s\" to the upgraded env, keeping current env. Reason: %s\n" %(venvPath, str(switchError)))
+                return
+            if printDebug:
+                sys.stderr.write ( "Background upgrade complete, \"%s\" now points to \"%s\".\n" %(venvPath, virtualenvInfo.virtualenvDirectory))
+
+            try:
+                _pruneGenerations(venvPath, os.path.dirname(virtualenvInfo.virtualenvDirectory))
+            except Exception as pruneError:
+                if printDebug:
+                    sys.stderr.write ( "Failed to remove old generations of \"%s\". Reason: %s\n" %(venvPath, str(pruneError)))
+        finally:
+            HostSemaphore.release(upgradeLock)
+
+    thread = threading.Thread(target=_upgrade, name='VirtualEnvOnDemand-upgrade-%s' %(name,))
+    # Does not hold up exit. The version marker of the current generation is unchanged, so the next process starts the upgrade over.
+    thread.daemon = True
+    _backgroundUpgradeThreads.append(thread)
+    thread.start()
+    return thread
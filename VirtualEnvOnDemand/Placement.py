@@ -0,0 +1,238 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Placement - Where temporary envs (createEnv without a "parentDirectory", and the on-demand env) are created.
+
+      By default they are created within tempfile.gettempdir(). With a memory budget set, they are instead placed on a
+        memory-backed filesystem (e.x. /dev/shm) whenever it has the free space and the envs already placed there
+        fit within the budget, and spill over to tempfile.gettempdir() otherwise. Creating an env and installing into it
+        is then mostly memory-speed I/O.
+
+      Example:
+
+        from VirtualEnvOnDemand.Placement import setPlacementPolicy
+
+        setPlacementPolicy(memoryBudget=512 * 1024 * 1024)
+
+      Only envs removed when the process exits (createEnv "deleteOnClose") are placed in memory. The bytes used are
+        accounted per process, by measuring the live envs each time one is placed, so an env which grows afterwards
+        (e.x. the on-demand env) is counted against later placements, but is never moved.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import tempfile
+import threading
+
+from .Metrics import ENV_PLACEMENTS
+
+__all__ = ('setPlacementPolicy', 'getPlacementPolicy', 'placeTemporaryEnv', 'getMemoryEnvUsage', 'EnvPlacement',
+    'DEFAULT_MEMORY_DIRECTORIES', 'MEMORY_FILESYSTEMS',
+)
+
+# DEFAULT_MEMORY_DIRECTORIES - Candidate memory-backed directories, in order of preference
+DEFAULT_MEMORY_DIRECTORIES = ('/dev/shm', )
+
+# MEMORY_FILESYSTEMS - Filesystem types (from /proc/mounts) which are memory-backed
+MEMORY_FILESYSTEMS = ('tmpfs', 'ramfs')
+
+# The policy applied to temporary envs. @see setPlacementPolicy
+global _placementPolicy
+_placementPolicy = { 'memoryBudget' : None, 'memoryDirectories' : DEFAULT_MEMORY_DIRECTORIES, 'minFreeBytes' : 256 * 1024 * 1024,
+    'estimatedEnvBytes' : 64 * 1024 * 1024 }
+
+# _memoryEnvs - Map of placement -> env directory (None until created), for every live env placed in memory by this process
+_memoryEnvs = {}
+_memoryEnvsLock = threading.Lock()
+
+
+def setPlacementPolicy(memoryBudget=None, memoryDirectories=None, minFreeBytes=256 * 1024 * 1024, estimatedEnvBytes=64 * 1024 * 1024):
+    '''
+        setPlacementPolicy - Set where temporary envs are created
+
+            @param memoryBudget <int/None> Default None - Maximum total bytes of the live envs this process has placed in memory.
+                                                       None (or 0) never places envs in memory.
+            @param memoryDirectories list<str>/None Default None - Candidate memory-backed directories, in order of preference.
+                                                       Default is DEFAULT_MEMORY_DIRECTORIES. Directories which are not writable, not on one of
+                                                       MEMORY_FILESYSTEMS, or mounted "noexec" (scripts and extension modules could not run) are skipped.
+            @param minFreeBytes <int> Default 256MiB - Free space to always leave on the memory-backed filesystem
+            @param estimatedEnvBytes <int> Default 64MiB - Bytes expected to be used by a new env, which must fit before it is placed in memory
+
+            @return <dict> - The previous policy
+    '''
+    global _placementPolicy
+
+    if memoryBudget is not None and memoryBudget < 0:
+        raise ValueError('memoryBudget must be >= 0, or None to never place envs in memory')
+
+    oldPolicy = _placementPolicy
+    _placementPolicy = { 'memoryBudget' : memoryBudget, 'memoryDirectories' : tuple(memoryDirectories or DEFAULT_MEMORY_DIRECTORIES),
+        'minFreeBytes' : minFreeBytes, 'estimatedEnvBytes' : estimatedEnvBytes }
+    return oldPolicy
+
+
+def getPlacementPolicy():
+    '''
+        getPlacementPolicy - Get where temporary envs are created. @see setPlacementPolicy
+
+            @return <dict> - Copy of the policy
+    '''
+    return dict(_placementPolicy)
+
+
+def _readMounts():
+    '''
+        _readMounts - Read the mount table (Linux)
+
+        @return list<tuple<str, str, list<str>>> - ( mount point, filesystem type, options ) of every mount, or empty if unavailable
+    '''
+    try:
+        with open('/proc/mounts', 'rt') as f:
+            lines = f.read().split('\n')
+    except (IOError, OSError):
+        return []
+
+    ret = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 4:
+            # Spaces and such in the mount point are octal-escaped
+            mountPoint = fields[1].replace('\\040', ' ').replace('\\011', '\t').replace('\\134', '\\')
+            ret.append( (mountPoint, fields[2], fields[3].split(',')) )
+    return ret
+
+
+def _getMount(directory, mounts):
+    '''
+        _getMount - Find the mount a directory is on
+
+        @return tuple<str, str, list<str>>/None - The entry from _readMounts, or None
+    '''
+    ret = None
+    for mount in mounts:
+        mountPoint = mount[0]
+        if directory == mountPoint or directory.startswith(mountPoint.rstrip('/') + '/'):
+            # The longest match, and the last mounted on the same point, wins
+            if ret is None or len(mountPoint) >= len(ret[0]):
+                ret = mount
+    return ret
+
+
+def _getFreeBytes(directory):
+    try:
+        stat = os.statvfs(directory)
+    except (AttributeError, OSError):
+        return 0
+    return stat.f_bavail * stat.f_frsize
+
+
+def _getTreeBytes(directory):
+    '''
+        _getTreeBytes - Get the bytes used by everything within a directory
+    '''
+    total = 0
+    for (dirPath, dirNames, fileNames) in os.walk(directory):
+        for name in fileNames + dirNames:
+            try:
+                stat = os.lstat(os.sep.join([dirPath, name]))
+            except OSError:
+                continue
+            blocks = getattr(stat, 'st_blocks', None)
+            total += blocks * 512 if blocks is not None else stat.st_size
+    return total
+
+
+def getMemoryEnvUsage():
+    '''
+        getMemoryEnvUsage - Get the bytes used by each live env this process has placed in memory
+
+            @return dict<str, int> - Env directory -> bytes
+    '''
+    with _memoryEnvsLock:
+        venvDirs = [ venvDir for venvDir in _memoryEnvs.values() if venvDir ]
+    return dict([ (venvDir, _getTreeBytes(venvDir)) for venvDir in venvDirs ])
+
+
+def _findMemoryDirectory(policy):
+    '''
+        _findMemoryDirectory - Find a memory-backed directory with room for another env, per #policy
+
+        @return <str/None>
+    '''
+    mounts = _readMounts()
+    for directory in policy['memoryDirectories']:
+        directory = os.path.realpath(directory)
+        if not os.path.isdir(directory) or not os.access(directory, os.W_OK | os.X_OK):
+            continue
+        mount = _getMount(directory, mounts)
+        if mount is None or mount[1] not in MEMORY_FILESYSTEMS or 'noexec' in mount[2]:
+            continue
+        if _getFreeBytes(directory) - policy['estimatedEnvBytes'] < policy['minFreeBytes']:
+            continue
+        return directory
+    return None
+
+
+class EnvPlacement(object):
+    '''
+        EnvPlacement - Where a temporary env is to be created, from placeTemporaryEnv.
+
+            parentDirectory - The directory to create the env within
+            isMemory        - True if #parentDirectory is memory-backed
+
+            Call assign once the env is created, and release once it is removed (or failed to be created).
+    '''
+
+    __slots__ = ('parentDirectory', 'isMemory')
+
+    def __init__(self, parentDirectory, isMemory=False):
+        self.parentDirectory = parentDirectory
+        self.isMemory = isMemory
+
+    def assign(self, venvDir):
+        '''
+            assign - Record the env created with this placement, so the bytes it uses are accounted
+
+            @param venvDir <str> - The env's root directory
+        '''
+        if self.isMemory:
+            with _memoryEnvsLock:
+                if self in _memoryEnvs:
+                    _memoryEnvs[self] = venvDir
+
+    def release(self):
+        '''
+            release - Stop accounting for the env created with this placement
+        '''
+        if self.isMemory:
+            with _memoryEnvsLock:
+                _memoryEnvs.pop(self, None)
+
+    def __repr__(self):
+        return 'EnvPlacement(parentDirectory=%r, isMemory=%r)' %(self.parentDirectory, self.isMemory)
+
+
+def placeTemporaryEnv(deleteOnClose=True):
+    '''
+        placeTemporaryEnv - Choose where to create a temporary env, per the policy (@see setPlacementPolicy)
+
+            @param deleteOnClose <bool> Default True - If the env is removed when the process exits. Only such envs are placed in memory.
+
+            @return <EnvPlacement>
+    '''
+    policy = _placementPolicy
+    if policy['memoryBudget'] and deleteOnClose:
+        memoryDirectory = _findMemoryDirectory(policy)
+        if memoryDirectory:
+            # Measured outside of the lock, as it walks every env. Envs still being created count as their estimate.
+            createdBytes = sum(getMemoryEnvUsage().values())
+            with _memoryEnvsLock:
+                pendingCount = len([ venvDir for venvDir in _memoryEnvs.values() if not venvDir ])
+                if createdBytes + (pendingCount + 1) * policy['estimatedEnvBytes'] <= policy['memoryBudget']:
+                    placement = EnvPlacement(memoryDirectory, isMemory=True)
+                    _memoryEnvs[placement] = None
+                    ENV_PLACEMENTS.inc(location='memory')
+                    return placement
+
+        ENV_PLACEMENTS.inc(location='disk')
+    return EnvPlacement(tempfile.gettempdir())
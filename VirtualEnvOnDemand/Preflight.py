@@ -0,0 +1,402 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Preflight - Statically find the imports of a program which cannot be satisfied, and install them all before it runs.
+
+      The on-demand importer finds missing packages one import at a time, running pip once per missing name,
+        in the middle of execution. preflight instead parses the program's source (it is not run), collects the top-level names
+        it imports which nothing on the path provides, maps them to distributions, and installs them with a single installPackages call.
+
+      Example:
+
+        from VirtualEnvOnDemand import enableOnDemandImporter
+        from VirtualEnvOnDemand.Preflight import preflight
+
+        enableOnDemandImporter()
+        preflight(['myscript.py'])
+
+      Or from the command line:
+
+        python -m VirtualEnvOnDemand.Preflight --venv /path/to/env myscript.py mypackage/
+
+      Then run the program with that env activated.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import ast
+import imp
+import os
+import sys
+
+from .VirtualEnvInfo import VirtualEnvInfo
+from .InstallPackages import installPackages
+from .exceptions import PipInstallFailed
+
+__all__ = ('IMPORT_NAME_TO_DISTRIBUTION', 'PreflightResult', 'findImports', 'findMissingImports', 'getDistributionName', 'preflight', 'main')
+
+# IMPORT_NAME_TO_DISTRIBUTION - Well-known import names which differ from the name of the distribution providing them.
+#   Names not in here (or in the "distributionMap" argument) are assumed to be the distribution name.
+IMPORT_NAME_TO_DISTRIBUTION = {
+    'Bio'           : 'biopython',
+    'Crypto'        : 'pycryptodome',
+    'OpenSSL'       : 'pyOpenSSL',
+    'PIL'           : 'Pillow',
+    'attr'          : 'attrs',
+    'bs4'           : 'beautifulsoup4',
+    'cv2'           : 'opencv-python',
+    'dateutil'      : 'python-dateutil',
+    'dns'           : 'dnspython',
+    'dotenv'        : 'python-dotenv',
+    'google.protobuf' : 'protobuf',
+    'jose'          : 'python-jose',
+    'jwt'           : 'PyJWT',
+    'magic'         : 'python-magic',
+    'serial'        : 'pyserial',
+    'sklearn'       : 'scikit-learn',
+    'skimage'       : 'scikit-image',
+    'usb'           : 'pyusb',
+    'win32api'      : 'pywin32',
+    'yaml'          : 'PyYAML',
+    'zmq'           : 'pyzmq',
+}
+
+# IMPORT_ERROR_NAMES - Exceptions which mark a "try:" block as an optional import, which preflight skips
+IMPORT_ERROR_NAMES = ('ImportError', 'ModuleNotFoundError', 'Exception', 'BaseException')
+
+
+class PreflightResult(object):
+    '''
+        PreflightResult - The outcome of preflight
+
+            missing   - Map of import name -> distribution name, for every import which could not be satisfied
+            installed - Distributions which were installed
+            failed    - Distributions which could not be installed
+    '''
+
+    __slots__ = ('missing', 'installed', 'failed')
+
+    def __init__(self, missing=None, installed=None, failed=None):
+        self.missing = missing or {}
+        self.installed = installed or []
+        self.failed = failed or []
+
+    @property
+    def success(self):
+        return not self.failed
+
+    def __repr__(self):
+        return 'PreflightResult(missing=%r, installed=%r, failed=%r)' %(self.missing, self.installed, self.failed)
+
+
+def _isOptionalImportTry(node):
+    '''
+        _isOptionalImportTry - Check if a "try:" node handles ImportError (or catches everything), i.e. guards an optional import
+    '''
+    for handler in node.handlers:
+        if handler.type is None:
+            return True
+        handlerTypes = handler.type.elts if isinstance(handler.type, ast.Tuple) else [ handler.type ]
+        for handlerType in handlerTypes:
+            if isinstance(handlerType, ast.Name) and handlerType.id in IMPORT_ERROR_NAMES:
+                return True
+    return False
+
+
+class _ImportCollector(ast.NodeVisitor):
+    '''
+        _ImportCollector - Collect the absolute imports in a module, skipping those guarded by "try: ... except ImportError"
+    '''
+
+    def __init__(self):
+        # imports - Map of dotted module name -> line number of its first import
+        self.imports = {}
+
+    def _addImport(self, moduleName, lineno):
+        if moduleName not in self.imports:
+            self.imports[moduleName] = lineno
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._addImport(alias.name, node.lineno)
+
+    def visit_ImportFrom(self, node):
+        # Relative imports are always local
+        if not node.level and node.module:
+            self._addImport(node.module, node.lineno)
+
+    def visit_Try(self, node):
+        if _isOptionalImportTry(node):
+            # Only the body is guarded. Imports in the handlers, else, and finally still count.
+            for child in node.handlers + node.orelse + node.finalbody:
+                self.visit(child)
+            return
+        self.generic_visit(node)
+
+    # python2 and python < 3.3
+    visit_TryExcept = visit_Try
+
+
+def _iterSourceFiles(path):
+    '''
+        _iterSourceFiles - Yield the python source files within #path (a file, or a directory which is walked)
+    '''
+    if not os.path.isdir(path):
+        yield path
+        return
+
+    for (dirPath, dirNames, fileNames) in os.walk(path):
+        dirNames[:] = sorted([ dirName for dirName in dirNames if not dirName.startswith('.') and dirName != '__pycache__' ])
+        for fileName in sorted(fileNames):
+            if fileName.endswith('.py'):
+                yield os.sep.join([dirPath, fileName])
+
+
+def _getLocalModuleNames(path):
+    '''
+        _getLocalModuleNames - Get the names of the modules and packages which are importable locally when running the program at #path.
+
+            For a script this is its directory (which python puts first on sys.path). For a directory it is the directory
+              itself (its modules), plus the directory itself if it is a package.
+    '''
+    ret = set()
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        searchDir = path
+        if os.path.isfile(os.sep.join([path, '__init__.py'])):
+            ret.add(os.path.basename(path))
+    else:
+        searchDir = os.path.dirname(path)
+
+    try:
+        entries = os.listdir(searchDir)
+    except OSError:
+        return ret
+    for entry in entries:
+        if entry.endswith('.py'):
+            ret.add(entry[:-3])
+        elif os.path.isfile(os.sep.join([searchDir, entry, '__init__.py'])):
+            ret.add(entry)
+    return ret
+
+
+def findImports(paths, stderr=None):
+    '''
+        findImports - Parse python source, and collect the modules it imports at the top level of the import system (absolute imports)
+
+            Imports guarded by "try: ... except ImportError" are skipped, as they are optional.
+            Relative imports, and imports of the program's own modules, are skipped.
+
+        @param paths list<str> / <str> - Python files, or directories which are searched for python files
+        @param stderr <iostream/None> Default None - If provided, files which cannot be parsed are reported here
+
+        @return dict<str, str> - Map of imported dotted module name -> "filename:line" of its first import
+    '''
+    if not isinstance(paths, (list, tuple, set)):
+        paths = [ paths ]
+
+    ret = {}
+    localNames = set()
+    for path in paths:
+        localNames.update(_getLocalModuleNames(path))
+
+        for filename in _iterSourceFiles(path):
+            try:
+                with open(filename, 'rb') as f:
+                    tree = ast.parse(f.read(), filename)
+            except (SyntaxError, ValueError, IOError, OSError) as e:
+                if stderr is not None:
+                    stderr.write('VirtualEnvOnDemand: Cannot parse "%s": %s\n' %(filename, str(e)))
+                continue
+
+            collector = _ImportCollector()
+            collector.visit(tree)
+            for (moduleName, lineno) in collector.imports.items():
+                if moduleName not in ret:
+                    ret[moduleName] = '%s:%d' %(filename, lineno)
+
+    for moduleName in list(ret.keys()):
+        if moduleName.split('.')[0] in localNames:
+            del ret[moduleName]
+
+    return ret
+
+
+def _canFindModule(moduleName, searchPath):
+    '''
+        _canFindModule - Check if a top-level module can be found, without importing it, and without consulting
+          meta path hooks (so the on-demand importer is never triggered)
+    '''
+    if moduleName in sys.modules or moduleName in sys.builtin_module_names:
+        return True
+    try:
+        imp.find_module(moduleName, searchPath)
+        return True
+    except ImportError:
+        pass
+
+    # imp does not find namespace packages (directories without an __init__.py, like "google")
+    for path in searchPath:
+        if os.path.isdir(os.sep.join([path, moduleName])):
+            return True
+    return False
+
+
+def getDistributionName(importName, distributionMap=None):
+    '''
+        getDistributionName - Get the name of the distribution which provides an import
+
+        @param importName <str> - A module name, e.x. "yaml" or "google.protobuf"
+        @param distributionMap <dict/None> Default None - Extra import name -> distribution name mappings, which take precedence
+          over IMPORT_NAME_TO_DISTRIBUTION
+
+        @return <str> - The distribution name
+    '''
+    mappings = IMPORT_NAME_TO_DISTRIBUTION
+    if distributionMap:
+        mappings = dict(IMPORT_NAME_TO_DISTRIBUTION)
+        mappings.update(distributionMap)
+
+    # Check the most specific name first, so "google.protobuf" can map differently than "google"
+    parts = importName.split('.')
+    for i in range(len(parts), 0, -1):
+        name = '.'.join(parts[:i])
+        if name in mappings:
+            return mappings[name]
+    return parts[0]
+
+
+def findMissingImports(paths, venvDir=None, distributionMap=None, ignore=None, stderr=None):
+    '''
+        findMissingImports - Find the imports within #paths which cannot be satisfied by the current path (or #venvDir)
+
+        @param paths list<str> / <str> - Python files, or directories which are searched for python files
+        @param venvDir <str/VirtualEnvInfo/None> Default None - A virtualenv whose packages count as available, even if it is not activated
+        @param distributionMap <dict/None> Default None - Extra import name -> distribution name mappings. @see getDistributionName
+        @param ignore list<str>/None Default None - Top-level import names to never report (e.x. modules only imported on other platforms)
+        @param stderr <iostream/None> Default None - If provided, files which cannot be parsed are reported here
+
+        @return dict<str, str> - Map of missing import name -> distribution name. The import name is the top-level name,
+                                   unless a more specific name maps to its own distribution (e.x. "google.protobuf")
+    '''
+    searchPath = list(sys.path)
+    if venvDir:
+        if isinstance(venvDir, VirtualEnvInfo):
+            venvDir = venvDir.virtualenvDirectory
+        searchPath.insert(0, VirtualEnvInfo.getSitePackagesDirectory(venvDir))
+    searchPath = [ path for path in searchPath if path and os.path.isdir(path) ]
+
+    ignore = set(ignore or [])
+
+    ret = {}
+    canFind = {}
+    for moduleName in sorted(findImports(paths, stderr=stderr).keys()):
+        topLevelName = moduleName.split('.')[0]
+        if topLevelName in ignore:
+            continue
+        if topLevelName not in canFind:
+            canFind[topLevelName] = _canFindModule(topLevelName, searchPath)
+        if canFind[topLevelName]:
+            continue
+
+        distributionName = getDistributionName(moduleName, distributionMap)
+        if distributionName != getDistributionName(topLevelName, distributionMap):
+            # e.x. "google.protobuf", where the top-level name is shared by several distributions
+            ret[moduleName] = distributionName
+        elif topLevelName not in ret:
+            ret[topLevelName] = distributionName
+    return ret
+
+
+def preflight(paths, venvDir=None, stdout=sys.stdout, stderr=sys.stderr, distributionMap=None, ignore=None, dryRun=False, **installKwargs):
+    '''
+        preflight - Install every distribution the program at #paths needs but cannot import, with a single install.
+
+            If the batched install fails (e.x. one name does not exist on the index), each distribution is then installed on its own,
+              so one bad name does not prevent the rest from being installed. Failures are reported in the result, not raised.
+
+        @param paths list<str> / <str> - Python files, or directories which are searched for python files
+        @param venvDir <str/VirtualEnvInfo/None> Default None - The virtualenv to install into. Default is the global env
+                                                                 (@see VirtualEnvOnDemand.GlobalEnv.enableOnDemandImporter), which is built now if deferred.
+        @param stdout <iostream/None> - Stream to be used as stdout for installation. Use "None" to swallow output.
+        @param stderr <iostream/None> - Stream to be used as stderr for installation. Use "None" to swallow output.
+        @param distributionMap <dict/None> Default None - Extra import name -> distribution name mappings. @see getDistributionName
+        @param ignore list<str>/None Default None - Top-level import names to never install
+        @param dryRun <bool> Default False - If True, only find what is missing, do not install
+        @param installKwargs - Passed to installPackages (e.x. packageStore, lockFile, timeout, installer)
+
+        @return <PreflightResult>
+
+        @raises ValueError - If #venvDir is not provided, and the on-demand importer has not been enabled
+    '''
+    if venvDir is None and not dryRun:
+        from .GlobalEnv import _buildDeferredGlobalEnv
+        venvDir = _buildDeferredGlobalEnv()
+        if venvDir is None:
+            raise ValueError('preflight requires a "venvDir", or enableOnDemandImporter() to have been called.')
+
+    missing = findMissingImports(paths, venvDir, distributionMap, ignore, stderr)
+    result = PreflightResult(missing=missing)
+
+    distributionNames = sorted(set(missing.values()))
+    if dryRun or not distributionNames:
+        return result
+
+    try:
+        installPackages(distributionNames, venvDir, stdout, stderr, **installKwargs)
+        result.installed = distributionNames
+    except PipInstallFailed:
+        if len(distributionNames) == 1:
+            result.failed = distributionNames
+            return result
+        for distributionName in distributionNames:
+            try:
+                installPackages([distributionName], venvDir, stdout, stderr, **installKwargs)
+                result.installed.append(distributionName)
+            except PipInstallFailed:
+                result.failed.append(distributionName)
+
+    return result
+
+
+def main(argv=None):
+    '''
+        main - Command-line entry point. @see the module docstring.
+
+        @return <int> - Exit code. 0 if nothing is missing (or everything missing was installed), 1 if anything failed.
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m VirtualEnvOnDemand.Preflight',
+        description='Install the packages a python program imports but cannot find, in one batch, before running it.')
+    parser.add_argument('paths', nargs='+', metavar='path', help='Python files, or directories to search for python files')
+    parser.add_argument('--venv', dest='venvDir', default=None, help='Virtualenv to install into. Required unless --dry-run.')
+    parser.add_argument('--map', dest='mappings', action='append', default=[], metavar='IMPORT=DISTRIBUTION',
+        help='Map an import name to the distribution providing it. May be repeated.')
+    parser.add_argument('--ignore', action='append', default=[], metavar='IMPORT', help='Import name to never install. May be repeated.')
+    parser.add_argument('--dry-run', dest='dryRun', action='store_true', help='Only print what is missing.')
+    args = parser.parse_args(argv)
+
+    distributionMap = {}
+    for mapping in args.mappings:
+        (importName, sep, distributionName) = mapping.partition('=')
+        if not sep or not importName or not distributionName:
+            parser.error('Invalid --map "%s", expected IMPORT=DISTRIBUTION' %(mapping,))
+        distributionMap[importName] = distributionName
+
+    if args.venvDir is None and not args.dryRun:
+        parser.error('--venv is required unless --dry-run')
+
+    result = preflight(args.paths, args.venvDir, sys.stdout, sys.stderr, distributionMap, args.ignore, args.dryRun)
+
+    for (importName, distributionName) in sorted(result.missing.items()):
+        sys.stdout.write('missing: %s (%s)\n' %(importName, distributionName))
+    for distributionName in result.installed:
+        sys.stdout.write('installed: %s\n' %(distributionName,))
+    for distributionName in result.failed:
+        sys.stderr.write('failed: %s\n' %(distributionName,))
+
+    return 0 if result.success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
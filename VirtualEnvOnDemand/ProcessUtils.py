@@ -0,0 +1,180 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    ProcessUtils - Methods for running the subprocesses (virtualenv, pip, interpreters) used by VirtualEnvOnDemand
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from .exceptions import SubprocessTimedOut
+from .ResourcePolicy import getPriorityCommand, getPriorityCreationFlags, setProcessPriority
+
+__all__ = ('runProcess', 'runProcessGetOutput', 'killProcessTree')
+
+# KILL_GRACE_PERIOD - Seconds between asking a timed-out process tree to terminate, and killing it outright
+KILL_GRACE_PERIOD = 2.0
+
+
+def _getPopenKwargs():
+    '''
+        _getPopenKwargs - Extra arguments to Popen, so every subprocess leads its own process group,
+          and can be killed along with everything it has started (e.x. pip's build subprocesses).
+
+          On Windows, the niceness of the resource policy is applied as well. @see VirtualEnvOnDemand.ResourcePolicy
+    '''
+    if os.name == 'nt':
+        return { 'creationflags' : getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0) | getPriorityCreationFlags() }
+
+    if sys.version_info[0] >= 3:
+        # Not preexec_fn, which is unsafe (can deadlock) when other threads are running, as they are for background builds
+        return { 'start_new_session' : True }
+
+    return { 'preexec_fn' : os.setsid }
+
+
+def killProcessTree(pipe, gracePeriod=KILL_GRACE_PERIOD):
+    '''
+        killProcessTree - Kill a process started by runProcess, and all of its descendants.
+
+            The tree is first asked to terminate, and killed outright if still alive after #gracePeriod seconds.
+
+        @param pipe <subprocess.Popen> - The process
+        @param gracePeriod <float> - Seconds to wait after terminating before killing
+    '''
+    if pipe.poll() is not None:
+        return
+
+    if os.name == 'nt':
+        devnull = open(os.devnull, 'wt')
+        try:
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(pipe.pid)], stdout=devnull, stderr=devnull)
+        finally:
+            devnull.close()
+        pipe.wait()
+        return
+
+    for (sig, waitTime) in ( (signal.SIGTERM, gracePeriod), (signal.SIGKILL, None) ):
+        try:
+            os.killpg(pipe.pid, sig)
+        except OSError:
+            pass
+        if _waitForExit(pipe, waitTime) is not None:
+            return
+
+
+def _waitForExit(pipe, timeout):
+    '''
+        _waitForExit - Wait for a process to exit
+
+        @param timeout <float/None> - Seconds to wait, or None to wait forever
+
+        @return <int/None> - The return code, or None if still running after #timeout
+    '''
+    if timeout is None:
+        return pipe.wait()
+
+    deadline = time.time() + timeout
+    sleepTime = 0.01
+    while pipe.poll() is None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        time.sleep(min(sleepTime, remaining))
+        sleepTime = min(sleepTime * 2, 0.25)
+
+    return pipe.returncode
+
+
+def runProcess(cmd, stdout=sys.stdout, stderr=sys.stderr, timeout=None):
+    '''
+        runProcess - Run a command and wait for it to complete.
+
+        @param cmd list<str> - The command and its arguments
+        @param stdout <iostream/None> - Stream to be used as stdout. Use "None" to swallow output.
+        @param stderr <iostream/None> - Stream to be used as stderr. Use "None" to swallow output.
+        @param timeout <float/None> Default None - If provided, the maximum number of seconds to wait.
+                                                     Upon timeout, the process and all of its descendants are killed.
+
+        @return <int> - The return code
+
+        @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If #timeout was exceeded
+    '''
+    # If they chose to ignore output to one or more streams, setup a /dev/null stream
+    devnull = None
+    if stdout is None or stderr is None:
+        devnull = open(os.devnull, 'wt')
+        if stdout is None:
+            stdout = devnull
+        if stderr is None:
+            stderr = devnull
+
+    try:
+        # The resource policy's priority is applied by running under nice/ionice where possible, @see VirtualEnvOnDemand.ResourcePolicy
+        (priorityCmd, remainingPriority) = getPriorityCommand(cmd)
+        pipe = subprocess.Popen(priorityCmd, shell=False, stdout=stdout, stderr=stderr, **_getPopenKwargs())
+        setProcessPriority(pipe.pid, remainingPriority)
+        try:
+            returnCode = _waitForExit(pipe, timeout)
+        except BaseException:
+            # e.x. KeyboardInterrupt, don't leave an orphaned pip behind
+            killProcessTree(pipe)
+            raise
+        if returnCode is None:
+            killProcessTree(pipe)
+            raise SubprocessTimedOut(cmd, timeout)
+    finally:
+        # Cleanup devnull stream if setup
+        if devnull is not None:
+            devnull.close()
+
+    return returnCode
+
+
+def runProcessGetOutput(cmd, stderr=None, timeout=None):
+    '''
+        runProcessGetOutput - Run a command, and collect its stdout.
+
+        @param cmd list<str> - The command and its arguments
+        @param stderr <iostream/None> - Stream to be used as stderr. Default None swallows output.
+        @param timeout <float/None> Default None - If provided, the maximum number of seconds to wait. @see runProcess
+
+        @return tuple<int, str> - ( return code, stdout contents )
+
+        @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If #timeout was exceeded
+    '''
+    devnull = None
+    if stderr is None:
+        devnull = stderr = open(os.devnull, 'wt')
+
+    try:
+        (priorityCmd, remainingPriority) = getPriorityCommand(cmd)
+        pipe = subprocess.Popen(priorityCmd, shell=False, stdout=subprocess.PIPE, stderr=stderr, **_getPopenKwargs())
+        setProcessPriority(pipe.pid, remainingPriority)
+        if timeout is None:
+            output = pipe.communicate()[0]
+        else:
+            # Read on a thread, so we can enforce the timeout on python2 as well
+            import threading
+            outputHolder = []
+            reader = threading.Thread(target=lambda : outputHolder.append(pipe.communicate()[0]))
+            reader.daemon = True
+            reader.start()
+            reader.join(timeout)
+            if reader.is_alive():
+                killProcessTree(pipe)
+                reader.join()
+                raise SubprocessTimedOut(cmd, timeout)
+            output = outputHolder[0]
+    finally:
+        if devnull is not None:
+            devnull.close()
+
+    if not isinstance(output, str):
+        output = output.decode('utf-8', 'replace')
+
+    return (pipe.returncode, output)
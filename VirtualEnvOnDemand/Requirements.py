@@ -0,0 +1,603 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Requirements - Parse, normalize, and merge requirements in-process, and detect conflicting ones, before pip ever runs.
+
+      Each requirement is parsed per the PEP 508 grammar (name, extras, version specifiers, url, environment marker).
+        Names are canonicalized (PEP 503), duplicates (including case, "-", "_" and "." variants) are merged, and combinations
+        which no version can satisfy (e.x. "foo==1" and "foo==2", or "foo>=2,<1") raise RequirementConflict.
+        Malformed requirements raise InvalidRequirement. This takes microseconds, rather than a pip run and its resolver.
+
+      Lines pip accepts which are not PEP 508 requirements (options like "-r" or "--index-url", local paths, and bare urls)
+        are passed through unchanged.
+
+      Conflict detection is conservative: it only reports combinations which are certainly unsatisfiable, and leaves anything
+        subtler (pre-release rules, markers, wildcards against ranges) to pip.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import hashlib
+import re
+
+from .exceptions import InvalidRequirement, RequirementConflict
+from .utils import canonicalizeName
+
+__all__ = ('Requirement', 'parseRequirement', 'parseRequirementsTxt', 'mergeRequirements', 'normalizeRequirementsTxt', 'getRequirementsKey', 'parseVersion', 'normalizeVersion')
+
+
+# NAME_RE - A PEP 508 distribution name
+NAME_RE = re.compile(r'^([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9._-]*[A-Za-z0-9])$')
+
+# REQUIREMENT_RE - name, optional [extras], then the rest (version specifiers, "@ url", and/or "; marker")
+REQUIREMENT_RE = re.compile(r'^\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[(?P<extras>[^\]]*)\])?\s*(?P<rest>.*?)\s*$', re.DOTALL)
+
+# URL_REQUIREMENT_RE - The "@ url [; marker]" of a requirement. A url must be followed by whitespace before the marker.
+URL_REQUIREMENT_RE = re.compile(r'^@\s*(?P<url>\S+)(?:\s+;(?P<marker>.*))?$', re.DOTALL)
+
+# SPECIFIER_RE - One version specifier, e.x. ">= 1.2" or "==1.*"
+SPECIFIER_RE = re.compile(r'^\s*(?P<op>===|~=|==|!=|<=|>=|<|>)\s*(?P<version>[^\s,;()]+)\s*$')
+
+# URL_LINE_RE - Lines which pip accepts, but are not PEP 508 requirements: local paths, archives, and bare (or VCS) urls
+URL_LINE_RE = re.compile(r'^([A-Za-z][A-Za-z0-9+.-]*://|[.~/\\]|[A-Za-z]:[\\/])')
+
+# OPTIONS_SPLIT_RE - Per-requirement pip options (like --hash) following a requirement
+OPTIONS_SPLIT_RE = re.compile(r'\s+(?=--?[A-Za-z])')
+
+# VERSION_RE - A PEP 440 version, as in the PEP's appendix
+VERSION_RE = re.compile(r'''^\s*v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?P<pre>[-_.]?(?P<preLetter>a|b|c|rc|alpha|beta|pre|preview)[-_.]?(?P<preNumber>[0-9]+)?)?
+    (?P<post>(?:-(?P<postImplicit>[0-9]+))|(?:[-_.]?(?P<postLetter>post|rev|r)[-_.]?(?P<postNumber>[0-9]+)?))?
+    (?P<dev>[-_.]?dev[-_.]?(?P<devNumber>[0-9]+)?)?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+    \s*$''', re.VERBOSE | re.IGNORECASE)
+
+# MARKER_VARIABLES - Environment marker variables (PEP 508, plus the legacy dotted names pip still accepts)
+MARKER_VARIABLES = ('python_version', 'python_full_version', 'os_name', 'sys_platform', 'platform_release', 'platform_system',
+    'platform_version', 'platform_machine', 'platform_python_implementation', 'implementation_name', 'implementation_version', 'extra',
+    'os.name', 'sys.platform', 'platform.version', 'platform.machine', 'platform.python_implementation', 'python_implementation')
+
+# MARKER_TOKEN_RE - One token of an environment marker
+MARKER_TOKEN_RE = re.compile(r'''\s*(?:
+    (?P<string>'[^']*'|"[^"]*")|
+    (?P<op>===|==|!=|<=|>=|~=|<|>|not\s+in\b|in\b)|
+    (?P<bool>and\b|or\b)|
+    (?P<paren>[()])|
+    (?P<variable>[A-Za-z_][A-Za-z0-9_.]*)
+    )''', re.VERBOSE)
+
+# _NEG_INF / _POS_INF - Sentinels which sort before / after every (1, value) in version keys
+_NEG_INF = (0,)
+_POS_INF = (2,)
+
+
+def parseVersion(version):
+    '''
+        parseVersion - Parse a PEP 440 version into a key which sorts in version order
+
+        @param version <str> - A version, e.x. "1.2.0rc1"
+
+        @return tuple - ( sort key ignoring the local version label, local version label or None )
+
+        @raises ValueError - If #version is not a valid PEP 440 version
+    '''
+    matchObj = VERSION_RE.match(version)
+    if not matchObj:
+        raise ValueError('Invalid version "%s"' %(version,))
+
+    release = [ int(x) for x in matchObj.group('release').split('.') ]
+    # Trailing zeros are not significant, "1.0" == "1"
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+
+    preLetter = matchObj.group('preLetter')
+    if preLetter:
+        preLetter = { 'alpha' : 'a', 'beta' : 'b', 'c' : 'rc', 'pre' : 'rc', 'preview' : 'rc' }.get(preLetter.lower(), preLetter.lower())
+        pre = (1, preLetter, int(matchObj.group('preNumber') or 0))
+    elif not matchObj.group('post') and matchObj.group('dev'):
+        # 1.0.dev0 sorts before 1.0a0
+        pre = _NEG_INF
+    else:
+        pre = _POS_INF
+
+    if matchObj.group('post'):
+        post = (1, int(matchObj.group('postImplicit') or matchObj.group('postNumber') or 0))
+    else:
+        post = _NEG_INF
+
+    if matchObj.group('dev'):
+        dev = (1, int(matchObj.group('devNumber') or 0))
+    else:
+        dev = _POS_INF
+
+    local = matchObj.group('local')
+    return ( (int(matchObj.group('epoch') or 0), tuple(release), pre, post, dev), local and local.lower() or None )
+
+
+def normalizeVersion(version, stripTrailingZeros=False):
+    '''
+        normalizeVersion - Get the PEP 440 normal form of a version, e.x. "1.0-RC.1" -> "1.0rc1", "1.0-1" -> "1.0.post1"
+
+        @param version <str> - A version. A trailing ".*" (wildcard) is kept, and its release segments are never stripped.
+        @param stripTrailingZeros <bool> Default False - If True, trailing zero release segments are removed ("1.0.0" -> "1"),
+                                                          so equal versions have the same normal form
+
+        @return <str>
+
+        @raises ValueError - If #version is not a valid PEP 440 version
+    '''
+    if version.endswith('.*'):
+        # Zeros are significant in a wildcard, "1.0.*" is not "1.*"
+        return normalizeVersion(version[:-2]) + '.*'
+
+    ((epoch, release, pre, post, dev), local) = parseVersion(version)
+    if not stripTrailingZeros:
+        release = [ int(x) for x in VERSION_RE.match(version).group('release').split('.') ]
+
+    ret = '.'.join([ str(x) for x in release ])
+    if epoch:
+        ret = '%d!%s' %(epoch, ret)
+    if pre[0] == 1:
+        ret += '%s%d' %(pre[1], pre[2])
+    if post[0] == 1:
+        ret += '.post%d' %(post[1],)
+    if dev[0] == 1:
+        ret += '.dev%d' %(dev[1],)
+    if local:
+        ret += '+' + '.'.join(re.split('[-_.]', local))
+    return ret
+
+
+def _getReleasePrefix(version):
+    '''
+        _getReleasePrefix - Get ( epoch, release segments ) of a wildcard version like "1.2.*", or None if not a wildcard
+    '''
+    if not version.endswith('.*'):
+        return None
+    (key, _) = parseVersion(version[:-2])
+    return ( key[0], [ int(x) for x in VERSION_RE.match(version[:-2]).group('release').split('.') ] )
+
+
+def _matchesReleasePrefix(versionKey, releasePrefix):
+    (epoch, prefix) = releasePrefix
+    release = list(versionKey[1]) + [0] * max(0, len(prefix) - len(versionKey[1]))
+    return versionKey[0] == epoch and release[:len(prefix)] == prefix
+
+
+def _normalizeMarker(marker, requirementStr):
+    '''
+        _normalizeMarker - Validate an environment marker against the PEP 508 grammar, and normalize its whitespace and quoting
+
+        @raises InvalidRequirement - If the marker is not valid
+    '''
+    tokens = []
+    pos = 0
+    marker = marker.strip()
+    while pos < len(marker):
+        matchObj = MARKER_TOKEN_RE.match(marker, pos)
+        if not matchObj or matchObj.end() == pos:
+            raise InvalidRequirement(requirementStr, 'Invalid environment marker at "%s"' %(marker[pos:],))
+        pos = matchObj.end()
+        for kind in ('string', 'op', 'bool', 'paren', 'variable'):
+            value = matchObj.group(kind)
+            if value is not None:
+                if kind == 'op':
+                    value = ' '.join(value.split())
+                elif kind == 'string':
+                    value = '"%s"' %(value[1:-1],) if '"' not in value[1:-1] else value
+                elif kind == 'variable' and value not in MARKER_VARIABLES:
+                    raise InvalidRequirement(requirementStr, 'Unknown environment marker variable "%s"' %(value,))
+                tokens.append( (kind, value) )
+                break
+
+    # Recursive descent over:  markerOr := markerAnd ("or" markerAnd)* ;  markerAnd := expr ("and" expr)* ;  expr := "(" markerOr ")" | value op value
+    state = { 'pos' : 0 }
+
+    def _peek():
+        return state['pos'] < len(tokens) and tokens[state['pos']] or (None, None)
+
+    def _take(kind, value=None):
+        (tokenKind, tokenValue) = _peek()
+        if tokenKind != kind or (value is not None and tokenValue != value):
+            raise InvalidRequirement(requirementStr, 'Invalid environment marker "%s"' %(marker,))
+        state['pos'] += 1
+        return tokenValue
+
+    def _expr():
+        if _peek() == ('paren', '('):
+            _take('paren', '(')
+            ret = '(' + _markerOr() + ')'
+            _take('paren', ')')
+            return ret
+        values = []
+        for expected in ('value', 'op', 'value'):
+            (tokenKind, tokenValue) = _peek()
+            if expected == 'value' and tokenKind in ('string', 'variable'):
+                values.append(_take(tokenKind))
+            else:
+                values.append(_take(expected))
+        return ' '.join(values)
+
+    def _markerAnd():
+        ret = _expr()
+        while _peek() == ('bool', 'and'):
+            _take('bool', 'and')
+            ret += ' and ' + _expr()
+        return ret
+
+    def _markerOr():
+        ret = _markerAnd()
+        while _peek() == ('bool', 'or'):
+            _take('bool', 'or')
+            ret += ' or ' + _markerAnd()
+        return ret
+
+    normalized = _markerOr()
+    if state['pos'] != len(tokens):
+        raise InvalidRequirement(requirementStr, 'Invalid environment marker "%s"' %(marker,))
+    return normalized
+
+
+class Requirement(object):
+    '''
+        Requirement - One parsed requirement
+
+            name          - The name as given
+            canonicalName - The PEP 503 canonical name, used to compare requirements
+            extras        - Sorted list of canonicalized extras
+            specifiers    - list of ( operator, version ), e.x. [ ('>=', '1.2'), ('<', '2') ]
+            url           - The url of a "name @ url" requirement, or None
+            marker        - The normalized environment marker, or None
+            options       - Per-requirement pip options which followed it, e.x. [ '--hash=sha256:...' ]
+            line          - For lines which are not PEP 508 requirements (pip options, paths, bare urls), the line. Otherwise None.
+    '''
+
+    __slots__ = ('name', 'canonicalName', 'extras', 'specifiers', 'url', 'marker', 'options', 'line')
+
+    def __init__(self, name=None, extras=None, specifiers=None, url=None, marker=None, options=None, line=None):
+        self.name = name
+        self.canonicalName = name and canonicalizeName(name) or None
+        self.extras = sorted(set(extras or []))
+        self.specifiers = list(specifiers or [])
+        self.url = url
+        self.marker = marker
+        self.options = list(options or [])
+        self.line = line
+
+    @property
+    def isPassthrough(self):
+        '''
+            isPassthrough - True if this is not a PEP 508 requirement (a pip option, path, or bare url) and is passed to pip as-is
+        '''
+        return self.line is not None
+
+    def getMergeKey(self):
+        '''
+            getMergeKey - Requirements with the same merge key refer to the same thing, and are merged
+        '''
+        if self.isPassthrough:
+            return ('line', self.line)
+        return ('requirement', self.canonicalName, self.marker, self.url is not None)
+
+    def __str__(self):
+        return self.toString()
+
+    def toString(self, canonicalVersions=False):
+        '''
+            toString - Format as a line of a requirements.txt
+
+            @param canonicalVersions <bool> Default False - If True, versions have trailing zeros removed (e.x. ">=1.0" -> ">=1"), so that
+                                                             equivalent requirements are formatted the same (@see getRequirementsKey)
+        '''
+        if self.isPassthrough:
+            return self.line
+
+        ret = self.canonicalName
+        if self.extras:
+            ret += '[%s]' %(','.join(self.extras),)
+        if self.url:
+            ret += ' @ ' + self.url
+            if self.marker:
+                # A url must be followed by whitespace before the marker
+                ret += ' '
+        else:
+            specifiers = sorted(self.specifiers, key=_specifierSortKey)
+            if canonicalVersions:
+                specifiers = [ (op, version if op == '===' else normalizeVersion(version, stripTrailingZeros=True)) for (op, version) in specifiers ]
+            ret += ','.join([ op + version for (op, version) in specifiers ])
+        if self.marker:
+            ret += '; ' + self.marker
+        if self.options:
+            ret += ' ' + ' '.join(self.options)
+        return ret
+
+    def __repr__(self):
+        return 'Requirement(%r)' %(str(self),)
+
+
+def _specifierSortKey(specifier):
+    (op, version) = specifier
+    try:
+        return (0, parseVersion(version.rstrip('.*'))[0], op, version)
+    except ValueError:
+        return (1, (), op, version)
+
+
+def parseRequirement(requirementStr):
+    '''
+        parseRequirement - Parse one line of a requirements.txt
+
+        @param requirementStr <str> - A PEP 508 requirement (e.x. 'foo[bar]>=1.0,<2; python_version >= "3.6"'), optionally followed by
+                                        per-requirement pip options (like --hash). Lines which pip accepts but which are not requirements
+                                        (options like "-r file", local paths, urls) are returned as passthrough requirements.
+
+        @return <Requirement>
+
+        @raises InvalidRequirement - If #requirementStr is malformed
+    '''
+    line = ' '.join(requirementStr.split())
+    if not line:
+        raise InvalidRequirement(requirementStr, 'Empty requirement')
+
+    if line.startswith('-') or URL_LINE_RE.match(line):
+        return Requirement(line=line)
+
+    parts = OPTIONS_SPLIT_RE.split(line)
+    (requirementPart, options) = (parts[0], parts[1:])
+
+    matchObj = REQUIREMENT_RE.match(requirementPart)
+    if not matchObj or not NAME_RE.match(matchObj.group('name')):
+        raise InvalidRequirement(requirementStr, 'Invalid distribution name')
+
+    name = matchObj.group('name')
+
+    extras = []
+    if matchObj.group('extras') is not None:
+        for extra in matchObj.group('extras').split(','):
+            extra = extra.strip()
+            if not extra:
+                continue
+            if not NAME_RE.match(extra):
+                raise InvalidRequirement(requirementStr, 'Invalid extra "%s"' %(extra,))
+            extras.append(canonicalizeName(extra))
+
+    rest = matchObj.group('rest')
+    url = None
+    marker = None
+    specifiers = []
+
+    if rest.startswith('@'):
+        urlMatch = URL_REQUIREMENT_RE.match(rest)
+        if not urlMatch or ':' not in urlMatch.group('url'):
+            raise InvalidRequirement(requirementStr, 'Invalid url "%s"' %(rest[1:].strip(),))
+        url = urlMatch.group('url')
+        if urlMatch.group('marker') is not None:
+            if not urlMatch.group('marker').strip():
+                raise InvalidRequirement(requirementStr, 'Empty environment marker')
+            marker = _normalizeMarker(urlMatch.group('marker'), requirementStr)
+    else:
+        (specifierStr, sep, markerStr) = rest.partition(';')
+        if sep:
+            if not markerStr.strip():
+                raise InvalidRequirement(requirementStr, 'Empty environment marker')
+            marker = _normalizeMarker(markerStr, requirementStr)
+
+        specifierStr = specifierStr.strip()
+        if specifierStr.startswith('(') and specifierStr.endswith(')'):
+            specifierStr = specifierStr[1:-1]
+        if specifierStr.strip():
+            for specifier in specifierStr.split(','):
+                specifierMatch = SPECIFIER_RE.match(specifier)
+                if not specifierMatch:
+                    raise InvalidRequirement(requirementStr, 'Invalid version specifier "%s"' %(specifier.strip(),))
+                (op, version) = (specifierMatch.group('op'), specifierMatch.group('version'))
+                if op != '===':
+                    _validateSpecifierVersion(op, version, requirementStr)
+                    version = normalizeVersion(version)
+                specifiers.append( (op, version) )
+
+    return Requirement(name, extras, specifiers, url, marker, options)
+
+
+def _validateSpecifierVersion(op, version, requirementStr):
+    if version.endswith('.*'):
+        if op not in ('==', '!='):
+            raise InvalidRequirement(requirementStr, 'Wildcard version "%s" is only allowed with == and !=' %(version,))
+        version = version[:-2]
+    try:
+        (_, local) = parseVersion(version)
+    except ValueError:
+        raise InvalidRequirement(requirementStr, 'Invalid version "%s"' %(version,))
+    if local and op not in ('==', '!='):
+        raise InvalidRequirement(requirementStr, 'Local version "%s" is only allowed with == and !=' %(version,))
+    if op == '~=' and '.' not in version.split('+')[0]:
+        raise InvalidRequirement(requirementStr, '~= requires a version with at least two release segments, not "%s"' %(version,))
+
+
+def _splitRequirementsTxt(reqContents):
+    '''
+        _splitRequirementsTxt - Split a requirements.txt into logical lines, joining continuations and removing comments
+    '''
+    ret = []
+    current = ''
+    for line in reqContents.split('\n'):
+        if line.lstrip().startswith('#'):
+            line = ''
+        else:
+            # A comment must be preceded by whitespace, otherwise "#" is part of a url fragment
+            line = re.split(r'\s#', line, 1)[0].rstrip()
+        if line.endswith('\\'):
+            current += line[:-1] + ' '
+            continue
+        line = (current + line).strip()
+        current = ''
+        if line:
+            ret.append(line)
+    if current.strip():
+        ret.append(current.strip())
+    return ret
+
+
+def parseRequirementsTxt(reqContents):
+    '''
+        parseRequirementsTxt - Parse the contents of a requirements.txt
+
+        @param reqContents <str> - Contents of a requirements.txt
+
+        @return list<Requirement> - In the order given, not merged. @see mergeRequirements
+
+        @raises InvalidRequirement - If any line is malformed
+    '''
+    return [ parseRequirement(line) for line in _splitRequirementsTxt(reqContents) ]
+
+
+def _checkSatisfiable(requirement):
+    '''
+        _checkSatisfiable - Raise RequirementConflict if no version can satisfy all of a merged requirement's specifiers.
+
+            Only certain conflicts are reported: different exact pins, a pin outside the range or excluded, and an empty range.
+    '''
+    pins = []
+    arbitraryPins = set()
+    lowerBound = None
+    upperBound = None
+    exclusions = []
+    prefixes = []
+
+    def _conflict(reason):
+        raise RequirementConflict(requirement.canonicalName, [ op + version for (op, version) in requirement.specifiers ], reason)
+
+    for (op, version) in requirement.specifiers:
+        if op == '===':
+            arbitraryPins.add(version)
+            continue
+        releasePrefix = _getReleasePrefix(version)
+        if releasePrefix is not None:
+            prefixes.append( (op, releasePrefix, version) )
+            continue
+
+        (key, local) = parseVersion(version)
+        if op == '==':
+            pins.append( (key, local, version) )
+        elif op == '!=':
+            exclusions.append( (key, local, version) )
+        elif op in ('>=', '>', '~='):
+            inclusive = (op != '>')
+            if lowerBound is None or key > lowerBound[0] or (key == lowerBound[0] and not inclusive):
+                lowerBound = (key, inclusive, op + version)
+        elif op in ('<=', '<'):
+            inclusive = (op == '<=')
+            if upperBound is None or key < upperBound[0] or (key == upperBound[0] and not inclusive):
+                upperBound = (key, inclusive, op + version)
+
+    if len(arbitraryPins) > 1:
+        _conflict('Pinned to different versions: %s' %(', '.join(sorted([ '===' + x for x in arbitraryPins ])),))
+
+    for (key, local, version) in pins[1:]:
+        (firstKey, firstLocal, firstVersion) = pins[0]
+        # A pin without a local label matches any local label
+        if key != firstKey or (local and firstLocal and local != firstLocal):
+            _conflict('Pinned to different versions: ==%s, ==%s' %(firstVersion, version))
+
+    if lowerBound and upperBound:
+        if lowerBound[0] > upperBound[0] or (lowerBound[0] == upperBound[0] and not (lowerBound[1] and upperBound[1])):
+            _conflict('No version satisfies both %s and %s' %(lowerBound[2], upperBound[2]))
+
+    for (key, local, version) in pins:
+        # Local labels are ignored when comparing against ranges and exclusions without them
+        if lowerBound and (key < lowerBound[0] or (key == lowerBound[0] and not lowerBound[1])):
+            _conflict('==%s does not satisfy %s' %(version, lowerBound[2]))
+        if upperBound and (key > upperBound[0] or (key == upperBound[0] and not upperBound[1])):
+            _conflict('==%s does not satisfy %s' %(version, upperBound[2]))
+        for (excludedKey, excludedLocal, excludedVersion) in exclusions:
+            if key == excludedKey and (not excludedLocal or excludedLocal == local):
+                _conflict('==%s is excluded by !=%s' %(version, excludedVersion))
+        for (op, releasePrefix, prefixVersion) in prefixes:
+            if _matchesReleasePrefix(key, releasePrefix) != (op == '=='):
+                _conflict('==%s does not satisfy %s%s' %(version, op, prefixVersion))
+
+
+def _getSpecifierIdentity(specifier):
+    '''
+        _getSpecifierIdentity - Specifiers with the same identity are equivalent, e.x. "==1" and "==1.0"
+    '''
+    (op, version) = specifier
+    if op == '===' or version.endswith('.*'):
+        return specifier
+    return (op, parseVersion(version))
+
+
+def mergeRequirements(requirements):
+    '''
+        mergeRequirements - Merge requirements which refer to the same distribution (by canonical name, url-ness, and environment marker),
+          combining their extras, specifiers, and options, and check that each merged requirement can be satisfied.
+
+        @param requirements list<Requirement> - Parsed requirements
+
+        @return list<Requirement> - The merged requirements, in order of first appearance
+
+        @raises RequirementConflict - If two requirements are certainly unsatisfiable together
+    '''
+    merged = {}
+    ret = []
+    for requirement in requirements:
+        mergeKey = requirement.getMergeKey()
+        existing = merged.get(mergeKey)
+        if existing is None:
+            existing = merged[mergeKey] = Requirement(requirement.name, requirement.extras, requirement.specifiers, requirement.url,
+                requirement.marker, requirement.options, requirement.line)
+            ret.append(existing)
+            continue
+        if existing.isPassthrough:
+            continue
+
+        if requirement.url and requirement.url != existing.url:
+            raise RequirementConflict(existing.canonicalName, [ existing.url, requirement.url ], 'Required from different urls')
+
+        existing.extras = sorted(set(existing.extras + requirement.extras))
+        existingIdentities = [ _getSpecifierIdentity(specifier) for specifier in existing.specifiers ]
+        for specifier in requirement.specifiers:
+            if _getSpecifierIdentity(specifier) not in existingIdentities:
+                existing.specifiers.append(specifier)
+                existingIdentities.append(_getSpecifierIdentity(specifier))
+        for option in requirement.options:
+            if option not in existing.options:
+                existing.options.append(option)
+
+    for requirement in ret:
+        if not requirement.isPassthrough and len(requirement.specifiers) > 1:
+            _checkSatisfiable(requirement)
+    return ret
+
+
+def normalizeRequirementsTxt(reqContents):
+    '''
+        normalizeRequirementsTxt - Parse, validate, and merge the contents of a requirements.txt
+
+        @param reqContents <str> - Contents of a requirements.txt
+
+        @return <str> - The normalized requirements.txt, one requirement per line in order of first appearance. Empty if there are none.
+
+        @raises InvalidRequirement - If any line is malformed
+        @raises RequirementConflict - If requirements are certainly unsatisfiable together
+    '''
+    requirements = mergeRequirements(parseRequirementsTxt(reqContents))
+    return '\n'.join([ str(requirement) for requirement in requirements ])
+
+
+def getRequirementsKey(reqContents):
+    '''
+        getRequirementsKey - Generate a key which identifies a set of requirements.
+
+            Requirements which only differ in ordering, whitespace, comments, duplicates, or name spelling (case, "-", "_", ".") produce the same key.
+
+        @param reqContents <str> - Contents of a requirements.txt
+
+        @return <str> - A hex digest
+
+        @raises InvalidRequirement - If any line is malformed
+        @raises RequirementConflict - If requirements are certainly unsatisfiable together
+    '''
+    lines = sorted(set([ requirement.toString(canonicalVersions=True) for requirement in mergeRequirements(parseRequirementsTxt(reqContents)) ]))
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
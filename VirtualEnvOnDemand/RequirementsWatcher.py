@@ -0,0 +1,400 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    RequirementsWatcher - Follow a requirements file (or a version marker) from a long-running service, and install
+      into its env whenever it changes, without a restart.
+
+      Example:
+
+        venvInfo = setupAndActivateEnv(parentDirectory, name, open('requirements.txt').read())
+
+        def onInstalled(venvInfo, requirements, error):
+            if error is None:
+                ...  # e.x. reload plugins
+
+        watcher = watchRequirements(venvInfo, requirementsFile='requirements.txt', callback=onInstalled)
+
+      On Linux the directories of the watched files are watched with inotify, so an idle watcher is a thread blocked in select.
+        Elsewhere (or if inotify is unavailable), the files are polled with os.stat every "pollInterval" seconds.
+        The directory (rather than the file) is watched, so files replaced by a rename (editors, config management,
+        Kubernetes ConfigMaps) are followed as well.
+
+      A change is acted on only once the contents settle and actually differ. The install is incremental (packages already
+        satisfied are left alone), and runs on the watcher thread at the lowest CPU and I/O priority, and at background priority
+        on the build daemon. Newly installed modules can be imported afterwards; modules already imported are not reloaded.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+from .BuildDaemon import buildPriority, PRIORITY_BACKGROUND
+from .InstallPackages import installPackages
+from .Metrics import REQUIREMENTS_WATCH_INSTALLS
+from .ResourcePolicy import lowestPriority
+from .VirtualEnvInfo import VirtualEnvInfo, getInfoFromVirtualEnv
+
+try:
+    from types import StringTypes
+except ImportError:
+    StringTypes = (str,)
+
+__all__ = ('watchRequirements', 'RequirementsWatcher', 'DEFAULT_POLL_INTERVAL', 'DEFAULT_SETTLE_TIME')
+
+# DEFAULT_POLL_INTERVAL - Seconds between checks of the watched files, when inotify is not available
+DEFAULT_POLL_INTERVAL = 5.0
+
+# DEFAULT_SETTLE_TIME - Seconds without further changes before a change is acted on, so a file being written is not read half-way
+DEFAULT_SETTLE_TIME = 0.5
+
+# inotify constants, from <sys/inotify.h>
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_IGNORED = 0x8000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+
+# _EVENT_HEADER - struct inotify_event, excluding the trailing name: wd, mask, cookie, len
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _openInotify(directories):
+    '''
+        _openInotify - Create an inotify instance watching #directories (Linux only)
+
+        @return <int/None> - The inotify file descriptor, or None if inotify is unavailable
+    '''
+    if not sys.platform.startswith('linux'):
+        return None
+
+    import ctypes
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotifyInit = libc.inotify_init1
+        addWatch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    fd = inotifyInit(_IN_NONBLOCK | _IN_CLOEXEC)
+    if fd < 0:
+        return None
+
+    for directory in directories:
+        if not isinstance(directory, bytes):
+            directory = directory.encode(sys.getfilesystemencoding() or 'utf-8')
+        if addWatch(fd, ctypes.c_char_p(directory), _WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+    return fd
+
+
+def _readInotifyEvents(fd):
+    '''
+        _readInotifyEvents - Read every queued event from an inotify descriptor. Which file changed does not matter, only if any did.
+
+        @return <bool> - True if a watched directory went away (so its watch has ended)
+    '''
+    watchEnded = False
+    while True:
+        try:
+            data = os.read(fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return watchEnded
+            raise
+        if not data:
+            return watchEnded
+
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            (wd, mask, cookie, nameLength) = _EVENT_HEADER.unpack_from(data, offset)
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED):
+                watchEnded = True
+            offset += _EVENT_HEADER.size + nameLength
+
+
+def _readFile(path):
+    '''
+        _readFile - Read the contents of a watched file
+
+        @return <bytes/None> - The contents, or None if the file does not exist (or cannot be read) right now
+    '''
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _statFile(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class RequirementsWatcher(object):
+    '''
+        RequirementsWatcher - Installs into an env whenever a watched requirements file or version marker changes.
+
+            Use #watchRequirements to create and start one.
+
+            mode - "inotify" or "poll" once started, None before
+    '''
+
+    def __init__(self, venv, requirementsFile=None, versionFile=None, packages=None, callback=None, pollInterval=DEFAULT_POLL_INTERVAL,
+            settleTime=DEFAULT_SETTLE_TIME, useInotify=True, packageStore=None, lockFile=None, installer=None):
+        '''
+            @see #watchRequirements
+        '''
+        if isinstance(venv, StringTypes):
+            venv = getInfoFromVirtualEnv(venv, validate=False)
+        elif not isinstance(venv, VirtualEnvInfo):
+            raise TypeError('Unknown type passed to RequirementsWatcher: %s. Should be VirtualEnvInfo or a string.' %(venv.__class__.__name__,))
+
+        if not requirementsFile and not versionFile:
+            raise ValueError('At least one of requirementsFile or versionFile must be provided.')
+        if not requirementsFile and not packages:
+            raise ValueError('packages must be provided when only watching a versionFile.')
+
+        self.virtualenvInfo = venv
+        self.requirementsFile = requirementsFile and os.path.abspath(requirementsFile) or None
+        self.versionFile = versionFile and os.path.abspath(versionFile) or None
+        self.packages = packages
+        self.callback = callback
+        self.pollInterval = pollInterval
+        self.settleTime = settleTime
+        self.useInotify = useInotify
+        self.installArgs = { 'packageStore' : packageStore, 'lockFile' : lockFile, 'installer' : installer }
+
+        self.mode = None
+
+        self._paths = [ path for path in (self.requirementsFile, self.versionFile) if path ]
+        self._contents = None
+        self._thread = None
+        self._stopEvent = threading.Event()
+        self._wakeFds = None
+
+    def _getContents(self):
+        '''
+            _getContents - Read every watched file
+
+            @return list<bytes>/None - The contents of each, or None if any is missing (e.x. between the unlink and rename of a replace)
+        '''
+        contents = [ _readFile(path) for path in self._paths ]
+        if None in contents:
+            return None
+        return contents
+
+    def start(self):
+        '''
+            start - Start watching, from the current contents of the watched files. Those are taken to be installed already.
+        '''
+        if self._thread is not None:
+            raise ValueError('RequirementsWatcher has already been started.')
+
+        self._contents = self._getContents()
+
+        inotifyFd = None
+        if self.useInotify:
+            # Parent directories are not resolved, so a replaced symlink (e.x. Kubernetes' "..data") is seen
+            inotifyFd = _openInotify(sorted(set([ os.path.dirname(path) for path in self._paths ])))
+        if inotifyFd is not None:
+            self.mode = 'inotify'
+            self._wakeFds = os.pipe()
+        else:
+            self.mode = 'poll'
+
+        self._thread = threading.Thread(target=self._run, args=(inotifyFd, ), name='VirtualEnvOnDemand-requirements-watcher')
+        # Never keeps a process from exiting. An install still running at exit is abandoned.
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        '''
+            stop - Stop watching. An install which is running is completed first.
+
+            @param timeout <float/None> Default None - Maximum seconds to wait for the watcher thread to exit, or None to wait forever.
+
+            @return <bool> - True if the watcher thread has exited
+        '''
+        self._stopEvent.set()
+        if self._wakeFds is not None:
+            try:
+                os.write(self._wakeFds[1], b'x')
+            except OSError:
+                pass
+
+        if self._thread is None:
+            return True
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+
+        if self._wakeFds is not None:
+            for fd in self._wakeFds:
+                os.close(fd)
+            self._wakeFds = None
+        return True
+
+    @property
+    def isWatching(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stopEvent.is_set()
+
+    def _run(self, inotifyFd):
+        try:
+            if inotifyFd is not None:
+                if self._watchInotify(inotifyFd) and not self._stopEvent.is_set():
+                    # A watched directory was removed or renamed, follow the paths by polling from now on
+                    self.mode = 'poll'
+                    self._watchPoll()
+            else:
+                self._watchPoll()
+        finally:
+            if inotifyFd is not None:
+                os.close(inotifyFd)
+
+    def _waitReadable(self, fds, timeout=None):
+        while True:
+            try:
+                return select.select(fds, [], [], timeout)[0]
+            except (select.error, OSError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def _watchInotify(self, inotifyFd):
+        '''
+            _watchInotify - Wait on inotify events until stopped
+
+            @return <bool> - True if a watch ended, and inotify can no longer be relied on
+        '''
+        wakeFd = self._wakeFds[0]
+        while not self._stopEvent.is_set():
+            if wakeFd in self._waitReadable([inotifyFd, wakeFd]):
+                return False
+            watchEnded = _readInotifyEvents(inotifyFd)
+
+            # Wait for the writes to settle
+            while not self._stopEvent.is_set():
+                readable = self._waitReadable([inotifyFd, wakeFd], self.settleTime)
+                if not readable or wakeFd in readable:
+                    break
+                watchEnded = _readInotifyEvents(inotifyFd) or watchEnded
+
+            if self._stopEvent.is_set():
+                return False
+            self._checkForChange()
+            if watchEnded:
+                return True
+        return False
+
+    def _watchPoll(self):
+        stats = [ _statFile(path) for path in self._paths ]
+        while not self._stopEvent.wait(self.pollInterval):
+            newStats = [ _statFile(path) for path in self._paths ]
+            if newStats == stats:
+                continue
+            # Wait for the writes to settle
+            while not self._stopEvent.wait(self.settleTime):
+                (stats, newStats) = (newStats, [ _statFile(path) for path in self._paths ])
+                if newStats == stats:
+                    break
+            if self._stopEvent.is_set():
+                return
+            self._checkForChange()
+
+    def _checkForChange(self):
+        '''
+            _checkForChange - Install if the contents of the watched files differ from the last seen
+        '''
+        contents = self._getContents()
+        if contents is None or contents == self._contents:
+            return
+        self._contents = contents
+
+        if self.requirementsFile:
+            requirements = contents[0].decode('utf-8')
+        else:
+            requirements = self.packages
+        self._install(requirements)
+
+    def _install(self, requirements):
+        '''
+            _install - Install #requirements in the background, and notify the callback
+        '''
+        error = None
+        try:
+            # Nothing is blocked on this, so keep it out of the way of the service itself
+            with lowestPriority():
+                with buildPriority(PRIORITY_BACKGROUND):
+                    installPackages(requirements, self.virtualenvInfo, stdout=None, stderr=None, **self.installArgs)
+        except Exception as installError:
+            error = installError
+            REQUIREMENTS_WATCH_INSTALLS.inc(result='failure')
+        else:
+            REQUIREMENTS_WATCH_INSTALLS.inc(result='success')
+            try:
+                # So modules installed just now can be found by imports which already looked, and missed
+                import importlib
+                importlib.invalidate_caches()
+            except (ImportError, AttributeError):
+                pass
+
+        if self.callback is not None:
+            try:
+                self.callback(self.virtualenvInfo, requirements, error)
+            except Exception as callbackError:
+                sys.stderr.write('RequirementsWatcher callback raised %s: %s\n' %(callbackError.__class__.__name__, str(callbackError)))
+
+
+def watchRequirements(venv, requirementsFile=None, versionFile=None, packages=None, callback=None, pollInterval=DEFAULT_POLL_INTERVAL,
+        settleTime=DEFAULT_SETTLE_TIME, useInotify=True, packageStore=None, lockFile=None, installer=None):
+    '''
+        watchRequirements - Start installing into an env whenever a requirements file, or a version marker, changes.
+
+            The files as they are now are taken to be installed already (e.x. by setupAndActivateEnv at startup).
+
+            @param venv <str/VirtualEnvInfo> - The env to install into. A path to the root of a virtualenv, or a VirtualEnvInfo
+
+            @param requirementsFile <str/None> Default None - A requirements.txt to follow. Its contents are installed whenever they change.
+
+            @param versionFile <str/None> Default None - A version marker to follow. Whenever its contents change, the requirements
+                                                (#requirementsFile, or else #packages) are installed. At least one of the files must be given.
+
+            @param packages <str/list/dict/None> Default None - What to install when #versionFile changes, if there is no #requirementsFile.
+                                                Any form accepted by installPackages.
+
+            @param callback <function/None> Default None - Called on the watcher thread after every install, as
+                                                callback(virtualenvInfo, requirements, error). #error is None on success, otherwise the
+                                                exception raised by installPackages. A failed install is not retried until the files change again.
+
+            @param pollInterval <float> Default DEFAULT_POLL_INTERVAL - Seconds between checks when inotify is unavailable
+
+            @param settleTime <float> Default DEFAULT_SETTLE_TIME - Seconds without further changes before a change is acted on
+
+            @param useInotify <bool> Default True - If False, always poll
+
+            @param packageStore / lockFile / installer - Passed to installPackages. @see VirtualEnvOnDemand.InstallPackages.installPackages
+
+            @return <RequirementsWatcher> - The started watcher. Use its "stop" method to stop watching.
+
+            @raises ValueError - If neither file is given, or only #versionFile is given without #packages
+    '''
+    watcher = RequirementsWatcher(venv, requirementsFile, versionFile, packages, callback, pollInterval, settleTime, useInotify,
+        packageStore, lockFile, installer)
+    return watcher.start()
@@ -0,0 +1,421 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    ResourcePolicy - Host-wide resource governance for env builds and installs, so bursts of builds (e.x. many workers hitting
+      a missing env at once) do not starve latency-sensitive processes on the same host.
+
+      Every subprocess started to build or install (virtualenv, venv, pip) can be run at a lower CPU priority (niceness) and
+        I/O scheduling class, applied before it executes by running it under "nice" and "ionice", and the number of builds/installs
+        running at once across every process of a user on the host can be capped. The cap is a counting semaphore made of lock files, so slots held by a process which dies are released by the OS.
+
+      Example:
+
+        from VirtualEnvOnDemand.ResourcePolicy import setResourcePolicy, IO_PRIORITY_IDLE
+
+        setResourcePolicy(niceness=10, ioPriorityClass=IO_PRIORITY_IDLE, maxConcurrentBuilds=2)
+
+      Work nothing is waiting on yet (e.x. a speculative build) can be run at the lowest priority, whatever the policy,
+        within "with lowestPriority():" on the thread doing it.
+
+      Time spent waiting for a slot is recorded in the "virtualenvondemand_build_slot_wait_seconds" metric. @see VirtualEnvOnDemand.Metrics
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from .Metrics import BUILD_SLOT_WAIT_SECONDS, BUILD_SLOT_TIMEOUTS
+from .exceptions import BuildSlotTimedOut
+from .utils import ensureDirectory
+
+__all__ = ('setResourcePolicy', 'getResourcePolicy', 'HostSemaphore', 'acquireBuildSlot', 'setProcessPriority', 'getPriorityCommand', 'getPriorityCreationFlags',
+    'isPriorityLowered', 'lowestPriority',
+    'IO_PRIORITY_REALTIME', 'IO_PRIORITY_BEST_EFFORT', 'IO_PRIORITY_IDLE', 'DEFAULT_SLOTS_DIRECTORY',
+)
+
+# I/O scheduling classes (Linux ioprio_set), @see setResourcePolicy "ioPriorityClass"
+IO_PRIORITY_REALTIME = 1
+IO_PRIORITY_BEST_EFFORT = 2
+IO_PRIORITY_IDLE = 3
+
+# DEFAULT_SLOTS_DIRECTORY - Where the lock files of the build slots live, unless "slotsDirectory" is given.
+#   One per user, as another user's lock files could not be opened (and they could hold every slot).
+DEFAULT_SLOTS_DIRECTORY = os.sep.join([tempfile.gettempdir(), 'VirtualEnvOnDemand_build_slots_%d' %(os.getuid() if hasattr(os, 'getuid') else 0,)])
+
+# _IOPRIO_SET_SYSCALLS - Number of the ioprio_set syscall, by machine
+_IOPRIO_SET_SYSCALLS = { 'x86_64' : 251, 'amd64' : 251, 'i386' : 289, 'i686' : 289, 'aarch64' : 30, 'arm64' : 30, 'riscv64' : 30,
+    'ppc64le' : 273, 'ppc64' : 273, 's390x' : 282 }
+
+# _executablePaths - Cache of the paths of "nice" and "ionice" (None if not found), @see _findExecutable
+_executablePaths = {}
+
+# The policy applied to builds and installs. @see setResourcePolicy
+global _resourcePolicy
+_resourcePolicy = { 'niceness' : None, 'ioPriorityClass' : None, 'ioPriorityLevel' : None, 'maxConcurrentBuilds' : None,
+    'slotsDirectory' : None, 'slotTimeout' : None }
+
+# _priorityLocal.priority - Per-thread override of the niceness and I/O priority of the policy, @see lowestPriority
+_priorityLocal = threading.local()
+
+# _LOWEST_PRIORITY - The override applied by lowestPriority
+_LOWEST_PRIORITY = { 'niceness' : 19, 'ioPriorityClass' : IO_PRIORITY_IDLE, 'ioPriorityLevel' : None }
+
+# _slotLocal - Per-thread held build slot, so nested acquires (createEnv -> installPackages) do not take a second slot
+_slotLocal = threading.local()
+
+
+def setResourcePolicy(niceness=None, ioPriorityClass=None, ioPriorityLevel=None, maxConcurrentBuilds=None, slotsDirectory=None, slotTimeout=None):
+    '''
+        setResourcePolicy - Set the resource governance of env builds and installs (createEnv, installPackages, and everything which calls them)
+
+            @param niceness <int/None> Default None - Increment to the CPU niceness of build subprocesses (e.x. 10). On Windows, any positive
+                                                       value runs them "below normal", and 15 or more runs them "idle". None leaves it alone.
+            @param ioPriorityClass <int/None> Default None - I/O scheduling class of build subprocesses on Linux, IO_PRIORITY_BEST_EFFORT or IO_PRIORITY_IDLE.
+                                                       None leaves it alone. Ignored on other platforms. IO_PRIORITY_REALTIME is not supported.
+            @param ioPriorityLevel <int/None> Default None - Level (0 highest - 7 lowest) within IO_PRIORITY_BEST_EFFORT. Default 7 for best-effort.
+            @param maxConcurrentBuilds <int/None> Default None - Maximum number of builds/installs running at once, across every process on this host
+                                                       which uses the same #slotsDirectory. None is no limit.
+            @param slotsDirectory <str/None> Default None - Directory holding the slot lock files. Default is DEFAULT_SLOTS_DIRECTORY, one per user.
+                                                       To share the cap between users, give a directory (and lock files) writable by all of them.
+            @param slotTimeout <float/None> Default None - Maximum seconds to wait for a slot before raising BuildSlotTimedOut. None waits forever.
+
+            @return <dict> - The previous policy
+    '''
+    global _resourcePolicy
+
+    if maxConcurrentBuilds is not None and maxConcurrentBuilds < 1:
+        raise ValueError('maxConcurrentBuilds must be >= 1, or None for no limit')
+    if ioPriorityClass == IO_PRIORITY_REALTIME:
+        raise ValueError('IO_PRIORITY_REALTIME is not supported, use IO_PRIORITY_BEST_EFFORT or IO_PRIORITY_IDLE')
+    if ioPriorityClass not in (None, IO_PRIORITY_BEST_EFFORT, IO_PRIORITY_IDLE):
+        raise ValueError('Unknown ioPriorityClass: %s' %(str(ioPriorityClass),))
+    if ioPriorityLevel is not None and not (0 <= ioPriorityLevel <= 7):
+        raise ValueError('ioPriorityLevel must be between 0 and 7')
+
+    oldPolicy = _resourcePolicy
+    _resourcePolicy = { 'niceness' : niceness, 'ioPriorityClass' : ioPriorityClass, 'ioPriorityLevel' : ioPriorityLevel,
+        'maxConcurrentBuilds' : maxConcurrentBuilds, 'slotsDirectory' : slotsDirectory, 'slotTimeout' : slotTimeout }
+    return oldPolicy
+
+
+def getResourcePolicy():
+    '''
+        getResourcePolicy - Get the resource governance of env builds and installs. @see setResourcePolicy
+
+            @return <dict> - Copy of the policy
+    '''
+    return dict(_resourcePolicy)
+
+
+class lowestPriority(object):
+    '''
+        lowestPriority - Context manager which runs the build subprocesses started by this thread at the lowest CPU priority (niceness 19)
+          and I/O class (idle), whatever the policy. For speculative builds which nothing is waiting on yet.
+    '''
+
+    def __enter__(self):
+        self._saved = getattr(_priorityLocal, 'priority', None)
+        _priorityLocal.priority = _LOWEST_PRIORITY
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        _priorityLocal.priority = self._saved
+
+
+def _getPriority():
+    '''
+        _getPriority - Get the priority settings applying to subprocesses started by this thread
+
+        @return <dict> - Has "niceness", "ioPriorityClass", and "ioPriorityLevel"
+    '''
+    return getattr(_priorityLocal, 'priority', None) or _resourcePolicy
+
+
+def isPriorityLowered():
+    '''
+        isPriorityLowered - Check if build subprocesses started by this thread run at a lowered priority (by the policy, or lowestPriority)
+
+            Work which would otherwise be done in-process (e.x. creating a virtualenv) should be run in a subprocess when this is True,
+              so that it is governed as well.
+
+        @return <bool>
+    '''
+    priority = _getPriority()
+    return bool(priority['niceness'] or priority['ioPriorityClass'])
+
+
+def _findExecutable(name):
+    '''
+        _findExecutable - Find an executable on the PATH
+
+        @return <str/None> - Its path, or None if not found
+    '''
+    if name not in _executablePaths:
+        foundPath = None
+        for directory in os.environ.get('PATH', os.defpath).split(os.pathsep):
+            candidate = os.sep.join([directory, name])
+            if directory and os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                foundPath = candidate
+                break
+        _executablePaths[name] = foundPath
+    return _executablePaths[name]
+
+
+def _setIOPriority(pid, ioPriorityClass, ioPriorityLevel):
+    '''
+        _setIOPriority - Set the I/O scheduling class of a process, via the ioprio_set syscall (Linux only)
+
+        @return <bool> - True if set
+    '''
+    syscallNumber = _IOPRIO_SET_SYSCALLS.get(platform.machine().lower())
+    if not syscallNumber or not os.path.exists('/proc/self'):
+        return False
+
+    import ctypes
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return False
+
+    if ioPriorityLevel is None:
+        ioPriorityLevel = 7 if ioPriorityClass == IO_PRIORITY_BEST_EFFORT else 0
+    IOPRIO_WHO_PROCESS = 1
+    IOPRIO_CLASS_SHIFT = 13
+    return libc.syscall(syscallNumber, IOPRIO_WHO_PROCESS, pid, (ioPriorityClass << IOPRIO_CLASS_SHIFT) | ioPriorityLevel) == 0
+
+
+def getPriorityCommand(cmd):
+    '''
+        getPriorityCommand - Wrap a build subprocess command with "nice" and "ionice" (POSIX), so the priority of the policy is applied
+          before it executes, and is inherited by everything it starts (e.x. pip's build subprocesses).
+
+        @param cmd list<str> - The command and its arguments
+
+        @return tuple<list<str>, dict> - ( The command to run ; the priority which could not be applied by wrapping (e.x. "ionice" is not installed),
+                                            to pass to setProcessPriority once started )
+    '''
+    priority = _getPriority()
+    remaining = { 'niceness' : priority['niceness'], 'ioPriorityClass' : priority['ioPriorityClass'], 'ioPriorityLevel' : priority['ioPriorityLevel'] }
+    if os.name == 'nt':
+        # Niceness is applied by getPriorityCreationFlags, and there is no I/O priority
+        remaining['niceness'] = remaining['ioPriorityClass'] = None
+        return (list(cmd), remaining)
+
+    prefix = []
+    if remaining['niceness']:
+        nicePath = _findExecutable('nice')
+        if nicePath:
+            prefix += [nicePath, '-n', str(remaining['niceness'])]
+            remaining['niceness'] = None
+
+    if remaining['ioPriorityClass']:
+        ionicePath = _findExecutable('ionice')
+        if ionicePath:
+            prefix += [ionicePath, '-c', str(remaining['ioPriorityClass'])]
+            if remaining['ioPriorityClass'] == IO_PRIORITY_BEST_EFFORT:
+                prefix += ['-n', str(7 if remaining['ioPriorityLevel'] is None else remaining['ioPriorityLevel'])]
+            remaining['ioPriorityClass'] = None
+
+    return (prefix + list(cmd), remaining)
+
+
+def getPriorityCreationFlags():
+    '''
+        getPriorityCreationFlags - Get the Popen creationflags (Windows) which apply the niceness of the policy
+
+        @return <int>
+    '''
+    niceness = _getPriority()['niceness']
+    if not niceness or niceness <= 0:
+        return 0
+    # IDLE_PRIORITY_CLASS / BELOW_NORMAL_PRIORITY_CLASS
+    return 0x00000040 if niceness >= 15 else 0x00004000
+
+
+def setProcessPriority(pid, priority=None):
+    '''
+        setProcessPriority - Apply the priority of the policy to a started build subprocess, when it could not be applied before it executed.
+          Children it has already started keep the default priority, so prefer getPriorityCommand.
+
+        @param pid <int> - The process id
+        @param priority <dict/None> Default None - The priority to apply, as returned by getPriorityCommand. Default is the whole policy.
+    '''
+    if priority is None:
+        priority = _getPriority()
+    if os.name == 'nt':
+        return
+
+    niceness = priority['niceness']
+    if niceness and hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, min(19, os.getpriority(os.PRIO_PROCESS, pid) + niceness))
+        except OSError:
+            pass
+
+    ioPriorityClass = priority['ioPriorityClass']
+    if ioPriorityClass:
+        try:
+            _setIOPriority(pid, ioPriorityClass, priority['ioPriorityLevel'])
+        except Exception:
+            pass
+
+
+class HostSemaphore(object):
+    '''
+        HostSemaphore - A counting semaphore shared by every process on a host, made of one lock file per slot.
+
+            A slot is held by holding an exclusive lock on its file. Locks are released by the OS if the holder dies, so a crashed
+              build never leaks a slot. Waiters poll with backoff.
+    '''
+
+    def __init__(self, directory, slots):
+        '''
+            @param directory <str> - Directory holding the lock files. Created if missing.
+            @param slots <int> - Number of slots
+        '''
+        self.directory = directory
+        self.slots = slots
+
+    def _tryLock(self, slotNumber):
+        '''
+            _tryLock - Try to take a slot without blocking
+
+            @return <file/None> - The open, locked file, or None if the slot is held
+
+            @raises ValueError - If the lock file cannot be opened (e.x. it is owned by another user)
+        '''
+        lockPath = os.sep.join([self.directory, 'slot-%d.lock' %(slotNumber,)])
+        try:
+            lockFile = open(lockPath, 'a+')
+        except (IOError, OSError) as e:
+            raise ValueError('Cannot open build slot lock file "%s": %s. Use a slotsDirectory writable by this user.' %(lockPath, str(e)))
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lockFile.seek(0)
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_NBLCK, 1)
+        except (IOError, OSError):
+            lockFile.close()
+            return None
+        return lockFile
+
+    def acquire(self, timeout=None):
+        '''
+            acquire - Take a slot, waiting until one is free
+
+            @param timeout <float/None> Default None - Maximum seconds to wait, or None to wait forever
+
+            @return tuple<file, float> - ( the held lock, pass to release ; seconds spent waiting )
+
+            @raises -
+                BuildSlotTimedOut - If no slot became free within #timeout
+                ValueError - If a slot's lock file cannot be opened
+        '''
+        ensureDirectory(self.directory)
+
+        startTime = time.time()
+        sleepTime = 0.02
+        while True:
+            # Start at a random slot, so waiters do not all contend for slot 0
+            firstSlot = random.randint(0, self.slots - 1)
+            for i in range(self.slots):
+                lockFile = self._tryLock( (firstSlot + i) % self.slots )
+                if lockFile is not None:
+                    return (lockFile, time.time() - startTime)
+
+            waited = time.time() - startTime
+            if timeout is not None and waited >= timeout:
+                raise BuildSlotTimedOut(self.slots, self.directory, waited)
+            time.sleep(sleepTime if timeout is None else max(0, min(sleepTime, timeout - waited)))
+            sleepTime = min(sleepTime * 2, 0.5)
+
+    @staticmethod
+    def release(lockFile):
+        '''
+            release - Give back a slot taken by acquire
+
+            @param lockFile <file> - The lock returned by acquire
+        '''
+        try:
+            if fcntl is not None:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+            else:
+                lockFile.seek(0)
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+        except (IOError, OSError):
+            pass
+        lockFile.close()
+
+
+class _BuildSlot(object):
+    '''
+        _BuildSlot - A held build slot (or a no-op, when there is no limit). Use as a context manager, or call release.
+
+            waitTime - Seconds spent waiting for the slot
+    '''
+
+    def __init__(self, lockFile=None, waitTime=0.0, isNested=False):
+        self._lockFile = lockFile
+        self._isNested = isNested
+        self.waitTime = waitTime
+
+    def release(self):
+        if self._isNested:
+            _slotLocal.depth -= 1
+            self._isNested = False
+        elif self._lockFile is not None:
+            _slotLocal.depth = 0
+            HostSemaphore.release(self._lockFile)
+            self._lockFile = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.release()
+
+
+def acquireBuildSlot():
+    '''
+        acquireBuildSlot - Take one of the host's build slots, per the policy (@see setResourcePolicy "maxConcurrentBuilds").
+
+            If this thread already holds a slot (e.x. installPackages called from createEnv), no second slot is taken.
+            If there is no limit, this returns immediately.
+
+        @return <_BuildSlot> - Release it (or use as a context manager) when the build is done
+
+        @raises -
+            BuildSlotTimedOut - If no slot became free within the policy's "slotTimeout"
+            ValueError - If a slot's lock file cannot be opened
+    '''
+    maxConcurrentBuilds = _resourcePolicy['maxConcurrentBuilds']
+    if not maxConcurrentBuilds:
+        return _BuildSlot()
+
+    if getattr(_slotLocal, 'depth', 0) > 0:
+        _slotLocal.depth += 1
+        return _BuildSlot(isNested=True)
+
+    semaphore = HostSemaphore(_resourcePolicy['slotsDirectory'] or DEFAULT_SLOTS_DIRECTORY, maxConcurrentBuilds)
+    try:
+        (lockFile, waitTime) = semaphore.acquire(_resourcePolicy['slotTimeout'])
+    except BuildSlotTimedOut as e:
+        BUILD_SLOT_TIMEOUTS.inc()
+        BUILD_SLOT_WAIT_SECONDS.observe(e.waited)
+        raise
+
+    BUILD_SLOT_WAIT_SECONDS.observe(waitTime)
+    _slotLocal.depth = 1
+    return _BuildSlot(lockFile, waitTime)
@@ -0,0 +1,143 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    RunPip - Low-level methods for invoking pip against a virtualenv
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import sys
+import tempfile
+import time
+
+from .VirtualEnvInfo import VirtualEnvInfo
+from .ProcessUtils import runProcess, runProcessGetOutput
+from .Wheels import findDistInfoDirectory
+from .Metrics import PIP_RUNS, PIP_RUN_SECONDS
+from .exceptions import SubprocessTimedOut
+
+__all__ = ('getPipCommand', 'getPipVersion', 'getHostPipVersion', 'writeRequirementsFile', 'runPip', 'runPipGetOutput', 'HOST_PIP_MIN_VERSION')
+
+# HOST_PIP_MIN_VERSION - The host's pip must support "--python" (added in pip 22.3) to install into virtualenvs created without pip
+HOST_PIP_MIN_VERSION = '22.3'
+
+
+def getPipCommand(venvDir):
+    '''
+        getPipCommand - Get the command (as a list) used to invoke pip for a given virtualenv.
+
+            This is the virtualenv's own pip, or for a virtualenv created without pip, the host's pip targeting the virtualenv's python.
+
+        @param venvDir <str> - The root directory of the virtualenv
+
+        @return list<str> - The command, to which pip arguments (like "install") should be appended
+    '''
+    if VirtualEnvInfo.isPipless(venvDir):
+        return [ sys.executable, '-m', 'pip', '--python', VirtualEnvInfo.getPythonBin(venvDir) ]
+    return [ VirtualEnvInfo.getPipBin(venvDir) ]
+
+
+def getHostPipVersion():
+    '''
+        getHostPipVersion - Get the version of pip available to the running interpreter
+
+        @return <str/None> - The version string, or None if pip is not available
+    '''
+    try:
+        import pip
+    except ImportError:
+        return None
+    return getattr(pip, '__version__', None)
+
+
+def getPipVersion(venvDir):
+    '''
+        getPipVersion - Get the version of pip installed within a virtualenv, without running it.
+
+            For a virtualenv created without pip, this is the version of the host's pip.
+
+        @param venvDir <str> - The root directory of the virtualenv
+
+        @return <str/None> - The version string, or None if it could not be determined
+    '''
+    if VirtualEnvInfo.isPipless(venvDir):
+        return getHostPipVersion()
+
+    distInfoName = findDistInfoDirectory(VirtualEnvInfo.getSitePackagesDirectory(venvDir), 'pip')
+    if not distInfoName:
+        return None
+    return distInfoName[:-len('.dist-info')].rsplit('-', 1)[-1]
+
+
+def writeRequirementsFile(reqContents, directory):
+    '''
+        writeRequirementsFile - Write a requirements.txt into a temporary file for pip to ingest.
+
+            Note -- windows will NOT allow pip to read an open file handle held by another process.
+              so we have to create, close, and the caller must manually remove later.
+
+        @param reqContents <str> - Contents of the requirements.txt
+        @param directory <str> - Directory in which to create the file
+
+        @return <str> - The filename. Caller is responsible for removing it.
+    '''
+    reqFile = tempfile.NamedTemporaryFile(prefix='venv_req_', suffix='txt', mode='wt', dir=directory, delete=False)
+    reqFilename = reqFile.name
+    reqFile.write(reqContents)
+    if reqContents and reqContents[-1] != '\n':
+        reqFile.write('\n')
+    reqFile.flush()
+    reqFile.close()
+
+    return reqFilename
+
+
+def runPip(venvDir, pipArgs, stdout=sys.stdout, stderr=sys.stderr, timeout=None):
+    '''
+        runPip - Run pip for a virtualenv, and wait for it to complete.
+
+        @param venvDir <str> - The root directory of the virtualenv
+        @param pipArgs list<str> - Arguments to pip, e.x. ['install', '-r', 'requirements.txt']
+        @param stdout <iostream/None> - Stream to be used as stdout. Use "None" to swallow output.
+        @param stderr <iostream/None> - Stream to be used as stderr. Use "None" to swallow output.
+        @param timeout <float/None> Default None - If provided, pip (and everything it started) is killed after this many seconds
+
+        @return <int> - The return code of pip
+
+        @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If #timeout was exceeded
+    '''
+    return _measurePipRun(pipArgs, runProcess, getPipCommand(venvDir) + list(pipArgs), stdout, stderr, timeout)
+
+
+def runPipGetOutput(venvDir, pipArgs, stderr=None, timeout=None):
+    '''
+        runPipGetOutput - Run pip for a virtualenv, and collect its stdout.
+
+        @param venvDir <str> - The root directory of the virtualenv
+        @param pipArgs list<str> - Arguments to pip, e.x. ['freeze']
+        @param stderr <iostream/None> - Stream to be used as stderr. Default None swallows output.
+        @param timeout <float/None> Default None - If provided, pip is killed after this many seconds
+
+        @return tuple<int, str> - ( return code, stdout contents )
+
+        @raises VirtualEnvOnDemand.exceptions.SubprocessTimedOut - If #timeout was exceeded
+    '''
+    return _measurePipRun(pipArgs, runProcessGetOutput, getPipCommand(venvDir) + list(pipArgs), stderr, timeout)
+
+
+def _measurePipRun(pipArgs, runFunc, *args):
+    '''
+        _measurePipRun - Call #runFunc, and record the pip run (command, exit code, duration) in the metrics registry
+    '''
+    pipCommand = pipArgs and pipArgs[0] or 'none'
+    startTime = time.time()
+    exitCode = 'error'
+    try:
+        ret = runFunc(*args)
+        exitCode = str(ret[0] if isinstance(ret, tuple) else ret)
+        return ret
+    except SubprocessTimedOut:
+        exitCode = 'timeout'
+        raise
+    finally:
+        PIP_RUNS.inc(command=pipCommand, exit_code=exitCode)
+        PIP_RUN_SECONDS.observe(time.time() - startTime, command=pipCommand)
@@ -0,0 +1,354 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Slim - Shrink a virtualenv by removing classes of installed files which are not needed at runtime
+      (test suites, documentation, bytecode for other interpreters, etc).
+
+      Files are found through each distribution's RECORD, and the RECORD is rewritten to match,
+        so pip can still upgrade and uninstall slimmed distributions.
+
+      Modules the application is recorded as importing are never removed. @see recordImports
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import csv
+import os
+import sys
+
+from .VirtualEnvInfo import VirtualEnvInfo
+
+__all__ = ('slimEnv', 'SlimReport', 'recordImports', 'getRecordedImports',
+    'SLIM_TESTS', 'SLIM_DOCS', 'SLIM_FOREIGN_BYTECODE', 'SLIM_TYPE_STUBS', 'SLIM_SOURCES', 'SLIM_DEFAULT_CLASSES', 'SLIM_ALL_CLASSES',
+)
+
+# Classes of files which may be removed
+
+# SLIM_TESTS - Anything within "test" or "tests" directories, and conftest.py
+SLIM_TESTS = 'tests'
+# SLIM_DOCS - Anything within "doc", "docs", "example", or "examples" directories, markdown and reStructuredText, READMEs and changelogs
+SLIM_DOCS = 'docs'
+# SLIM_FOREIGN_BYTECODE - Bytecode in __pycache__ compiled by a different python than the virtualenv's
+SLIM_FOREIGN_BYTECODE = 'foreignBytecode'
+# SLIM_TYPE_STUBS - Type stubs (.pyi) and py.typed markers, only used by type checkers
+SLIM_TYPE_STUBS = 'typeStubs'
+# SLIM_SOURCES - C/C++/Cython sources and headers shipped alongside compiled extensions
+SLIM_SOURCES = 'sources'
+
+SLIM_DEFAULT_CLASSES = (SLIM_TESTS, SLIM_DOCS, SLIM_FOREIGN_BYTECODE)
+SLIM_ALL_CLASSES = (SLIM_TESTS, SLIM_DOCS, SLIM_FOREIGN_BYTECODE, SLIM_TYPE_STUBS, SLIM_SOURCES)
+
+# RECORDED_IMPORTS_FILENAME - Within the root of a virtualenv, one module name per line which the application imports
+RECORDED_IMPORTS_FILENAME = '.VirtualEnvOnDemand_Imports'
+
+_TEST_DIRECTORIES = ('test', 'tests')
+_DOC_DIRECTORIES = ('doc', 'docs', 'example', 'examples')
+_DOC_EXTENSIONS = ('.md', '.rst')
+_DOC_PREFIXES = ('README', 'CHANGELOG', 'CHANGES', 'HISTORY')
+_SOURCE_EXTENSIONS = ('.c', '.h', '.cc', '.cpp', '.hpp', '.pyx', '.pxd', '.pxi')
+
+
+class SlimReport(object):
+    '''
+        SlimReport - The result of slimEnv
+    '''
+
+    __slots__ = ('filesRemoved', 'bytesSaved', 'bytesByClass', 'dryRun')
+
+    def __init__(self, dryRun=False):
+        self.filesRemoved = 0
+        self.bytesSaved = 0
+        # bytesByClass - Map of slim class -> bytes removed
+        self.bytesByClass = {}
+        self.dryRun = dryRun
+
+    def _add(self, slimClass, size):
+        self.filesRemoved += 1
+        self.bytesSaved += size
+        self.bytesByClass[slimClass] = self.bytesByClass.get(slimClass, 0) + size
+
+    def __repr__(self):
+        return 'SlimReport(filesRemoved=%d, bytesSaved=%d, bytesByClass=%r, dryRun=%s)' %(self.filesRemoved, self.bytesSaved, self.bytesByClass, str(self.dryRun))
+
+
+def getRecordedImports(venvDir):
+    '''
+        getRecordedImports - Get the modules recorded as imported by the application, @see recordImports
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+
+        @return set<str> - Module names
+    '''
+    if isinstance(venvDir, VirtualEnvInfo):
+        venvDir = venvDir.virtualenvDirectory
+
+    try:
+        with open(os.sep.join([venvDir, RECORDED_IMPORTS_FILENAME]), 'rt') as f:
+            return set( [ line.strip() for line in f if line.strip() and not line.startswith('#') ] )
+    except (IOError, OSError):
+        return set()
+
+
+def recordImports(venvDir, moduleNames=None):
+    '''
+        recordImports - Record modules which the application imports from a virtualenv, so slimEnv never removes them.
+
+            The names are merged with any already recorded.
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+        @param moduleNames list<str>/None - Module names. Default None records everything currently in sys.modules
+                                            which was loaded from within the virtualenv.
+
+        @return set<str> - All recorded module names
+    '''
+    if isinstance(venvDir, VirtualEnvInfo):
+        venvDir = venvDir.virtualenvDirectory
+
+    if moduleNames is None:
+        venvPrefix = os.path.realpath(venvDir) + os.sep
+        moduleNames = []
+        for (moduleName, module) in list(sys.modules.items()):
+            moduleFile = getattr(module, '__file__', None)
+            if moduleFile and os.path.realpath(moduleFile).startswith(venvPrefix):
+                moduleNames.append(moduleName)
+
+    recorded = getRecordedImports(venvDir)
+    recorded.update(moduleNames)
+
+    recordPath = os.sep.join([venvDir, RECORDED_IMPORTS_FILENAME])
+    tmpPath = '%s.tmp%d' %(recordPath, os.getpid())
+    with open(tmpPath, 'wt') as f:
+        f.write('\n'.join(sorted(recorded)) + '\n')
+    os.rename(tmpPath, recordPath)
+
+    return recorded
+
+
+def _getCacheTag(venvDir):
+    '''
+        _getCacheTag - Get the bytecode cache tag (e.x. "cpython-311") of a virtualenv's python
+    '''
+    pythonVersion = VirtualEnvInfo.getPythonVersion(venvDir)
+    implementation = getattr(sys, 'implementation', None)
+    hostVersion = '%d.%d' %(sys.version_info[0], sys.version_info[1])
+    if implementation is not None and implementation.cache_tag and (not pythonVersion or pythonVersion == hostVersion):
+        return implementation.cache_tag
+    return 'cpython-' + (pythonVersion or hostVersion).replace('.', '')
+
+
+def _getModuleName(relPath):
+    '''
+        _getModuleName - Get the dotted module name of a file within site-packages
+
+        @param relPath <str> - "/"-separated path relative to site-packages
+
+        @return <str/None> - The module name, or None if not a module
+    '''
+    parts = relPath.split('/')
+    (dirs, filename) = (parts[:-1], parts[-1])
+    if dirs and dirs[-1] == '__pycache__':
+        dirs = dirs[:-1]
+
+    if not filename.endswith(('.py', '.pyc', '.so', '.pyd')):
+        return None
+
+    baseName = filename.split('.', 1)[0]
+    if baseName == '__init__':
+        return '.'.join(dirs) or None
+    return '.'.join(dirs + [baseName])
+
+
+def _classifyFile(relPath, cacheTag, slimClasses):
+    '''
+        _classifyFile - Determine which slim class (if any) a file within site-packages falls under
+
+        @return <str/None> - The slim class, or None if the file should be kept
+    '''
+    parts = relPath.split('/')
+    (dirs, filename) = (parts[:-1], parts[-1])
+
+    # Never touch metadata, or anything outside of a package directory
+    if not dirs or dirs[0].endswith(('.dist-info', '.egg-info', '.data')):
+        return None
+
+    if SLIM_TESTS in slimClasses and ([ d for d in dirs if d in _TEST_DIRECTORIES ] or filename == 'conftest.py'):
+        return SLIM_TESTS
+
+    if SLIM_DOCS in slimClasses:
+        if [ d for d in dirs if d in _DOC_DIRECTORIES ] or filename.endswith(_DOC_EXTENSIONS):
+            return SLIM_DOCS
+        if filename.upper().startswith(_DOC_PREFIXES) and not filename.endswith(('.py', '.pyc', '.so', '.pyd')):
+            return SLIM_DOCS
+
+    if SLIM_FOREIGN_BYTECODE in slimClasses and dirs[-1] == '__pycache__' and filename.endswith('.pyc') and ('.%s.' %(cacheTag,)) not in filename:
+        return SLIM_FOREIGN_BYTECODE
+
+    if SLIM_TYPE_STUBS in slimClasses and (filename.endswith('.pyi') or filename == 'py.typed'):
+        return SLIM_TYPE_STUBS
+
+    if SLIM_SOURCES in slimClasses and filename.endswith(_SOURCE_EXTENSIONS):
+        return SLIM_SOURCES
+
+    return None
+
+
+def slimEnv(venvDir, slimClasses=SLIM_DEFAULT_CLASSES, keepModules=None, dryRun=False):
+    '''
+        slimEnv - Remove classes of files not needed at runtime from every distribution installed in a virtualenv.
+
+            Only files listed in a distribution's RECORD (and bytecode compiled from them) are considered, and each RECORD is
+              rewritten without the removed files so that pip can still upgrade and uninstall.
+
+            Modules in #keepModules, or recorded with recordImports, are never removed (nor are the packages containing them).
+              Other files in the same directory as such a module (e.x. a test-helper module within "tests") are kept as well,
+              as it may load data from alongside itself.
+
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv
+        @param slimClasses list<str> Default SLIM_DEFAULT_CLASSES - Which classes of files to remove, @see SLIM_ALL_CLASSES
+        @param keepModules list<str>/None - Module names which must not be removed, in addition to those recorded in the virtualenv
+        @param dryRun <bool> Default False - If True, nothing is removed, but the report shows what would be
+
+        @return <SlimReport> - What was (or would be) removed
+
+        @raises ValueError - If an unknown slim class is given
+    '''
+    if isinstance(venvDir, VirtualEnvInfo):
+        venvDir = venvDir.virtualenvDirectory
+
+    slimClasses = tuple(slimClasses)
+    unknownClasses = [ x for x in slimClasses if x not in SLIM_ALL_CLASSES ]
+    if unknownClasses:
+        raise ValueError('Unknown slim class(es): %s. Choices are: %s' %(', '.join(unknownClasses), ', '.join(SLIM_ALL_CLASSES)))
+
+    sitePackagesDir = VirtualEnvInfo.getSitePackagesDirectory(venvDir)
+    cacheTag = _getCacheTag(venvDir)
+
+    # Protect the kept modules, and the packages containing them
+    keptNames = getRecordedImports(venvDir).union(keepModules or [])
+    protectedNames = set()
+    for moduleName in keptNames:
+        nameParts = moduleName.split('.')
+        for i in range(1, len(nameParts) + 1):
+            protectedNames.add('.'.join(nameParts[:i]))
+
+    # protectedDirs - Directories directly containing a kept (non-package) module. Other files there may be data it loads.
+    protectedDirs = set()
+
+    report = SlimReport(dryRun)
+
+    try:
+        distInfoNames = sorted([ x for x in os.listdir(sitePackagesDir) if x.endswith('.dist-info') ])
+    except OSError:
+        return report
+
+    # First pass: find candidates, and which directories hold protected modules
+    candidates = {}
+    for distInfoName in distInfoNames:
+        recordPath = os.sep.join([sitePackagesDir, distInfoName, 'RECORD'])
+        try:
+            with open(recordPath, 'rt') as f:
+                rows = [ row for row in csv.reader(f) if row ]
+        except (IOError, OSError):
+            continue
+
+        removeRows = []
+        for row in rows:
+            relPath = os.path.normpath(row[0]).replace(os.sep, '/')
+            if relPath.startswith('../') or os.path.isabs(relPath):
+                # Outside of site-packages (scripts, headers, data)
+                continue
+
+            moduleName = _getModuleName(relPath)
+            if moduleName and moduleName in protectedNames:
+                if moduleName in keptNames and not os.path.basename(relPath).startswith('__init__.'):
+                    directory = os.path.dirname(relPath)
+                    if os.path.basename(directory) == '__pycache__':
+                        directory = os.path.dirname(directory)
+                    protectedDirs.add(directory)
+                continue
+
+            slimClass = _classifyFile(relPath, cacheTag, slimClasses)
+            if slimClass:
+                removeRows.append( (row, relPath, slimClass) )
+
+        candidates[distInfoName] = (recordPath, rows, removeRows)
+
+    # Second pass: remove, and rewrite each RECORD
+    removedDirs = set()
+    # countedPaths - Files already removed (or counted, with dryRun)
+    countedPaths = set()
+    for distInfoName in distInfoNames:
+        if distInfoName not in candidates:
+            continue
+        (recordPath, rows, removeRows) = candidates[distInfoName]
+
+        removedRows = set()
+        for (row, relPath, slimClass) in removeRows:
+            directory = os.path.dirname(relPath)
+            if os.path.basename(directory) == '__pycache__':
+                directory = os.path.dirname(directory)
+            if directory in protectedDirs:
+                continue
+
+            fullPath = os.sep.join([sitePackagesDir] + relPath.split('/'))
+            if fullPath in countedPaths:
+                removedRows.add(id(row))
+                continue
+            try:
+                size = os.lstat(fullPath).st_size
+            except OSError:
+                # Already gone, just drop it from the RECORD
+                removedRows.add(id(row))
+                continue
+
+            if not dryRun:
+                try:
+                    os.unlink(fullPath)
+                except OSError:
+                    continue
+                removedDirs.add(os.path.dirname(fullPath))
+            removedRows.add(id(row))
+            countedPaths.add(fullPath)
+            report._add(slimClass, size)
+
+            if fullPath.endswith('.py'):
+                # Bytecode compiled from this file at runtime is not in the RECORD
+                cacheDir = os.sep.join([os.path.dirname(fullPath), '__pycache__'])
+                prefix = os.path.basename(fullPath)[:-3] + '.'
+                try:
+                    cacheFiles = [ x for x in os.listdir(cacheDir) if x.startswith(prefix) and x.endswith('.pyc') ]
+                except OSError:
+                    cacheFiles = []
+                for cacheFile in cacheFiles:
+                    cachePath = os.sep.join([cacheDir, cacheFile])
+                    if cachePath in countedPaths:
+                        continue
+                    try:
+                        size = os.lstat(cachePath).st_size
+                        if not dryRun:
+                            os.unlink(cachePath)
+                            removedDirs.add(cacheDir)
+                    except OSError:
+                        continue
+                    countedPaths.add(cachePath)
+                    report._add(slimClass, size)
+
+        if removedRows and not dryRun:
+            tmpPath = recordPath + '.tmp'
+            with open(tmpPath, 'wt') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                for row in rows:
+                    if id(row) not in removedRows:
+                        writer.writerow(row)
+            os.rename(tmpPath, recordPath)
+
+    # Remove now-empty directories, deepest first, but never site-packages itself
+    sitePackagesDir = os.path.normpath(sitePackagesDir)
+    for directory in sorted(removedDirs, key=len, reverse=True):
+        while directory.startswith(sitePackagesDir + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    return report
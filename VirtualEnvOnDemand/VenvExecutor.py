@@ -0,0 +1,376 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    VenvExecutor - A concurrent.futures Executor which runs callables within a virtualenv,
+      on a pool of long-lived worker processes started from that virtualenv's python.
+
+      Unlike activateEnv, this does not touch the running process's sys.path, so each executor can
+        use a different (even conflicting) set of packages, or a different python version entirely.
+
+      Workers are started once and reused, so imports stay warm between tasks. Where fork is available,
+        a list of heavy modules can be preloaded once in a fork-server parent, which then forks the workers.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import binascii
+import os
+import pickle
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    from concurrent.futures import Executor, Future
+except ImportError:
+    # python2 without the "futures" backport
+    Executor = object
+    Future = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .VirtualEnvInfo import VirtualEnvInfo, getInfoFromVirtualEnv
+from .ExecutorWorker import sendMessage, recvMessage, recvHello, PICKLE_PROTOCOL, EXIT_CANNOT_CONNECT
+from .exceptions import VenvExecutorWorkerDied
+
+__all__ = ('VenvExecutor', )
+
+# WORKER_SCRIPT - Path to the script run by the virtualenv's python for each worker (or fork-server)
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ExecutorWorker.py')
+
+if WORKER_SCRIPT.endswith(('.pyc', '.pyo')):
+    WORKER_SCRIPT = WORKER_SCRIPT[:-1]
+
+# HELLO_TIMEOUT - Seconds a new connection has to prove it is one of our workers, before it is dropped
+HELLO_TIMEOUT = 10.0
+
+
+class VenvExecutor(Executor):
+    '''
+        VenvExecutor - Executor which runs submitted callables on worker processes within a virtualenv.
+
+            Callables, arguments, and results are pickled, so callables must be importable by the virtualenv's python
+              (i.e. module-level functions from a module available within that env, not from __main__ or lambdas).
+
+            Exceptions raised by a task are re-raised from its future, with the worker's formatted traceback
+              available as the "remoteTraceback" attribute of the exception.
+
+            If a worker dies while running a task, that future raises VenvExecutorWorkerDied, and the dead worker is replaced
+              (by the fork-server, where used). If every worker has exited, pending tasks fail with VenvExecutorWorkerDied, and so does submit.
+
+            Example:
+
+                with VenvExecutor(venvInfo, maxWorkers=4, preloadModules=['numpy']) as executor:
+                    results = list(executor.map(mymodule.crunch, items))
+    '''
+
+    def __init__(self, venv, maxWorkers=None, preloadModules=None, useForkServer=None, startupTimeout=60):
+        '''
+            @param venv <str/VirtualEnvInfo> - The virtualenv whose python runs the workers
+            @param maxWorkers <int/None> Default None - Number of worker processes. Default is the number of CPUs.
+            @param preloadModules list<str>/None - Modules to import in each worker before it accepts tasks
+            @param useForkServer <bool/None> Default None - If True, one process imports #preloadModules then forks all workers,
+                                    sharing the warm imports (and their memory pages). Default is True where fork is available.
+            @param startupTimeout <float> Default 60 - Seconds to wait for all workers to start and connect
+
+            @raises -
+                ImportError - If concurrent.futures is not available (python2 without the "futures" backport)
+                RuntimeError - If the workers could not be started within #startupTimeout
+        '''
+        if Future is None:
+            raise ImportError('VenvExecutor requires concurrent.futures (python3, or the "futures" backport on python2).')
+
+        if not isinstance(venv, VirtualEnvInfo):
+            venv = getInfoFromVirtualEnv(venv)
+
+        if not maxWorkers:
+            try:
+                maxWorkers = os.cpu_count() or 1
+            except AttributeError:
+                import multiprocessing
+                maxWorkers = multiprocessing.cpu_count()
+
+        if useForkServer is None:
+            useForkServer = hasattr(os, 'fork')
+
+        self.venvInfo = venv
+        self.maxWorkers = maxWorkers
+        self.preloadModules = list(preloadModules or [])
+        self._useForkServer = useForkServer
+
+        self._workQueue = queue.Queue()
+        self._shutdownLock = threading.Lock()
+        self._isShutdown = False
+        self._connectedCondition = threading.Condition()
+        self._numConnected = 0
+        self._workerThreads = []
+        # _connectedPids - Pids of every worker which has connected. Only these are replaced when they die, so a worker which cannot start is not retried forever.
+        self._connectedPids = set()
+        self._isBroken = False
+        self._authKey = binascii.hexlify(os.urandom(16)).decode('ascii')
+
+        # Listen for workers. A unix socket within a private directory where available, otherwise localhost tcp.
+        self._socketDirectory = None
+        if hasattr(socket, 'AF_UNIX'):
+            self._socketDirectory = tempfile.mkdtemp(prefix='venv_executor_')
+            socketPath = os.path.join(self._socketDirectory, 'executor.sock')
+            self._listenSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._listenSocket.bind(socketPath)
+            address = 'unix:' + socketPath
+        else:
+            self._listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._listenSocket.bind(('127.0.0.1', 0))
+            address = 'tcp:127.0.0.1:%d' %(self._listenSocket.getsockname()[1],)
+        self._listenSocket.listen(max(maxWorkers, 5))
+
+        self._acceptThread = threading.Thread(target=self._acceptWorkers, name='VenvExecutor-accept')
+        self._acceptThread.daemon = True
+        self._acceptThread.start()
+
+        # Start the workers
+        pythonBin = VirtualEnvInfo.getPythonBin(venv.virtualenvDirectory)
+        preloadArg = ','.join(self.preloadModules)
+        self._workerCommand = [pythonBin, WORKER_SCRIPT, address, '1', preloadArg, self._authKey]
+        if useForkServer:
+            commands = [ [pythonBin, WORKER_SCRIPT, address, str(maxWorkers), preloadArg, self._authKey] ]
+        else:
+            commands = [ list(self._workerCommand) for i in range(maxWorkers) ]
+
+        self._processes = []
+        for command in commands:
+            self._startProcess(command)
+
+        # Wait for every worker to connect, so the first tasks are not paying for startup
+        with self._connectedCondition:
+            deadline = time.time() + startupTimeout
+            while self._numConnected < maxWorkers:
+                if [ process for process in self._processes if process.poll() is not None ]:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._connectedCondition.wait(min(remaining, 0.5))
+
+            numConnected = self._numConnected
+
+        if numConnected < maxWorkers:
+            self.shutdown(wait=False)
+            for process in self._processes:
+                if process.poll() is None:
+                    process.terminate()
+            raise RuntimeError('Only %d of %d VenvExecutor workers started within %s seconds, using "%s".' %(numConnected, maxWorkers, str(startupTimeout), pythonBin))
+
+    def _startProcess(self, command):
+        '''
+            _startProcess - Start a worker (or fork-server) process, and a thread watching for it to exit
+
+            @return <subprocess.Popen> - The process
+        '''
+        devnull = open(os.devnull, 'rb')
+        try:
+            process = subprocess.Popen(command, shell=False, stdin=devnull, close_fds=(os.name != 'nt'))
+        finally:
+            devnull.close()
+        self._processes.append(process)
+
+        watchThread = threading.Thread(target=self._watchProcess, args=(process, ), name='VenvExecutor-watch-%d' %(process.pid,))
+        watchThread.daemon = True
+        watchThread.start()
+        return process
+
+    def _watchProcess(self, process):
+        '''
+            _watchProcess - Wait for a worker (or fork-server) process to exit. Replace it if it died, as the fork-server does for its workers,
+              and fail the pending tasks if no workers are left.
+        '''
+        returnCode = process.wait()
+
+        died = returnCode not in (0, EXIT_CANNOT_CONNECT)
+        with self._shutdownLock:
+            if died and not self._useForkServer and not self._isShutdown and process.pid in self._connectedPids:
+                try:
+                    self._startProcess(self._workerCommand)
+                except OSError:
+                    pass
+
+        self._checkBroken()
+
+    def _checkBroken(self):
+        '''
+            _checkBroken - If every worker has exited, fail every queued task, and have submit fail from now on.
+        '''
+        with self._shutdownLock:
+            if [ process for process in self._processes if process.poll() is None ]:
+                return
+            # Workers forked by a fork-server are not our children, so they are only known dead once their connection is lost
+            with self._connectedCondition:
+                if self._useForkServer and self._numConnected > 0:
+                    return
+            self._isBroken = True
+
+            sawShutdown = False
+            while True:
+                try:
+                    workItem = self._workQueue.get_nowait()
+                except queue.Empty:
+                    break
+                if workItem is None:
+                    sawShutdown = True
+                elif workItem[0].set_running_or_notify_cancel():
+                    workItem[0].set_exception(VenvExecutorWorkerDied('All VenvExecutor workers have exited, task %r was never run' %(workItem[1],)))
+            if sawShutdown:
+                self._workQueue.put(None)
+
+    def _acceptWorkers(self):
+        '''
+            _acceptWorkers - Accept connections from workers (including fork-server replacements), until shutdown.
+        '''
+        while True:
+            try:
+                (conn, _) = self._listenSocket.accept()
+            except (socket.error, OSError):
+                return
+
+            # Anyone local can connect over tcp, so nothing is unpickled from a connection until it has proven it is our worker
+            try:
+                conn.settimeout(HELLO_TIMEOUT)
+                workerPid = recvHello(conn, self._authKey)
+                conn.settimeout(None)
+            except (socket.error, OSError):
+                workerPid = None
+            if workerPid is None:
+                conn.close()
+                continue
+
+            thread = threading.Thread(target=self._serveWorker, args=(conn, ), name='VenvExecutor-worker-%d' %(workerPid,))
+            thread.daemon = True
+            with self._connectedCondition:
+                self._numConnected += 1
+                self._connectedPids.add(workerPid)
+                self._workerThreads.append(thread)
+                self._connectedCondition.notify_all()
+            thread.start()
+
+    def _serveWorker(self, conn):
+        '''
+            _serveWorker - Feed tasks from the queue to one worker connection
+        '''
+        try:
+            while True:
+                workItem = self._workQueue.get()
+                if workItem is None:
+                    # Shutdown. Pass the sentinel on to the next worker.
+                    self._workQueue.put(None)
+                    try:
+                        sendMessage(conn, ('shutdown', ))
+                    except (socket.error, OSError):
+                        pass
+                    return
+
+                (future, func, args, kwargs) = workItem
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    payload = pickle.dumps((func, args, kwargs), PICKLE_PROTOCOL)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+
+                try:
+                    sendMessage(conn, ('task', id(future), payload))
+                    response = recvMessage(conn)
+                except (socket.error, OSError, EOFError):
+                    response = None
+                except Exception as e:
+                    # Result could not be unpickled here
+                    future.set_exception(e)
+                    continue
+
+                if response is None:
+                    future.set_exception(VenvExecutorWorkerDied('Worker process exited while running task %r' %(func,)))
+                    return
+
+                (_, _, succeeded, value, formattedTraceback) = response
+                if succeeded:
+                    future.set_result(value)
+                else:
+                    try:
+                        value.remoteTraceback = formattedTraceback
+                    except Exception:
+                        pass
+                    future.set_exception(value)
+        finally:
+            with self._connectedCondition:
+                self._numConnected -= 1
+            conn.close()
+            self._checkBroken()
+
+    def submit(self, fn, *args, **kwargs):
+        '''
+            submit - Schedule fn(*args, **kwargs) to run on a worker within the virtualenv
+
+            @return <concurrent.futures.Future> - A future for the result
+
+            @raises -
+                RuntimeError - If the executor has been shutdown
+                VenvExecutorWorkerDied - If every worker has exited
+        '''
+        with self._shutdownLock:
+            if self._isShutdown:
+                raise RuntimeError('Cannot submit to a VenvExecutor after shutdown.')
+            if self._isBroken:
+                raise VenvExecutorWorkerDied('All VenvExecutor workers have exited, using "%s".' %(self._workerCommand[0],))
+
+            future = Future()
+            self._workQueue.put( (future, fn, args, kwargs) )
+            return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        '''
+            shutdown - Stop accepting tasks, and stop the workers once queued tasks complete.
+
+            @param wait <bool> Default True - If True, block until all queued tasks are complete and workers have exited
+            @param cancel_futures <bool> Default False - If True, cancel all tasks which have not started
+        '''
+        with self._shutdownLock:
+            if self._isShutdown:
+                return
+            self._isShutdown = True
+
+            if cancel_futures:
+                while True:
+                    try:
+                        workItem = self._workQueue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if workItem is not None:
+                        workItem[0].cancel()
+
+            self._workQueue.put(None)
+
+        # shutdown is needed to wake a blocking accept on linux, close alone does not.
+        for closeFunc in (lambda : self._listenSocket.shutdown(socket.SHUT_RDWR), self._listenSocket.close):
+            try:
+                closeFunc()
+            except (socket.error, OSError):
+                pass
+
+        if wait:
+            for thread in list(self._workerThreads):
+                thread.join()
+            for process in list(self._processes):
+                process.wait()
+        else:
+            # Workers exit on their own once they are sent the shutdown, or their connection is closed
+            for process in list(self._processes):
+                if process.poll() is None and self._numConnected == 0:
+                    process.terminate()
+
+        if self._socketDirectory:
+            shutil.rmtree(self._socketDirectory, ignore_errors=True)
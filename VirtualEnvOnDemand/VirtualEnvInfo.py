@@ -10,7 +10,10 @@ import os
 import platform
 import sys
 
-__all__ = ('VirtualEnvInfo', 'getInfoFromVirtualEnv')
+__all__ = ('VirtualEnvInfo', 'getInfoFromVirtualEnv', 'PIPLESS_MARKER_FILENAME')
+
+# PIPLESS_MARKER_FILENAME - Present in the root of a virtualenv created without pip. The host's pip is used to install into these.
+PIPLESS_MARKER_FILENAME = '.VirtualEnvOnDemand_NoPip'
 
 
 class VirtualEnvInfo(object):
@@ -47,12 +50,18 @@ class VirtualEnvInfo(object):
         '''
             _getSitePackagesDirectoryUnix - Get the site packages directory on a UNIX system (linux, mac, sun, etc)
 
+                The python version in the path is that of the virtualenv (@see getPythonVersion), which may differ from the running interpreter.
+                  If the virtualenv does not exist yet, the running interpreter's version is used.
+
             @param virtualenvDirectory <str> - The path to the root directory of the virtualenv
 
             @return <str> - Path to the "site-packages" directory of the virtualenv
         '''
-        versionInfo = sys.version_info
-        return os.sep.join([virtualenvDirectory, 'lib', 'python%d.%d' %(versionInfo.major, versionInfo.minor), 'site-packages'])
+        pythonVersion = VirtualEnvInfo.getPythonVersion(virtualenvDirectory)
+        if not pythonVersion:
+            versionInfo = sys.version_info
+            pythonVersion = '%d.%d' %(versionInfo[0], versionInfo[1])
+        return os.sep.join([virtualenvDirectory, 'lib', 'python' + pythonVersion, 'site-packages'])
 
     @staticmethod
     def _getSitePackagesDirectoryWindows(virtualenvDirectory):
@@ -196,6 +205,48 @@ class VirtualEnvInfo(object):
         raise NotImplementedError('getPipBin should have been overridden by platform-specific version.')
 
 
+    @staticmethod
+    def getPythonVersion(virtualenvDirectory):
+        '''
+            getPythonVersion - Get the "major.minor" version of python a virtualenv was created for.
+
+                This is read from the "pyvenv.cfg" within the virtualenv if present, otherwise from the name of the "lib/pythonX.Y" directory.
+
+            @param virtualenvDirectory <str> - The path to the root directory of the virtualenv
+
+            @return <str/None> - The version, e.x. "3.11", or None if it cannot be determined
+        '''
+        try:
+            with open(os.sep.join([virtualenvDirectory, 'pyvenv.cfg']), 'rt') as f:
+                for line in f:
+                    (key, _, value) = line.partition('=')
+                    if key.strip() in ('version_info', 'version') and value.strip():
+                        return '.'.join(value.strip().split('.')[:2])
+        except (IOError, OSError):
+            pass
+
+        try:
+            for entry in sorted(os.listdir(os.sep.join([virtualenvDirectory, 'lib']))):
+                if entry.startswith('python') and entry[len('python'):].replace('.', '').isdigit():
+                    return entry[len('python'):]
+        except OSError:
+            pass
+
+        return None
+
+
+    @staticmethod
+    def isPipless(virtualenvDirectory):
+        '''
+            isPipless - Check if a virtualenv was created without its own pip (createEnv with withPip=False)
+
+            @param virtualenvDirectory <str> - The path to the root directory of the virtualenv
+
+            @return <bool> - True if the host's pip must be used to install into this virtualenv
+        '''
+        return os.path.exists(os.sep.join([virtualenvDirectory, PIPLESS_MARKER_FILENAME]))
+
+
     # WINDOWS VS LINUX/UNIX COMPAT.
     #  Note, we treat cygwin like unix.
     if not sys.argv or not os.path.basename(sys.argv[0]).lower().startswith('pydoc'):
@@ -232,9 +283,14 @@ class VirtualEnvInfo(object):
         if not os.path.isdir(self.virtualenvDirectory):
             raise ValueError('virtualenvDirectory "%s" does not seem to be a directory.' %(self.virtualenvDirectory,))
 
-        pipPath = VirtualEnvInfo.getPipBin(self.virtualenvDirectory)
-        if not os.path.exists(pipPath):
-            raise ValueError('Cannot find pip executable at "%s"' %(pipPath,))
+        if VirtualEnvInfo.isPipless(self.virtualenvDirectory):
+            pythonPath = VirtualEnvInfo.getPythonBin(self.virtualenvDirectory)
+            if not os.path.exists(pythonPath):
+                raise ValueError('Cannot find python executable at "%s"' %(pythonPath,))
+        else:
+            pipPath = VirtualEnvInfo.getPipBin(self.virtualenvDirectory)
+            if not os.path.exists(pipPath):
+                raise ValueError('Cannot find pip executable at "%s"' %(pipPath,))
 
         if not os.path.isdir(self.sitePackagesDirectory):
             raise ValueError('Cannot find site packages directory at "%s"' %(self.sitePackagesDirectory,))
@@ -245,6 +301,8 @@ class VirtualEnvInfo(object):
 class VirtualEnvDeferredBuild(VirtualEnvInfo):
     '''
         VirtualEnvDeferredBuild - Used by GlobalEnv to defer a build.
+
+            virtualenvDirectory holds the parent directory to build within, or None to place it per the placement policy.
     '''
 
     def __init__(self, parentDirectory):
@@ -0,0 +1,340 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Wheels - Methods for placing an unpacked wheel into a virtualenv without going through pip,
+      and for removing a distribution placed that way.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import base64
+import csv
+import hashlib
+import os
+import re
+import shutil
+import stat
+import sys
+
+from .VirtualEnvInfo import VirtualEnvInfo
+from .utils import canonicalizeName, ensureDirectory
+
+__all__ = ('parseWheelFilename', 'findDistInfoDirectory', 'installUnpackedWheel', 'uninstallDistribution', 'INSTALLER_NAME')
+
+# INSTALLER_NAME - Written to the INSTALLER file of every distribution we place ourselves
+INSTALLER_NAME = 'VirtualEnvOnDemand'
+
+# WHEEL_FILENAME_RE - name-version(-build)?-pyver-abi-plat.whl
+WHEEL_FILENAME_RE = re.compile(r'^(?P<name>[^-]+)-(?P<version>[^-]+)(-(?P<build>\d[^-]*))?-(?P<pyver>[^-]+)-(?P<abi>[^-]+)-(?P<plat>[^-]+)\.whl$')
+
+# ENTRY_POINT_RE - "name = module:attr.sub [extras]"
+ENTRY_POINT_RE = re.compile(r'^\s*(?P<name>[^=\s]+)\s*=\s*(?P<module>[\w.]+)\s*(:\s*(?P<attr>[\w.]+))?\s*(\[.*\])?\s*$')
+
+CONSOLE_SCRIPT_TEMPLATE = '''#!%(python)s
+# -*- coding: utf-8 -*-
+# Generated by VirtualEnvOnDemand
+import re
+import sys
+from %(module)s import %(importName)s
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit(%(call)s())
+'''
+
+
+def parseWheelFilename(filename):
+    '''
+        parseWheelFilename - Parse the components out of a wheel filename (PEP 427)
+
+        @param filename <str> - Filename (or path) of a wheel, e.x. six-1.17.0-py2.py3-none-any.whl
+
+        @return tuple<str> - ( name, version, tag ) where tag is "pyver-abi-plat", e.x. ( 'six', '1.17.0', 'py2.py3-none-any' )
+
+        @raises ValueError - If #filename is not a wheel filename
+    '''
+    matchObj = WHEEL_FILENAME_RE.match(os.path.basename(filename))
+    if not matchObj:
+        raise ValueError('"%s" is not a valid wheel filename.' %(filename,))
+
+    groups = matchObj.groupdict()
+    return (groups['name'], groups['version'], '-'.join([groups['pyver'], groups['abi'], groups['plat']]))
+
+
+def findDistInfoDirectory(directory, name=None):
+    '''
+        findDistInfoDirectory - Find the "*.dist-info" directory contained directly within a directory
+
+        @param directory <str> - Directory to search (an unpacked wheel, or a site-packages directory)
+        @param name <str/None> - If provided, only a dist-info for this distribution (compared canonically) is returned
+
+        @return <str/None> - The name (not full path) of the dist-info directory, or None if not found
+    '''
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return None
+
+    canonicalName = name and canonicalizeName(name)
+    for entry in sorted(entries):
+        if not entry.endswith('.dist-info'):
+            continue
+        if canonicalName and canonicalizeName(entry[:-len('.dist-info')].rsplit('-', 1)[0]) != canonicalName:
+            continue
+        if os.path.isdir(os.sep.join([directory, entry])):
+            return entry
+
+    return None
+
+
+def _hashFile(path):
+    '''
+        _hashFile - Hash a file in the format used by RECORD
+
+        @return tuple<str, int> - ( "sha256=<urlsafe-b64>", size )
+    '''
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(65536)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+
+    return ('sha256=' + base64.urlsafe_b64encode(digest.digest()).decode('ascii').rstrip('='), size)
+
+
+def _readRecord(recordPath):
+    '''
+        _readRecord - Read a RECORD file
+
+        @return dict<str, tuple<str, str>> - Map of relative path -> ( hash, size )
+    '''
+    ret = {}
+    if not os.path.exists(recordPath):
+        return ret
+
+    with open(recordPath, 'rt') as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            row = row + ['', '']
+            ret[row[0]] = (row[1], row[2])
+    return ret
+
+
+def _writeRecord(recordPath, rows):
+    with open(recordPath, 'wt') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        for row in rows:
+            writer.writerow(row)
+
+
+def _placeFile(placeFunc, src, dest):
+    '''
+        _placeFile - Put #src at #dest using #placeFunc, replacing anything already at #dest
+    '''
+    if os.path.lexists(dest):
+        os.unlink(dest)
+    placeFunc(src, dest)
+
+
+def _writeScript(dest, contents):
+    if os.path.lexists(dest):
+        os.unlink(dest)
+    with open(dest, 'wb') as f:
+        f.write(contents)
+    os.chmod(dest, os.stat(dest).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def _readEntryPoints(entryPointsPath):
+    '''
+        _readEntryPoints - Read the console_scripts and gui_scripts sections of an entry_points.txt
+
+        @return list<tuple<str, str, str>> - List of ( scriptName, module, attr )
+    '''
+    ret = []
+    if not os.path.exists(entryPointsPath):
+        return ret
+
+    section = None
+    with open(entryPointsPath, 'rt') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in ('#', ';'):
+                continue
+            if line.startswith('['):
+                section = line.strip('[]').strip()
+                continue
+            if section not in ('console_scripts', 'gui_scripts'):
+                continue
+            matchObj = ENTRY_POINT_RE.match(line)
+            if matchObj:
+                ret.append( (matchObj.group('name'), matchObj.group('module'), matchObj.group('attr') or '') )
+    return ret
+
+
+def installUnpackedWheel(wheelTree, venvDir, placeFunc=shutil.copy2):
+    '''
+        installUnpackedWheel - Install the contents of an unpacked wheel into a virtualenv, as pip would.
+
+            Files are placed into the virtualenv using #placeFunc, so the caller decides whether they are copied, moved, or linked.
+              Scripts and generated console-script entry points are always written fresh, as they must reference this virtualenv's python.
+
+            A new RECORD and INSTALLER is written into the installed dist-info, so pip can later upgrade or uninstall the distribution.
+
+            Any currently-installed version of the same distribution is removed first.
+
+        @param wheelTree <str> - Path to the root of an unpacked wheel
+        @param venvDir <str/VirtualEnvInfo> - The virtualenv to install into
+        @param placeFunc <function> Default shutil.copy2 - function(src, dest) used to place each file
+
+        @return <str> - The name of the installed dist-info directory
+
+        @raises ValueError - If #wheelTree does not contain a dist-info directory
+    '''
+    if isinstance(venvDir, VirtualEnvInfo):
+        venvDir = venvDir.virtualenvDirectory
+
+    distInfoName = findDistInfoDirectory(wheelTree)
+    if not distInfoName:
+        raise ValueError('No dist-info directory found within unpacked wheel at "%s"' %(wheelTree,))
+
+    distName = distInfoName[:-len('.dist-info')].rsplit('-', 1)[0]
+    dataDirName = distInfoName[:-len('.dist-info')] + '.data'
+
+    sitePackagesDir = VirtualEnvInfo.getSitePackagesDirectory(venvDir)
+    binDir = VirtualEnvInfo.getBinDir(venvDir)
+    pythonBin = VirtualEnvInfo.getPythonBin(venvDir)
+
+    uninstallDistribution(sitePackagesDir, distName)
+
+    sourceHashes = _readRecord(os.sep.join([wheelTree, distInfoName, 'RECORD']))
+    skipFiles = set( [ '/'.join([distInfoName, x]) for x in ('RECORD', 'INSTALLER', 'REQUESTED') ] )
+
+    records = []
+
+    def _addRecord(installedPath, sourceRelPath=None):
+        relPath = os.path.relpath(installedPath, sitePackagesDir).replace(os.sep, '/')
+        if sourceRelPath and sourceRelPath in sourceHashes and sourceHashes[sourceRelPath][0]:
+            (fileHash, fileSize) = sourceHashes[sourceRelPath]
+        else:
+            (fileHash, fileSize) = _hashFile(installedPath)
+        records.append( (relPath, fileHash, str(fileSize)) )
+
+    for (dirPath, dirNames, fileNames) in os.walk(wheelTree):
+        relDir = os.path.relpath(dirPath, wheelTree)
+        relDir = '' if relDir == '.' else relDir.replace(os.sep, '/')
+
+        for fileName in fileNames:
+            relPath = relDir and '/'.join([relDir, fileName]) or fileName
+            if relPath in skipFiles:
+                continue
+            srcPath = os.sep.join([dirPath, fileName])
+
+            if relPath.startswith(dataDirName + '/'):
+                (scheme, _, schemeRelPath) = relPath[len(dataDirName) + 1:].partition('/')
+                if scheme in ('purelib', 'platlib'):
+                    destPath = os.sep.join([sitePackagesDir] + schemeRelPath.split('/'))
+                elif scheme == 'scripts':
+                    destPath = os.sep.join([binDir] + schemeRelPath.split('/'))
+                    with open(srcPath, 'rb') as f:
+                        contents = f.read()
+                    (firstLine, newline, remainder) = contents.partition(b'\n')
+                    if firstLine.startswith(b'#!python'):
+                        # Wheel scripts use a placeholder interpreter which must point at this virtualenv
+                        interpreterArgs = firstLine[len(b'#!python'):]
+                        if interpreterArgs.startswith(b'w'):
+                            interpreterArgs = interpreterArgs[1:]
+                        contents = b'#!' + pythonBin.encode(sys.getfilesystemencoding()) + interpreterArgs + newline + remainder
+                    ensureDirectory(os.path.dirname(destPath))
+                    _writeScript(destPath, contents)
+                    _addRecord(destPath)
+                    continue
+                elif scheme == 'headers':
+                    destPath = os.sep.join([venvDir, 'include', 'site', 'python' + (VirtualEnvInfo.getPythonVersion(venvDir) or '%d.%d' %(sys.version_info[0], sys.version_info[1])), distName] + schemeRelPath.split('/'))
+                else:
+                    # "data"
+                    destPath = os.sep.join([venvDir] + schemeRelPath.split('/'))
+            else:
+                destPath = os.sep.join([sitePackagesDir] + relPath.split('/'))
+
+            ensureDirectory(os.path.dirname(destPath))
+            _placeFile(placeFunc, srcPath, destPath)
+            _addRecord(destPath, relPath)
+
+    # Generate console-script entry points
+    installedDistInfo = os.sep.join([sitePackagesDir, distInfoName])
+    for (scriptName, moduleName, attrName) in _readEntryPoints(os.sep.join([installedDistInfo, 'entry_points.txt'])):
+        if not attrName:
+            continue
+        importName = attrName.split('.')[0]
+        contents = CONSOLE_SCRIPT_TEMPLATE %{
+            'python'     : pythonBin,
+            'module'     : moduleName,
+            'importName' : importName,
+            'call'       : attrName,
+        }
+        destPath = os.sep.join([binDir, scriptName])
+        _writeScript(destPath, contents.encode('utf-8'))
+        _addRecord(destPath)
+
+    with open(os.sep.join([installedDistInfo, 'INSTALLER']), 'wt') as f:
+        f.write(INSTALLER_NAME + '\n')
+    _addRecord(os.sep.join([installedDistInfo, 'INSTALLER']))
+
+    records.append( ('/'.join([distInfoName, 'RECORD']), '', '') )
+    _writeRecord(os.sep.join([installedDistInfo, 'RECORD']), records)
+
+    return distInfoName
+
+
+def uninstallDistribution(sitePackagesDir, name):
+    '''
+        uninstallDistribution - Remove an installed distribution by the files listed in its RECORD.
+
+            Directories left empty are removed as well.
+
+        @param sitePackagesDir <str> - The site-packages directory the distribution was installed into
+        @param name <str> - The distribution name (compared canonically)
+
+        @return <bool> - True if a distribution was found and removed, otherwise False
+    '''
+    distInfoName = findDistInfoDirectory(sitePackagesDir, name)
+    if not distInfoName:
+        return False
+
+    distInfoDir = os.sep.join([sitePackagesDir, distInfoName])
+    directories = set()
+    for relPath in _readRecord(os.sep.join([distInfoDir, 'RECORD'])).keys():
+        fullPath = os.path.normpath(os.sep.join([sitePackagesDir] + relPath.split('/')))
+        try:
+            os.unlink(fullPath)
+        except OSError:
+            pass
+        directories.add(os.path.dirname(fullPath))
+        if fullPath.endswith('.py'):
+            # Remove any bytecode compiled from this file
+            cacheDir = os.sep.join([os.path.dirname(fullPath), '__pycache__'])
+            prefix = os.path.basename(fullPath)[:-3] + '.'
+            try:
+                for cacheFile in os.listdir(cacheDir):
+                    if cacheFile.startswith(prefix) and cacheFile.endswith('.pyc'):
+                        os.unlink(os.sep.join([cacheDir, cacheFile]))
+                directories.add(cacheDir)
+            except OSError:
+                pass
+
+    shutil.rmtree(distInfoDir, ignore_errors=True)
+
+    # Remove now-empty directories, deepest first, but never site-packages itself.
+    sitePackagesDir = os.path.normpath(sitePackagesDir)
+    for directory in sorted(directories, key=len, reverse=True):
+        while directory.startswith(sitePackagesDir + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    return True
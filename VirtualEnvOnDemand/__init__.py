@@ -24,17 +24,33 @@
 
 
 
-__all__ = ('createEnv', 'createEnvIfCannotImport', 'enableOnDemandImporter', 'getGlobalVirtualEnvInfo', 'installPackages', 'ensureImport', 'ensureImportGlobal', 'PipInstallFailed', 'VirtualEnvInfo', 'toggleOnDemandImporter', 'getInfoFromVirtualEnv', 'activateEnv', 'setGlobalVirtualEnv', 'setupAndActivateEnv', 'toggleDebug', )
+__all__ = ('createEnv', 'createEnvIfCannotImport', 'enableOnDemandImporter', 'getGlobalVirtualEnvInfo', 'installPackages', 'ensureImport', 'ensureImportGlobal', 'PipInstallFailed', 'VirtualEnvInfo', 'toggleOnDemandImporter', 'getInfoFromVirtualEnv', 'activateEnv', 'setGlobalVirtualEnv', 'setupAndActivateEnv', 'toggleDebug', 'PackageStore', 'waitForBackgroundUpgrade', 'exportEnv', 'importEnv', 'IncompatibleVirtualEnv', 'buildEnvMatrix', 'VenvExecutor', 'PipInstallTimedOut', 'setInstallPolicy', 'InstallerBackend', 'PipInstaller', 'LocalWheelInstaller', 'slimEnv', 'recordImports', 'ImportProfiler', 'getMetricsRegistry', 'MetricsRegistry', 'waitForInstallReplay', 'setResourcePolicy', 'BuildSlotTimedOut', 'setBuildDaemon', 'BuildDaemon', 'BuildDaemonError', 'compileEnv', 'verifyEnv', 'getEnvManifest', 'deactivateEnv', 'activatedEnv', 'verifyEnvIntegrity', 'repairEnv', 'cancelGlobalEnvPrebuild', 'SdistBuildInstaller', 'setPlacementPolicy', 'LazyImporter', 'watchRequirements', )
 
 __version__ = '6.0.0'
 __version_tuple__ = (6, 0, 0)
 
-from .exceptions import PipInstallFailed
+from .exceptions import PipInstallFailed, PipInstallTimedOut, IncompatibleVirtualEnv, BuildSlotTimedOut, BuildDaemonError
 from .VirtualEnvInfo import VirtualEnvInfo, getInfoFromVirtualEnv
 
-from .CreateEnv import createEnv, createEnvIfCannotImport, activateEnv
-
-from VirtualEnvOnDemand.InstallPackages import installPackages, ensureImport
-from VirtualEnvOnDemand.GlobalEnv import enableOnDemandImporter, getGlobalVirtualEnvInfo, ensureImportGlobal, toggleOnDemandImporter, setGlobalVirtualEnv, toggleDebug
-
-from .PersistentEnv import setupAndActivateEnv
+from .CreateEnv import createEnv, createEnvIfCannotImport, activateEnv, deactivateEnv, activatedEnv
+
+from VirtualEnvOnDemand.InstallPackages import installPackages, ensureImport, setInstallPolicy
+from VirtualEnvOnDemand.GlobalEnv import enableOnDemandImporter, getGlobalVirtualEnvInfo, ensureImportGlobal, toggleOnDemandImporter, setGlobalVirtualEnv, toggleDebug, waitForInstallReplay, cancelGlobalEnvPrebuild
+
+from .PackageStore import PackageStore
+from .Installers import InstallerBackend, PipInstaller, LocalWheelInstaller
+from .ExportEnv import exportEnv, importEnv
+from .Slim import slimEnv, recordImports
+from .ImportProfiler import ImportProfiler
+from .Metrics import getMetricsRegistry, MetricsRegistry
+from .ResourcePolicy import setResourcePolicy
+from .BuildDaemon import setBuildDaemon, BuildDaemon
+from .BuildMatrix import buildEnvMatrix
+from .VenvExecutor import VenvExecutor
+from .PersistentEnv import setupAndActivateEnv, waitForBackgroundUpgrade
+from .Deploy import compileEnv, verifyEnv, getEnvManifest
+from .Integrity import verifyEnvIntegrity, repairEnv
+from .BuildTools import SdistBuildInstaller
+from .Placement import setPlacementPolicy
+from .LazyImports import LazyImporter
+from .RequirementsWatcher import watchRequirements
@@ -0,0 +1,256 @@
+# Copyright (c) 2015, 2016 Timothy Savannah under terms of LGPLv3. You should have received a copy of this with this distribution as "LICENSE"
+'''
+    Command-line entry point, for doing the expensive work (building, compiling, verifying envs) ahead of time,
+      e.x. during an image build or a deploy, rather than in the first process which needs the env.
+
+      python -m VirtualEnvOnDemand build PARENT_DIR NAME [package ...] [-r requirements.txt] [--my-version V] [--compile] [--verify]
+      python -m VirtualEnvOnDemand compile VENV
+      python -m VirtualEnvOnDemand verify VENV [--import MODULE ...] [--deep] [--repair]
+      python -m VirtualEnvOnDemand manifest VENV [--json]
+      python -m VirtualEnvOnDemand bench [package ...] [-r requirements.txt] [--scenario NAME ...] [--import MODULE ...]
+      python -m VirtualEnvOnDemand preflight PATH ... --venv VENV
+      python -m VirtualEnvOnDemand daemon [--socket PATH]
+      python -m VirtualEnvOnDemand export VENV ARCHIVE
+      python -m VirtualEnvOnDemand import ARCHIVE PARENT_DIR NAME
+
+      Use "python -m VirtualEnvOnDemand COMMAND --help" for the options of each command.
+'''
+
+# vim: ts=4 sw=4 expandtab
+
+import argparse
+import json
+import sys
+import time
+
+from .Deploy import compileEnv, verifyEnv, getEnvManifest, recordBuildTimings, runBenchmarks, BENCH_ALL_SCENARIOS
+from .PersistentEnv import setupAndActivateEnv
+from .VirtualEnvInfo import getInfoFromVirtualEnv
+
+
+def _readPackages(args):
+    '''
+        _readPackages - Combine the packages given on the command line and in -r files into requirements.txt contents
+    '''
+    lines = list(args.packages)
+    for requirementsFile in args.requirementsFiles:
+        with open(requirementsFile, 'rt') as f:
+            lines.append(f.read())
+    return '\n'.join(lines)
+
+
+def _addPackageArguments(parser):
+    parser.add_argument('packages', nargs='*', metavar='package', help='Packages to install, e.x. "requests>=2"')
+    parser.add_argument('-r', '--requirements', dest='requirementsFiles', action='append', default=[], metavar='FILE',
+        help='Install the packages listed in this requirements.txt. May be repeated.')
+    parser.add_argument('--without-pip', dest='withPip', action='store_false', help='Create the env without pip, using the host pip to install')
+
+
+def _printVerifyResult(result):
+    for problem in result.problems:
+        sys.stderr.write('%s\n' %(problem,))
+    if result.success:
+        sys.stdout.write('OK\n')
+    return 0 if result.success else 1
+
+
+def _commandBuild(args):
+    packages = _readPackages(args)
+    lockFile = args.lockFile
+    if lockFile == '':
+        lockFile = True
+
+    startTime = time.time()
+    venvInfo = setupAndActivateEnv(args.parentDirectory, args.name, packages, myVersion=args.myVersion, forceInstallPackages=args.force,
+        printDebug=args.verbose, packageStore=args.packageStore, lockFile=lockFile, withPip=args.withPip, slim=args.slim)
+    timings = { 'build' : time.time() - startTime }
+
+    if args.compile:
+        startTime = time.time()
+        returnCode = compileEnv(venvInfo, None, sys.stderr)
+        timings['compile'] = time.time() - startTime
+        if returnCode != 0:
+            sys.stderr.write('Failed to compile "%s" (ret=%d)\n' %(venvInfo['virtualenvDirectory'], returnCode))
+            return 1
+
+    if args.verify:
+        startTime = time.time()
+        result = verifyEnv(venvInfo, args.importNames)
+        timings['verify'] = time.time() - startTime
+        if not result.success:
+            return _printVerifyResult(result)
+
+    recordBuildTimings(venvInfo, timings)
+    for (step, seconds) in sorted(timings.items()):
+        sys.stdout.write('%s: %.3fs\n' %(step, seconds))
+    sys.stdout.write('%s\n' %(venvInfo['virtualenvDirectory'],))
+    return 0
+
+
+def _commandCompile(args):
+    startTime = time.time()
+    returnCode = compileEnv(args.venvDir, sys.stdout if args.verbose else None, sys.stderr, workers=args.workers)
+    if returnCode != 0:
+        sys.stderr.write('Failed to compile "%s" (ret=%d)\n' %(args.venvDir, returnCode))
+        return 1
+
+    recordBuildTimings(args.venvDir, { 'compile' : time.time() - startTime })
+    return 0
+
+
+def _commandVerify(args):
+    if args.repair:
+        try:
+            getInfoFromVirtualEnv(args.venvDir, validate=True)
+        except ValueError:
+            # Nothing to repair. verifyEnv reports why.
+            return _printVerifyResult(verifyEnv(args.venvDir, args.importNames))
+
+        from .Integrity import repairEnv, verifyEnvIntegrity
+        # repairEnv returns the report after the repair, so list what was broken before it
+        report = verifyEnvIntegrity(args.venvDir)
+        repairEnv(args.venvDir, report, sys.stderr, sys.stderr)
+        for name in sorted(report.broken.keys()):
+            sys.stdout.write('repaired: %s\n' %(name,))
+    return _printVerifyResult(verifyEnv(args.venvDir, args.importNames, deep=args.deep or args.repair))
+
+
+def _commandManifest(args):
+    try:
+        manifest = getEnvManifest(args.venvDir)
+    except ValueError as e:
+        sys.stderr.write('Invalid env "%s": %s\n' %(args.venvDir, str(e)))
+        return 1
+
+    if args.json:
+        sys.stdout.write(json.dumps(manifest, indent=2, sort_keys=True) + '\n')
+        return 0
+
+    for key in ('virtualenvDirectory', 'pythonVersion', 'pipless', 'myVersion', 'sizeBytes'):
+        sys.stdout.write('%s: %s\n' %(key, str(manifest[key])))
+    sys.stdout.write('timings:\n')
+    for (step, seconds) in sorted(manifest['timings'].items()):
+        sys.stdout.write('  %s: %.3fs\n' %(step, seconds))
+    sys.stdout.write('distributions:\n')
+    for (name, version) in sorted(manifest['distributions'].items(), key=lambda item : item[0].lower()):
+        sys.stdout.write('  %s==%s\n' %(name, version))
+    return 0
+
+
+def _commandBench(args):
+    results = runBenchmarks(_readPackages(args), args.scenarios or BENCH_ALL_SCENARIOS, args.repeat, args.parentDirectory, args.importNames,
+        args.withPip, sys.stderr)
+    if args.json:
+        sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+        return 0
+
+    sys.stdout.write('%-10s %5s %10s %10s %10s\n' %('scenario', 'runs', 'min', 'median', 'max'))
+    for scenario in BENCH_ALL_SCENARIOS:
+        if scenario in results:
+            times = sorted(results[scenario])
+            sys.stdout.write('%-10s %5d %9.3fs %9.3fs %9.3fs\n' %(scenario, len(times), times[0], times[len(times) // 2], times[-1]))
+    return 0
+
+
+def _commandExport(args):
+    from .ExportEnv import exportEnv
+    with open(args.archive, 'wb') as f:
+        exportEnv(args.venvDir, f, args.compression)
+    return 0
+
+
+def _commandImport(args):
+    from .ExportEnv import importEnv
+    with open(args.archive, 'rb') as f:
+        venvInfo = importEnv(f, args.parentDirectory, args.name, checkCompatibility=not args.noCompatibilityCheck)
+    sys.stdout.write('%s\n' %(venvInfo['virtualenvDirectory'],))
+    return 0
+
+
+def main(argv=None):
+    '''
+        main - Command-line entry point. @see the module docstring.
+
+        @param argv list<str>/None - Arguments, excluding the program name. Default is sys.argv[1:]
+
+        @return <int> - Exit code
+    '''
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # These have their own command lines
+    if argv and argv[0] == 'preflight':
+        from .Preflight import main as preflightMain
+        return preflightMain(argv[1:])
+    if argv and argv[0] == 'daemon':
+        from .BuildDaemon import main as daemonMain
+        return daemonMain(argv[1:])
+
+    parser = argparse.ArgumentParser(prog='python -m VirtualEnvOnDemand', description='Build, compile, verify and inspect envs ahead of time.',
+        epilog='Also: "preflight" (@see VirtualEnvOnDemand.Preflight) and "daemon" (@see VirtualEnvOnDemand.BuildDaemon). Use "COMMAND --help" for their options.')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    buildParser = subparsers.add_parser('build', help='Build, or upgrade, a persistent env (as setupAndActivateEnv would)')
+    buildParser.add_argument('parentDirectory', help='Directory in which the env is created')
+    buildParser.add_argument('name', help='Name of the env directory')
+    _addPackageArguments(buildParser)
+    buildParser.add_argument('--my-version', dest='myVersion', default=None, help='Version of the env. Packages are installed when it increases.')
+    buildParser.add_argument('--force', action='store_true', help='Install the packages, even if --my-version has not increased')
+    buildParser.add_argument('--lock-file', dest='lockFile', nargs='?', const='', default=None, metavar='PATH',
+        help='Capture (and install from) a lock file, within the env or at PATH')
+    buildParser.add_argument('--package-store', dest='packageStore', default=None, metavar='DIR', help='Link packages from this host-wide store')
+    buildParser.add_argument('--slim', action='store_true', help='Remove files not needed at runtime after installing')
+    buildParser.add_argument('--compile', action='store_true', help='Precompile bytecode after building')
+    buildParser.add_argument('--verify', action='store_true', help='Verify the env after building')
+    buildParser.add_argument('--import', dest='importNames', action='append', default=[], metavar='MODULE', help='With --verify, a module which must be importable')
+    buildParser.add_argument('-v', '--verbose', action='store_true', help='Print what is being done')
+    buildParser.set_defaults(func=_commandBuild)
+
+    compileParser = subparsers.add_parser('compile', help='Precompile the bytecode of everything installed in an env')
+    compileParser.add_argument('venvDir', metavar='VENV')
+    compileParser.add_argument('-j', '--workers', type=int, default=0, help='Number of processes, 0 (default) for one per CPU')
+    compileParser.add_argument('-v', '--verbose', action='store_true', help='List the files compiled')
+    compileParser.set_defaults(func=_commandCompile)
+
+    verifyParser = subparsers.add_parser('verify', help='Verify an env is usable. Exits 1 if any problems are found.')
+    verifyParser.add_argument('venvDir', metavar='VENV')
+    verifyParser.add_argument('--import', dest='importNames', action='append', default=[], metavar='MODULE', help='A module which must be importable. May be repeated.')
+    verifyParser.add_argument('--deep', action='store_true', help='Also check every installed file against the hashes in RECORD')
+    verifyParser.add_argument('--repair', action='store_true', help='Reinstall any distributions which fail the deep check, then verify')
+    verifyParser.set_defaults(func=_commandVerify)
+
+    manifestParser = subparsers.add_parser('manifest', help='Print what is installed in an env, and how long it took to build')
+    manifestParser.add_argument('venvDir', metavar='VENV')
+    manifestParser.add_argument('--json', action='store_true', help='Print as JSON')
+    manifestParser.set_defaults(func=_commandManifest)
+
+    benchParser = subparsers.add_parser('bench', help='Time creating, reusing, and importing from an env with the given packages')
+    _addPackageArguments(benchParser)
+    benchParser.add_argument('--scenario', dest='scenarios', action='append', choices=BENCH_ALL_SCENARIOS, default=[], help='Scenario to run. Default is all.')
+    benchParser.add_argument('--repeat', type=int, default=3, help='Runs of each scenario. Default: 3')
+    benchParser.add_argument('--import', dest='importNames', action='append', default=[], metavar='MODULE', help='Module to import in the "import" scenario')
+    benchParser.add_argument('--directory', dest='parentDirectory', default=None, help='Where to build. Default is the system temporary directory.')
+    benchParser.add_argument('--json', action='store_true', help='Print every run, as JSON')
+    benchParser.set_defaults(func=_commandBench)
+
+    exportParser = subparsers.add_parser('export', help='Export an env to an archive, @see VirtualEnvOnDemand.ExportEnv')
+    exportParser.add_argument('venvDir', metavar='VENV')
+    exportParser.add_argument('archive', metavar='ARCHIVE')
+    exportParser.add_argument('--compression', default='gz', choices=('gz', 'bz2', 'xz', ''), help='Default: gz')
+    exportParser.set_defaults(func=_commandExport)
+
+    importParser = subparsers.add_parser('import', help='Import an env from an archive created by "export"')
+    importParser.add_argument('archive', metavar='ARCHIVE')
+    importParser.add_argument('parentDirectory', metavar='PARENT_DIR')
+    importParser.add_argument('name', metavar='NAME')
+    importParser.add_argument('--no-compatibility-check', dest='noCompatibilityCheck', action='store_true',
+        help='Import even if the env was built for a different python or platform')
+    importParser.set_defaults(func=_commandImport)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
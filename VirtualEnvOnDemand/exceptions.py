@@ -5,7 +5,7 @@
 
 # vim: ts=4 sw=4 expandtab
 
-__all__ = ('PipInstallFailed', 'VirtualEnvDoesNotExist')
+__all__ = ('PipInstallFailed', 'VirtualEnvDoesNotExist', 'IncompatibleVirtualEnv', 'VenvExecutorWorkerDied', 'SubprocessTimedOut', 'PipInstallTimedOut', 'InvalidRequirement', 'RequirementConflict', 'BuildSlotTimedOut', 'BuildDaemonError')
 
 class PipInstallFailed(Exception):
     '''
@@ -27,7 +27,116 @@ class PipInstallFailed(Exception):
         return 'Failed to install pip modules (ret=%s) using this requirements file: \n"""\n%s\n"""\n\nCheck stdout/stderr logs.' %(str(self.returnCode), str(self.reqFileContents))
 
 
+class PipInstallTimedOut(PipInstallFailed):
+    '''
+        PipInstallTimedOut - Exception raised when pip did not complete within the allowed time, and was killed
+    '''
+
+    def __init__(self, timeout=None, reqFileContents=''):
+        '''
+            @param timeout <float> - The timeout, in seconds, which was exceeded
+            @param reqFileContents <str> - String of requirements file to reproduce error
+        '''
+        self.timeout = timeout
+        PipInstallFailed.__init__(self, None, reqFileContents)
+
+    def _genMsg(self):
+        return 'Timed out after %s seconds installing pip modules using this requirements file: \n"""\n%s\n"""\n' %(str(self.timeout), str(self.reqFileContents))
+
+
 class VirtualEnvDoesNotExist(Exception):
     '''
         VirtualEnvDoesNotExist - Exception raised when an attempt to install into a virtualenv directory that does not exist
     '''
+
+
+class IncompatibleVirtualEnv(Exception):
+    '''
+        IncompatibleVirtualEnv - Exception raised when importing an exported virtualenv which cannot run on this host
+            (different python version, implementation, or platform)
+    '''
+
+
+class VenvExecutorWorkerDied(Exception):
+    '''
+        VenvExecutorWorkerDied - Set as the exception of a VenvExecutor future whose worker process died while running it,
+          or which was pending when every worker had exited. Raised by submit once every worker has exited.
+    '''
+
+
+class SubprocessTimedOut(Exception):
+    '''
+        SubprocessTimedOut - Exception raised when a subprocess does not complete within its timeout. The process (and all its children) have been killed.
+    '''
+
+    def __init__(self, cmd, timeout):
+        self.cmd = cmd
+        self.timeout = timeout
+        Exception.__init__(self, 'Command %s did not complete within %s seconds, and was killed.' %(str(cmd), str(timeout)))
+
+
+class InvalidRequirement(ValueError):
+    '''
+        InvalidRequirement - Exception raised when a requirement is malformed (not valid per PEP 508 / PEP 440)
+    '''
+
+    def __init__(self, requirement, reason):
+        '''
+            @param requirement <str> - The requirement as given
+            @param reason <str> - What is wrong with it
+        '''
+        self.requirement = requirement
+        self.reason = reason
+        ValueError.__init__(self, 'Invalid requirement "%s": %s' %(requirement, reason))
+
+
+class RequirementConflict(ValueError):
+    '''
+        RequirementConflict - Exception raised when requirements of the same distribution cannot all be satisfied (e.x. "foo==1" and "foo==2")
+    '''
+
+    def __init__(self, name, specifiers, reason):
+        '''
+            @param name <str> - The canonical name of the distribution
+            @param specifiers list<str> - The conflicting specifiers (or urls)
+            @param reason <str> - Why they conflict
+        '''
+        self.name = name
+        self.specifiers = list(specifiers)
+        self.reason = reason
+        ValueError.__init__(self, 'Conflicting requirements for "%s" (%s): %s' %(name, ', '.join(self.specifiers), reason))
+
+
+class BuildSlotTimedOut(Exception):
+    '''
+        BuildSlotTimedOut - Exception raised when a build or install could not get a host-wide build slot within the policy's timeout.
+
+            @see VirtualEnvOnDemand.ResourcePolicy.setResourcePolicy
+    '''
+
+    def __init__(self, slots, slotsDirectory, waited):
+        '''
+            @param slots <int> - Number of build slots on the host
+            @param slotsDirectory <str> - Directory holding the slot lock files
+            @param waited <float> - Seconds spent waiting
+        '''
+        self.slots = slots
+        self.slotsDirectory = slotsDirectory
+        self.waited = waited
+        Exception.__init__(self, 'All %d build slots in "%s" remained busy for %.1f seconds.' %(slots, slotsDirectory, waited))
+
+
+class BuildDaemonError(Exception):
+    '''
+        BuildDaemonError - Exception raised when a build sent to the build daemon failed with an error which cannot be re-raised as-is.
+
+            @see VirtualEnvOnDemand.BuildDaemon
+    '''
+
+    def __init__(self, errorType, message):
+        '''
+            @param errorType <str> - Name of the exception raised within the daemon
+            @param message <str> - Its message
+        '''
+        self.errorType = errorType
+        Exception.__init__(self, '%s: %s' %(errorType, message))
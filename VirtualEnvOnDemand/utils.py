@@ -3,9 +3,11 @@
     utils - Some general-purpose utility functions
 '''
 
+import errno
+import os
 import re
 
-__all__ = ('cmp_version', )
+__all__ = ('cmp_version', 'canonicalizeName', 'ensureDirectory')
 
 # Yes, cmp is DA BOMB. What a huge mistake removing it from the language!!
 try:
@@ -146,3 +148,38 @@ def writeStrToFile(filename, contents):
         return e
 
     return None
+
+
+# CANONICALIZE_RE - Runs of characters which are considered equivalent in a distribution name (PEP 503)
+CANONICALIZE_RE = re.compile('[-_.]+')
+
+def canonicalizeName(name):
+    '''
+        canonicalizeName - Get the canonical form of a distribution name, as described by PEP 503.
+
+            i.e. "My_Package", "my.package", and "MY-PACKAGE" all become "my-package"
+
+        @param name <str> - A distribution name
+
+        @return <str> - The canonical form of #name
+    '''
+    return CANONICALIZE_RE.sub('-', name).lower()
+
+
+def ensureDirectory(path):
+    '''
+        ensureDirectory - Create a directory (and any missing parents) if it does not already exist.
+
+            This is safe to call from multiple processes at once.
+
+        @param path <str> - Path to the directory
+
+        @return <str> - #path
+    '''
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+    return path